@@ -0,0 +1,156 @@
+"""
+Requests/sec of IPLoggingMiddleware under uvicorn, sync vs native async.
+
+Usage (needs uvicorn and httpx installed):
+    python -m benchmarks.asgi_middleware [--requests 2000] [--concurrency 100]
+                                         [--geo-latency 0.05] [--distinct-ips 2000]
+                                         [--drop-sync-only-middleware]
+
+A local stub geolocation server answers after --geo-latency seconds, and
+every request comes from a fresh X-Forwarded-For address so each one is a
+geolocation miss. The "sync" run sets IP_TRACKING_ASYNC_MIDDLEWARE=False,
+i.e. Django runs the middleware in its thread pool as it did before.
+
+WhiteNoiseMiddleware is sync-only, so Django adapts the outer part of the
+chain through a thread; --drop-sync-only-middleware removes it to measure
+a fully async chain.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+STUB_BODY = json.dumps({"country": "Stubland", "city": "Benchville"}).encode()
+STUB_RESPONSE = (
+    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+    b"Content-Length: " + str(len(STUB_BODY)).encode() + b"\r\n\r\n" + STUB_BODY
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_stub_geo(port, latency):
+    """Minimal keep-alive HTTP server that answers every GET after `latency` seconds."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                if not request:
+                    break
+                await asyncio.sleep(latency)
+                writer.write(STUB_RESPONSE)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_stub_geo_server(latency):
+    port = free_port()
+    process = multiprocessing.Process(target=serve_stub_geo, args=(port, latency), daemon=True)
+    process.start()
+    wait_for_port(port)
+    return process, port
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def drive(port, total, concurrency, distinct_ips):
+    counter = iter(range(total))
+    statuses = {}
+
+    async def worker(client):
+        for n in counter:
+            index = n % distinct_ips
+            ip = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+            response = await client.get("/health/", headers={"X-Forwarded-For": ip})
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, statuses
+
+
+def run_variant(name, env, args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "core.asgi:application",
+         "--port", str(port), "--log-level", "warning", "--no-access-log",
+         "--timeout-keep-alive", "60"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        wait_for_port(port)
+        elapsed, statuses = asyncio.run(drive(port, args.requests, args.concurrency, args.distinct_ips))
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{name:>5}: {args.requests / elapsed:8.1f} req/s  ({elapsed:.2f}s, status counts {statuses})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--geo-latency", type=float, default=0.05)
+    parser.add_argument("--distinct-ips", type=int, default=2000)
+    parser.add_argument("--drop-sync-only-middleware", action="store_true")
+    args = parser.parse_args()
+
+    geo_server, geo_port = start_stub_geo_server(args.geo_latency)
+    bench_dir = tempfile.mkdtemp(prefix="ip-tracking-bench-")
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE="benchmarks.settings",
+        BENCH_DIR=bench_dir,
+        IP_TRACKING_GEO_HTTP_URL=f"http://127.0.0.1:{geo_port}/json/{{ip}}",
+        IP_TRACKING_LOG_MODE="buffered",
+    )
+    if args.drop_sync_only_middleware:
+        env["BENCH_DROP_SYNC_ONLY_MIDDLEWARE"] = "1"
+    subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"], cwd=ROOT, env=env, check=True)
+
+    for name, async_enabled in (("sync", "False"), ("async", "True")):
+        run_variant(name, dict(env, IP_TRACKING_ASYNC_MIDDLEWARE=async_enabled), args)
+    geo_server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+On-disk size and range-scan time of RequestLog, wide vs compact schema.
+
+Usage:
+    python -m benchmarks.log_storage [--rows 500000] [--ips 20000] [--paths 200] [--locations 300]
+
+Writes the same synthetic traffic (a week of requests) into the compact
+RequestLog table and into a copy of the previous schema (IP and path as
+text, country/city per row, same indexes), VACUUMs, and reports the
+table and index pages from SQLite's dbstat along with the time of a
+few typical range scans on each.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import django
+
+
+def legacy_model():
+    from django.db import models
+
+    class LegacyRequestLog(models.Model):
+        ip_address = models.GenericIPAddressField()
+        timestamp = models.DateTimeField()
+        path = models.CharField(max_length=255)
+        country = models.CharField(max_length=100, blank=True, null=True)
+        city = models.CharField(max_length=100, blank=True, null=True)
+        geo_pending = models.BooleanField(default=False)
+        status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+
+        class Meta:
+            app_label = "ip_tracking"
+            db_table = "bench_legacy_requestlog"
+            indexes = [
+                models.Index(fields=["timestamp"], name="legacy_timestamp_idx"),
+                models.Index(fields=["ip_address", "timestamp"], name="legacy_ip_timestamp_idx"),
+            ]
+
+    return LegacyRequestLog
+
+
+def synthetic_records(rows, ips, paths, locations, start, seed):
+    """Records in logwriter.LOG_FIELD_NAMES order, in timestamp order."""
+    rng = random.Random(seed)
+    ip_pool = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+               for _ in range(ips)]
+    path_pool = [f"/api/v1/resource-{i}/items/" for i in range(paths)]
+    location_pool = [(f"Country {i % 60}", f"City {i}") for i in range(locations)]
+    ip_location = {ip: rng.choice(location_pool) for ip in ip_pool}
+    step = 7 * 24 * 3600 / rows
+    for i in range(rows):
+        ip = ip_pool[min(int(rng.paretovariate(1.2)) - 1, ips - 1)] if i % 2 else rng.choice(ip_pool)
+        country, city = ip_location[ip]
+        yield (
+            ip,
+            rng.choice(path_pool),
+            start + timedelta(seconds=i * step),
+            country,
+            city,
+            False,
+            rng.choice((200, 200, 200, 301, 404, 500)),
+        )
+
+
+def table_bytes(cursor, table):
+    cursor.execute(
+        "SELECT s.name = %s, SUM(s.pgsize) FROM dbstat s "
+        "JOIN sqlite_master m ON m.name = s.name WHERE m.tbl_name = %s GROUP BY s.name = %s",
+        [table, table, table],
+    )
+    sizes = dict(cursor.fetchall())
+    return sizes.get(1, 0), sizes.get(0, 0)
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--ips", type=int, default=20_000)
+    parser.add_argument("--paths", type=int, default=200)
+    parser.add_argument("--locations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["BENCH_DIR"] = tempfile.mkdtemp(prefix="log-storage-")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.db.models import Count
+
+    from ip_tracking.interning import build_request_logs
+    from ip_tracking.iputils import pack_ip
+    from ip_tracking.models import RequestLog
+
+    call_command("migrate", verbosity=0)
+    Legacy = legacy_model()
+    with connection.schema_editor() as editor:
+        editor.create_model(Legacy)
+
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    records = list(synthetic_records(args.rows, args.ips, args.paths, args.locations, start, args.seed))
+    fields = ("ip_address", "path", "timestamp", "country", "city", "geo_pending", "status_code")
+
+    started = time.perf_counter()
+    for offset in range(0, len(records), 5000):
+        Legacy.objects.bulk_create(
+            [Legacy(**dict(zip(fields, record))) for record in records[offset:offset + 5000]], batch_size=500
+        )
+    legacy_write = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for offset in range(0, len(records), 5000):
+        RequestLog.objects.bulk_create(build_request_logs(records[offset:offset + 5000]), batch_size=500)
+    compact_write = time.perf_counter() - started
+
+    with connection.cursor() as cursor:
+        cursor.execute("VACUUM")
+        legacy_size = table_bytes(cursor, Legacy._meta.db_table)
+        compact_size = table_bytes(cursor, RequestLog._meta.db_table)
+
+    print(f"{args.rows:,} rows, {args.ips:,} IPs, {args.paths:,} paths, {args.locations:,} locations")
+    print(f"{'':28}{'legacy':>12}{'compact':>12}{'ratio':>8}")
+    for label, legacy, compact in (
+        ("table MB", legacy_size[0] / 1e6, compact_size[0] / 1e6),
+        ("indexes MB", legacy_size[1] / 1e6, compact_size[1] / 1e6),
+        ("total MB", sum(legacy_size) / 1e6, sum(compact_size) / 1e6),
+        ("write s", legacy_write, compact_write),
+    ):
+        print(f"{label:28}{legacy:12.2f}{compact:12.2f}{legacy / compact:7.2f}x")
+
+    hour = (start + timedelta(days=3), start + timedelta(days=3, hours=1))
+    day = (start + timedelta(days=3), start + timedelta(days=4))
+    heavy_ip = records[1][0]
+    scans = (
+        ("hour: rows per IP", lambda model, ip_field, ip: list(
+            model.objects.filter(timestamp__range=hour).order_by().values(ip_field).annotate(n=Count("id"))
+        )),
+        ("day: status 4xx count", lambda model, ip_field, ip: model.objects.filter(
+            timestamp__range=day, status_code__gte=400, status_code__lt=500
+        ).count()),
+        ("day: one IP's rows", lambda model, ip_field, ip: list(
+            model.objects.filter(**{ip_field: ip}, timestamp__range=day).values_list("timestamp", "status_code")
+        )),
+    )
+    for label, scan in scans:
+        legacy = timed(lambda: scan(Legacy, "ip_address", heavy_ip))
+        compact = timed(lambda: scan(RequestLog, "ip", pack_ip(heavy_ip)))
+        print(f"{label + ' ms':28}{legacy * 1e3:12.2f}{compact * 1e3:12.2f}{legacy / compact:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Per-request cost of the middleware chain by logging and geolocation mode.
+
+Usage:
+    python -m benchmarks.middleware_replay [--requests 5000] [--ips 1000] [--geo-latency 0.0]
+                                           [--driver wsgi] [--trace trace.jsonl]
+
+Replays the same trace (synthetic unless --trace is given) through
+ip_tracking.replay on a throwaway database, once per combination of
+IP_TRACKING_LOG_MODE (sync, buffered) and IP_TRACKING_GEO_MODE (inline,
+deferred), and prints latency percentiles, throughput and queries per
+request side by side. Use it before and after a change to the hot path.
+"""
+import argparse
+import os
+import tempfile
+
+import django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--ips", type=int, default=1000)
+    parser.add_argument("--geo-latency", type=float, default=0.0)
+    parser.add_argument("--driver", default="wsgi", choices=("client", "wsgi"))
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--trace", default=None)
+    args = parser.parse_args()
+
+    os.environ["BENCH_DIR"] = tempfile.mkdtemp(prefix="middleware-replay-")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+    from django.core.management import call_command
+    from django.test import override_settings
+
+    from ip_tracking.management.commands.replay_traffic import DEFAULT_PATH_MIX
+    from ip_tracking.replay import load_trace, parse_path_mix, replay, synthetic_trace
+
+    call_command("migrate", verbosity=0)
+    if args.trace:
+        with open(args.trace, encoding="utf-8") as handle:
+            trace = list(load_trace(handle))
+    else:
+        paths, weights = parse_path_mix(DEFAULT_PATH_MIX)
+        trace = list(synthetic_trace(args.requests + args.warmup, args.ips, paths, weights))
+
+    print(f"{len(trace) - args.warmup} requests ({args.warmup} warm-up) via {args.driver}, "
+          f"stub geo latency {args.geo_latency * 1e3:.0f} ms")
+    print(f"{'log / geo mode':20}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'queries':>9}{'writes':>8}{'geo hit':>9}")
+    for log_mode in ("sync", "buffered"):
+        for geo_mode in ("inline", "deferred"):
+            with override_settings(IP_TRACKING_LOG_MODE=log_mode, IP_TRACKING_GEO_MODE=geo_mode):
+                result = replay(trace, driver=args.driver, warmup=args.warmup, geo_latency=args.geo_latency)
+            latency = result["latency_ms"]
+            geo = result["caches"]["geo_local"]
+            print(f"{log_mode + ' / ' + geo_mode:20}{result['requests_per_second']:9.1f}"
+                  f"{latency['p50']:9.3f}{latency['p95']:9.3f}{latency['p99']:9.3f}"
+                  f"{result['queries_per_request']:9.2f}{result['writes_per_request']:8.2f}"
+                  f"{geo['hit_ratio']:9.1%}")
+
+
+if __name__ == "__main__":
+    main()
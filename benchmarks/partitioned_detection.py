@@ -0,0 +1,112 @@
+"""
+Scaling of the partitioned detector pipeline across a process pool.
+
+Usage:
+    python -m benchmarks.partitioned_detection [--rows 1000000] [--ips 50000] [--partitions 1,2,4,8]
+
+Writes a synthetic hour of traffic into a throwaway SQLite database,
+then times detection end to end the way detect_window runs it: load
+the window with WindowBatch.from_queryset(), run the detector registry
+in one process, or split into N IP-hash shards on a process pool, and
+check that every run returns the same findings. The load is one query
+in every run, so it caps the speedup of the "process" executor (the
+"celery" executor splits it across tasks instead). Speedup is also
+bounded by os.cpu_count(); the pool's start-up and the pickling of each
+shard are included in the timings.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import django
+
+
+def write_window(np, rows, ips, paths, seed, end):
+    """Insert `rows` RequestLog rows spread over the hour before `end`."""
+    from ip_tracking.interning import get_path_interner
+    from ip_tracking.iputils import pack_ip
+    from ip_tracking.models import RequestLog
+
+    rng = np.random.default_rng(seed)
+    # Zipf-like skew so a few IPs are heavy and most are light.
+    ip_ids = (rng.zipf(1.3, rows) - 1) % ips
+    path_ids = rng.integers(0, paths, rows)
+    timestamps = end.timestamp() - rng.uniform(0, 3600, rows)
+    status = rng.choice(np.array([200, 200, 200, 301, 404, 403, 500]), rows)
+
+    ip_pool = [pack_ip(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}") for i in range(ips)]
+    path_pool = [f"/p/{i}" if i % 50 else "/admin/login/" for i in range(paths)]
+    interned = get_path_interner().ids(set(path_pool))
+    path_pool = [interned[path] for path in path_pool]
+    for offset in range(0, rows, 10000):
+        RequestLog.objects.bulk_create(
+            [
+                RequestLog(
+                    ip=ip_pool[ip_id],
+                    timestamp=datetime.fromtimestamp(timestamp, tz=timezone.utc),
+                    path_id=path_pool[path_id],
+                    status_code=int(status_code),
+                )
+                for ip_id, path_id, timestamp, status_code in zip(
+                    ip_ids[offset:offset + 10000].tolist(),
+                    path_ids[offset:offset + 10000].tolist(),
+                    timestamps[offset:offset + 10000].tolist(),
+                    status[offset:offset + 10000].tolist(),
+                )
+            ],
+            batch_size=1000,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--ips", type=int, default=50_000)
+    parser.add_argument("--paths", type=int, default=2_000)
+    parser.add_argument("--partitions", default="1,2,4,8")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ["BENCH_DIR"] = tempfile.mkdtemp(prefix="partitioned-detection-")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+    import numpy as np
+    from django.core.management import call_command
+
+    from ip_tracking.detectors import WindowBatch, run_detectors, run_partitioned
+    from ip_tracking.models import RequestLog
+
+    call_command("migrate", verbosity=0)
+    now = datetime.fromtimestamp(1_700_003_600, tz=timezone.utc)
+    write_window(np, args.rows, args.ips, args.paths, args.seed, now)
+    window = RequestLog.objects.filter(timestamp__gte=now - timedelta(hours=1))
+
+    def detect(partitions=None):
+        started = time.perf_counter()
+        batch = WindowBatch.from_queryset(window)
+        loaded = time.perf_counter()
+        if partitions is None:
+            findings = run_detectors(batch, now)
+        else:
+            findings = run_partitioned(batch, now, partitions, max_workers=partitions)
+        return batch, findings, loaded - started, time.perf_counter() - loaded
+
+    batch, baseline, load, run = detect()
+    serial = load + run
+    print(f"{len(batch):,} rows, {len(batch.ips):,} IPs, {os.cpu_count()} CPUs")
+    print(f"{'':22}{'load s':>8}{'detect s':>10}{'total s':>9}")
+    print(f"{'in-process':22}{load:8.2f}{run:10.2f}{serial:9.2f}  {len(baseline):,} findings")
+
+    for partitions in (int(p) for p in args.partitions.split(",")):
+        _batch, findings, load, run = detect(partitions)
+        print(
+            f"{f'{partitions} partitions/workers':22}{load:8.2f}{run:10.2f}{load + run:9.2f}  "
+            f"speedup {serial / (load + run):5.2f}x  identical {findings == baseline}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Lookup cost of the blocklist prefix table as the number of prefixes grows.
+
+Usage:
+    python -m benchmarks.radix_lookup [--sizes 10,1000,100000,1000000] [--lookups 200000]
+
+A probe is one bisect over a short slice of the flattened ranges, so it
+makes about the same number of comparisons at any size; what growth is
+left at a million prefixes is memory latency once the table no longer
+fits in the CPU caches. Build time covers inserting and the range build
+that the first lookup triggers.
+"""
+import argparse
+import random
+import time
+
+from ip_tracking.radix import PrefixTable
+
+
+def random_prefixes(rng, count, width, min_length, max_length):
+    for _ in range(count):
+        length = rng.randint(min_length, max_length)
+        key = rng.getrandbits(width) >> (width - length) << (width - length)
+        yield key, length
+
+
+def bench(width, min_length, max_length, sizes, lookups, seed):
+    rng = random.Random(seed)
+    probes = [rng.getrandbits(width) for _ in range(lookups)]
+    for size in sizes:
+        table = PrefixTable(width)
+        started = time.perf_counter()
+        for key, length in random_prefixes(rng, size, width, min_length, max_length):
+            table.insert(key, length)
+        table.longest_match(0)
+        build = time.perf_counter() - started
+
+        match = table.longest_match
+        started = time.perf_counter()
+        hits = 0
+        for probe in probes:
+            if match(probe) is not None:
+                hits += 1
+        elapsed = time.perf_counter() - started
+        print(
+            f"IPv{4 if width == 32 else 6} {size:>9,} prefixes  "
+            f"build {build:7.2f}s  "
+            f"lookup {elapsed / lookups * 1e9:7.0f} ns  "
+            f"hit rate {hits / lookups:6.1%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,1000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    bench(32, 8, 32, sizes, args.lookups, args.seed)
+    bench(128, 32, 64, sizes, args.lookups, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Per-check overhead of the built-in rate limiter.
+
+Usage:
+    python -m benchmarks.ratelimit_check [--checks 200000] [--keys 1000]
+
+Measures RateLimiter.check() (key extraction + counter update) for the
+in-process token bucket and sliding-window log, and for the cache-backed
+sliding-window counter on LocMemCache. A networked cache (Redis,
+Memcached) adds its round-trip time on top of the cache figure.
+"""
+import argparse
+import os
+import time
+
+import django
+
+
+def bench(label, limiter, requests, checks):
+    started = time.perf_counter()
+    allowed = 0
+    for i in range(checks):
+        if limiter.check(requests[i % len(requests)]).allowed:
+            allowed += 1
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {elapsed / checks * 1e6:6.2f} us/check  allowed {allowed / checks:6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checks", type=int, default=200_000)
+    parser.add_argument("--keys", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    django.setup()
+
+    from django.test import RequestFactory
+
+    from ip_tracking.ratelimit import (
+        SLIDING_LOG,
+        SLIDING_WINDOW,
+        TOKEN_BUCKET,
+        CacheStore,
+        LocalStore,
+        RateLimiter,
+    )
+
+    factory = RequestFactory()
+    requests = [
+        factory.post("/login/", REMOTE_ADDR=f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}")
+        for i in range(args.keys)
+    ]
+
+    bench("local token_bucket", RateLimiter("100/s", algorithm=TOKEN_BUCKET, store=LocalStore()), requests, args.checks)
+    bench("local sliding_log", RateLimiter("100/s", algorithm=SLIDING_LOG, store=LocalStore()), requests, args.checks)
+    bench("cache sliding_window", RateLimiter("100/s", algorithm=SLIDING_WINDOW, store=CacheStore()), requests, args.checks)
+
+
+if __name__ == "__main__":
+    main()
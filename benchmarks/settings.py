@@ -0,0 +1,28 @@
+"""
+Settings for benchmark runs: the project settings with a throwaway
+SQLite database and an in-memory cache, so benchmarks never touch
+db.sqlite3 or the shared cache directory.
+"""
+import os
+import tempfile
+
+from core.settings import *  # noqa: F401,F403
+
+BENCH_DIR = os.environ.get("BENCH_DIR") or tempfile.gettempdir()
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCH_DIR, 'bench.sqlite3'),
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Used by benchmarks.asgi_middleware to measure a fully async chain.
+if os.environ.get("BENCH_DROP_SYNC_ONLY_MIDDLEWARE"):
+    MIDDLEWARE = [m for m in MIDDLEWARE if m != 'whitenoise.middleware.WhiteNoiseMiddleware']
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -66,9 +66,19 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'core.urls'
 
-# Rate limiting configuration
-RATELIMIT_ENABLE = False  # Disable for development without Redis
-RATELIMIT_VIEW = "django_ratelimit.exceptions.Ratelimited"  # optional custom handler
+# Rate limiting configuration (ip_tracking.ratelimit)
+RATELIMIT_ENABLE = config('RATELIMIT_ENABLE', default=True, cast=bool)
+# "local" keeps counters in-process (single node, no Redis needed);
+# "cache" shares them through CACHES[IP_TRACKING_RATELIMIT_CACHE] with atomic incr
+IP_TRACKING_RATELIMIT_STORE = config('IP_TRACKING_RATELIMIT_STORE', default='local')
+IP_TRACKING_RATELIMIT_CACHE = 'default'
+# Path-prefix limits applied by ip_tracking.ratelimit.RateLimitMiddleware (if installed)
+IP_TRACKING_RATE_LIMITS = []
+# Reverse proxies (addresses or CIDRs) whose X-Forwarded-For is believed for
+# the client IP the middleware blocks, logs and rate-limits; otherwise that is
+# REMOTE_ADDR. Behind a load balancer, list its addresses here or every client
+# shares its address.
+IP_TRACKING_TRUSTED_PROXIES = config('IP_TRACKING_TRUSTED_PROXIES', default='', cast=Csv())
 
 
 TEMPLATES = [
@@ -102,7 +112,24 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULE = {
     "detect_anomalies_hourly": {
         "task": "ip_tracking.tasks.detect_anomalies",
-        "schedule": 3600.0,  # 1 hour
+        # 1 hour; with IP_TRACKING_DETECTION_MODE=incremental run it every minute
+        "schedule": config('IP_TRACKING_DETECTION_INTERVAL', default=3600.0, cast=float),
+    },
+    "escalate_suspicious_ips": {
+        "task": "ip_tracking.tasks.escalate_suspicious_ips",
+        "schedule": 60.0,  # also sweeps expired blocks
+    },
+    "purge_old_request_logs": {
+        "task": "ip_tracking.tasks.purge_old_request_logs",
+        "schedule": 24 * 60 * 60.0,  # daily
+    },
+    "rollup_traffic": {
+        "task": "ip_tracking.tasks.rollup_traffic",
+        "schedule": 60.0,
+    },
+    "enrich_request_logs": {
+        "task": "ip_tracking.tasks.enrich_request_logs",
+        "schedule": 60.0,  # only does work in deferred geo mode
     },
 }
 
@@ -130,6 +157,151 @@ CACHES = {
 # Geolocation API configuration
 IPGEOLOCATION_API_KEY = config('IPGEOLOCATION_API_KEY', default='your-api-key')
 
+# Geolocation backends, tried in order. Local backends (RangeFileBackend)
+# answer in-process; remote ones (IPAPIBackend) are cached for
+# IP_TRACKING_GEO_CACHE_TIMEOUT seconds. Example for offline lookups with
+# HTTP fallback:
+#   IP_TRACKING_GEO_BACKENDS=ip_tracking.geo.RangeFileBackend,ip_tracking.geo.IPAPIBackend
+# "inline" resolves geolocation in the middleware; "deferred" logs rows
+# without it and lets the enrich_request_logs task fill them in bulk
+IP_TRACKING_GEO_MODE = config('IP_TRACKING_GEO_MODE', default='inline')
+IP_TRACKING_GEO_ENRICH_BATCH_SIZE = config('IP_TRACKING_GEO_ENRICH_BATCH_SIZE', default=1000, cast=int)
+IP_TRACKING_GEO_BACKENDS = config('IP_TRACKING_GEO_BACKENDS', default='ip_tracking.geo.IPAPIBackend', cast=Csv())
+# CSV of "start_ip,end_ip,country,city" rows used by RangeFileBackend
+IP_TRACKING_GEO_DATABASE = config('IP_TRACKING_GEO_DATABASE', default='')
+IP_TRACKING_GEO_CACHE_TIMEOUT = config('IP_TRACKING_GEO_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)
+# Failed lookups are cached briefly; expired successes are served stale
+# for up to STALE_TIMEOUT seconds while one background refresh runs
+IP_TRACKING_GEO_NEGATIVE_CACHE_TIMEOUT = config('IP_TRACKING_GEO_NEGATIVE_CACHE_TIMEOUT', default=300, cast=int)
+IP_TRACKING_GEO_STALE_TIMEOUT = config('IP_TRACKING_GEO_STALE_TIMEOUT', default=60 * 60, cast=int)
+# In-process LRU in front of the shared cache (entries, seconds, optional byte budget)
+IP_TRACKING_GEO_LOCAL_CACHE_SIZE = config('IP_TRACKING_GEO_LOCAL_CACHE_SIZE', default=10000, cast=int)
+IP_TRACKING_GEO_LOCAL_CACHE_TTL = config('IP_TRACKING_GEO_LOCAL_CACHE_TTL', default=60, cast=float)
+IP_TRACKING_GEO_LOCAL_CACHE_MAX_BYTES = config('IP_TRACKING_GEO_LOCAL_CACHE_MAX_BYTES', default=0, cast=int)
+# Stop calling the provider after THRESHOLD consecutive failures, retry after RESET_TIMEOUT seconds
+IP_TRACKING_GEO_BREAKER_THRESHOLD = config('IP_TRACKING_GEO_BREAKER_THRESHOLD', default=5, cast=int)
+IP_TRACKING_GEO_BREAKER_RESET_TIMEOUT = config('IP_TRACKING_GEO_BREAKER_RESET_TIMEOUT', default=30, cast=float)
+IP_TRACKING_GEO_HTTP_URL = config('IP_TRACKING_GEO_HTTP_URL', default='http://ip-api.com/json/{ip}')
+IP_TRACKING_GEO_HTTP_BATCH_URL = config('IP_TRACKING_GEO_HTTP_BATCH_URL', default='http://ip-api.com/batch?fields=status,country,city,query')
+IP_TRACKING_GEO_HTTP_TIMEOUT = config('IP_TRACKING_GEO_HTTP_TIMEOUT', default=5, cast=float)
+
+# IP tracking configuration
+# Max seconds before a worker notices a blocklist change made elsewhere
+IP_TRACKING_BLOCKLIST_REFRESH_SECONDS = config('IP_TRACKING_BLOCKLIST_REFRESH_SECONDS', default=5, cast=float)
+# "full" checks every IP seen in the trailing hour, "incremental" only IPs with
+# new traffic; both read the per-minute rollups (see ip_tracking/rollups.py);
+# "pipeline" loads the hour into NumPy arrays once and runs IP_TRACKING_DETECTORS
+IP_TRACKING_DETECTION_MODE = config('IP_TRACKING_DETECTION_MODE', default='full')
+IP_TRACKING_DETECTION_SETTLE_SECONDS = config('IP_TRACKING_DETECTION_SETTLE_SECONDS', default=5, cast=float)
+# Detectors used by the "pipeline" mode (see ip_tracking/detectors.py)
+IP_TRACKING_DETECTORS = [
+    'ip_tracking.detectors.RateDetector',
+    'ip_tracking.detectors.SensitivePathDetector',
+    'ip_tracking.detectors.RegularIntervalDetector',
+    'ip_tracking.detectors.PathFanoutDetector',
+    'ip_tracking.detectors.ErrorRatioDetector',
+]
+# Path prefixes that flag an IP; each also covers everything below it
+IP_TRACKING_SENSITIVE_PATHS = ['/admin', '/login']
+# Split the pipeline into IP shards: "process" runs them in a local process
+# pool, "celery" as a chord of detect_partition tasks over IP ranges. Celery
+# prefork workers cannot start a process pool, so there "process" means "celery"
+IP_TRACKING_DETECTION_PARTITIONS = config('IP_TRACKING_DETECTION_PARTITIONS', default=1, cast=int)
+IP_TRACKING_DETECTION_EXECUTOR = config('IP_TRACKING_DETECTION_EXECUTOR', default='process')
+IP_TRACKING_DETECT_RATE_THRESHOLD = config('IP_TRACKING_DETECT_RATE_THRESHOLD', default=100, cast=int)
+IP_TRACKING_DETECT_INTERVAL_MIN_REQUESTS = 20
+IP_TRACKING_DETECT_INTERVAL_MAX_CV = 0.1
+IP_TRACKING_DETECT_FANOUT_THRESHOLD = 50
+IP_TRACKING_DETECT_ERROR_MIN_REQUESTS = 20
+IP_TRACKING_DETECT_ERROR_RATIO = 0.5
+# Flag IPs in the middleware as soon as they pass THRESHOLD requests per
+# WINDOW seconds. Counts live in a count-min sketch of SLICES x DEPTH x WIDTH
+# 32-bit counters (~3 MB by default); overcounting is at most about
+# 2.7 / WIDTH of the requests seen in the window. With SKETCH_FILE (on local
+# disk) every gunicorn worker maps and counts into that one sketch; without
+# it each worker has its own, so behind N workers an IP may need up to about
+# N x THRESHOLD requests to be flagged
+IP_TRACKING_REALTIME_DETECTION = config('IP_TRACKING_REALTIME_DETECTION', default=True, cast=bool)
+IP_TRACKING_REALTIME_THRESHOLD = config('IP_TRACKING_REALTIME_THRESHOLD', default=100, cast=int)
+IP_TRACKING_REALTIME_WINDOW = config('IP_TRACKING_REALTIME_WINDOW', default=3600, cast=int)
+IP_TRACKING_REALTIME_SLICES = config('IP_TRACKING_REALTIME_SLICES', default=6, cast=int)
+IP_TRACKING_REALTIME_SKETCH_WIDTH = config('IP_TRACKING_REALTIME_SKETCH_WIDTH', default=2 ** 15, cast=int)
+IP_TRACKING_REALTIME_SKETCH_DEPTH = config('IP_TRACKING_REALTIME_SKETCH_DEPTH', default=4, cast=int)
+IP_TRACKING_REALTIME_SKETCH_FILE = config('IP_TRACKING_REALTIME_SKETCH_FILE', default='')
+# Promote SuspiciousIP findings to expiring BlockedIP entries (ttl in seconds,
+# None = permanent); see ip_tracking/escalation.py for the policy keys.
+# Policies without a "rule" also count sensitive_path findings, which a single
+# request raises. Off by default: enable it only once IP_TRACKING_TRUSTED_PROXIES
+# lists every proxy in front of the app, or findings (and blocks) land on the
+# proxy's address
+IP_TRACKING_ESCALATION_ENABLED = config('IP_TRACKING_ESCALATION_ENABLED', default=False, cast=bool)
+IP_TRACKING_ESCALATION_POLICIES = [
+    {"name": "severe-rate", "rule": "rate", "min_hits": 1000, "ttl": 24 * 60 * 60},
+    {"name": "repeat-offender", "rule": "rate", "min_findings": 3, "within": 24 * 60 * 60, "ttl": 60 * 60},
+]
+# "sync" writes one RequestLog row per request; "buffered" batches them
+# on a background thread (flushed every BATCH_SIZE rows or FLUSH_INTERVAL seconds)
+IP_TRACKING_LOG_MODE = config('IP_TRACKING_LOG_MODE', default='sync')
+IP_TRACKING_LOG_BATCH_SIZE = config('IP_TRACKING_LOG_BATCH_SIZE', default=500, cast=int)
+IP_TRACKING_LOG_FLUSH_INTERVAL = config('IP_TRACKING_LOG_FLUSH_INTERVAL', default=0.25, cast=float)
+IP_TRACKING_LOG_QUEUE_SIZE = config('IP_TRACKING_LOG_QUEUE_SIZE', default=10000, cast=int)
+IP_TRACKING_LOG_OVERFLOW = config('IP_TRACKING_LOG_OVERFLOW', default='drop_oldest')  # or "block"
+# Upper bound on how long a suspicious-ips page stays cached; entries are
+# also keyed on the findings and blocklist versions, so writes invalidate them
+IP_TRACKING_SUSPICIOUS_IPS_CACHE_SECONDS = config('IP_TRACKING_SUSPICIOUS_IPS_CACHE_SECONDS', default=60, cast=int)
+# Per-process cache of interned RequestLog paths and locations (entries each,
+# expiring after TTL seconds; keep it well under a day, the shortest log
+# retention, since unreferenced paths/locations are pruned with old logs)
+IP_TRACKING_INTERN_CACHE_SIZE = config('IP_TRACKING_INTERN_CACHE_SIZE', default=10000, cast=int)
+IP_TRACKING_INTERN_CACHE_TTL = config('IP_TRACKING_INTERN_CACHE_TTL', default=3600, cast=int)
+# Distinct paths stored at most; new paths past it are logged as "<other>"
+IP_TRACKING_INTERN_MAX_PATHS = config('IP_TRACKING_INTERN_MAX_PATHS', default=50000, cast=int)
+# Traffic rollups: ids folded in per run, and how long each granularity is kept
+IP_TRACKING_ROLLUP_BATCH_SIZE = config('IP_TRACKING_ROLLUP_BATCH_SIZE', default=100000, cast=int)
+IP_TRACKING_MINUTE_ROLLUP_RETENTION_DAYS = config('IP_TRACKING_MINUTE_ROLLUP_RETENTION_DAYS', default=2, cast=int)
+IP_TRACKING_HOUR_ROLLUP_RETENTION_DAYS = config('IP_TRACKING_HOUR_ROLLUP_RETENTION_DAYS', default=90, cast=int)
+# Delete RequestLog rows older than RETENTION_DAYS (0 keeps them forever),
+# CHUNK_SIZE ids per DELETE with PAUSE seconds between chunks
+IP_TRACKING_LOG_RETENTION_DAYS = config('IP_TRACKING_LOG_RETENTION_DAYS', default=30, cast=int)
+IP_TRACKING_LOG_RETENTION_CHUNK_SIZE = config('IP_TRACKING_LOG_RETENTION_CHUNK_SIZE', default=10000, cast=int)
+IP_TRACKING_LOG_RETENTION_PAUSE = config('IP_TRACKING_LOG_RETENTION_PAUSE', default=0.05, cast=float)
+# Metrics served at /metrics. With a directory, every process (gunicorn and
+# Celery workers) maps its counters onto a file there and /metrics sums them
+# all; empty keeps them per process. Clear the directory on each deploy.
+IP_TRACKING_METRICS_DIR = config('IP_TRACKING_METRICS_DIR', default='')
+# /metrics answers requests with `Authorization: Bearer <TOKEN>`, from staff
+# users, or from clients in ALLOWED_IPS (addresses or CIDRs, resolved through
+# IP_TRACKING_TRUSTED_PROXIES like rate limits); any other request is refused
+# unless PUBLIC is set
+IP_TRACKING_METRICS_TOKEN = config('IP_TRACKING_METRICS_TOKEN', default='')
+IP_TRACKING_METRICS_ALLOWED_IPS = config('IP_TRACKING_METRICS_ALLOWED_IPS', default='', cast=Csv())
+IP_TRACKING_METRICS_PUBLIC = config('IP_TRACKING_METRICS_PUBLIC', default=False, cast=bool)
+# /api/v1/request-logs/?export=ndjson|csv streams client IPs: only staff users
+# and requests with `Authorization: Bearer <TOKEN>` may use it, and it stops
+# after MAX_ROWS rows (narrow it with since/until to export more)
+IP_TRACKING_LOG_EXPORT_TOKEN = config('IP_TRACKING_LOG_EXPORT_TOKEN', default='')
+IP_TRACKING_LOG_EXPORT_MAX_ROWS = config('IP_TRACKING_LOG_EXPORT_MAX_ROWS', default=100000, cast=int)
+# Which paths to log. Prefix rules match longest-first; regex rules apply when
+# no prefix matches. sample_rate 0 skips logging and geolocation (the
+# blocklist still applies), geolocate=False logs without a geo lookup.
+# Skipped requests never reach RequestLog, so the rollups and the hourly
+# detection built on them do not count them (only the realtime tracker sees
+# every request): traffic to /static/ is invisible there and /health/ is
+# undercounted 100x. Drop a rule if that path's volume should be detected.
+IP_TRACKING_DEFAULT_SAMPLE_RATE = config('IP_TRACKING_DEFAULT_SAMPLE_RATE', default=1.0, cast=float)
+IP_TRACKING_PATH_RULES = [
+    {"prefix": "/health/", "sample_rate": 0.01},
+    {"prefix": "/static/", "sample_rate": 0},
+    {"prefix": "/media/", "sample_rate": 0},
+    {"prefix": "/favicon.ico", "sample_rate": 0},
+    {"prefix": "/metrics", "sample_rate": 0},
+    {"regex": r"^/(swagger|redoc)(/|\.json$|\.yaml$)", "sample_rate": 0},
+    {"prefix": "/login/", "sample_rate": 1.0},
+    {"prefix": "/admin/", "sample_rate": 1.0},
+]
+# Handle requests natively on the event loop under ASGI (False = run in a thread)
+IP_TRACKING_ASYNC_MIDDLEWARE = config('IP_TRACKING_ASYNC_MIDDLEWARE', default=True, cast=bool)
+
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
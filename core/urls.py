@@ -20,7 +20,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
 from django.shortcuts import redirect
-from ip_tracking.views import login_view
+from ip_tracking.views import login_view, metrics_view
 
 # Swagger imports
 from rest_framework import permissions
@@ -37,6 +37,7 @@ def api_root(request):
         'version': 'v1',
         'endpoints': {
             'health': '/health/',
+            'metrics': '/metrics',
             'swagger_docs': '/swagger/',
             'redoc_docs': '/redoc/',
             'admin': '/admin/',
@@ -49,6 +50,7 @@ def api_root(request):
             'test_email': '/api/v1/test-email/',
             'suspicious_ips': '/api/v1/suspicious-ips/',
             'request_logs': '/api/v1/request-logs/',
+            'traffic_summary': '/api/v1/traffic-summary/',
         }
     })
 
@@ -75,8 +77,9 @@ schema_view = get_schema_view(
         ## Available Endpoints
         - `/health/` - Health check endpoint
         - `/api/v1/login/` - User authentication
-        - `/api/v1/suspicious-ips/` - View suspicious IP addresses
-        - `/api/v1/request-logs/` - View request logs
+        - `/api/v1/suspicious-ips/` - Suspicious IPs with blocked status (cursor pages, rule/time filters, ETag)
+        - `/api/v1/request-logs/` - Page through (cursor), filter or export (NDJSON/CSV) request logs
+        - `/api/v1/traffic-summary/` - Top IPs, countries or paths from traffic rollups
         - `/api/v1/test-tasks/` - Test background tasks
         - `/api/v1/test-email/` - Test email functionality
         """,
@@ -97,6 +100,7 @@ urlpatterns = [
     
     path('admin/', admin.site.urls),
     path('health/', health_check, name='health-check'),
+    path('metrics', metrics_view, name='metrics'),
     path('login/', login_view, name='login'),
     
     # API Documentation
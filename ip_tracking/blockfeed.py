@@ -0,0 +1,200 @@
+"""
+Bulk blocklist operations for address/CIDR feeds (see the block_ip command).
+
+Feeds are read line by line: blank lines and "#" / ";" comments are
+skipped, and only the first comma/whitespace-separated field of a line
+is used, so plain lists and most CSV exports work as-is. Entries are
+normalized through ipaddress: single addresses (/32, /128) become
+BlockedIP rows, wider prefixes BlockedNetwork rows with host bits
+cleared.
+
+Feeds are consumed as a stream and written in chunks, each in its own
+transaction, with bulk_create / chunked deletes (only sync_blocks holds
+the whole feed, to diff it). Everything runs inside blocklist_batch(),
+so workers reload their snapshot once at the end rather than once per
+entry.
+"""
+import ipaddress
+
+from django.db import transaction
+
+from .blocklist import active_blocks, blocklist_batch, blocklist_changed, later_expiry
+
+_MAX_INVALID_KEPT = 20
+
+
+def normalize_entry(value):
+    """("ip", address) or ("network", cidr) for one entry; raises ValueError."""
+    network = ipaddress.ip_network(value, strict=False)
+    if network.num_addresses == 1:
+        return "ip", str(network.network_address)
+    return "network", str(network)
+
+
+def parse_entries(lines):
+    """
+    Yield ("ip" | "network" | "invalid", value) for each entry in `lines`
+    (any iterable of strings, e.g. an open file).
+    """
+    for line in lines:
+        line = line.split("#", 1)[0].split(";", 1)[0].strip()
+        if not line:
+            continue
+        value = line.replace(",", " ").split(None, 1)[0]
+        try:
+            yield normalize_entry(value)
+        except ValueError:
+            yield "invalid", value
+
+
+class FeedReader:
+    """
+    Iterates the valid (kind, value) entries of a feed, counting the
+    lines that failed to parse (the first few are kept in `invalid`).
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.invalid_count = 0
+        self.invalid = []
+
+    def __iter__(self):
+        for kind, value in parse_entries(self.lines):
+            if kind != "invalid":
+                yield kind, value
+                continue
+            self.invalid_count += 1
+            if len(self.invalid) < _MAX_INVALID_KEPT:
+                self.invalid.append(value)
+
+
+def _chunks(entries, size):
+    """Yield (kind, [unique values]) batches of up to `size` from a stream of entries."""
+    pending = {"ip": {}, "network": {}}
+    for kind, value in entries:
+        batch = pending[kind]
+        batch[value] = None
+        if len(batch) >= size:
+            yield kind, list(batch)
+            batch.clear()
+    for kind, batch in pending.items():
+        if batch:
+            yield kind, list(batch)
+
+
+def _models():
+    from .models import BlockedIP, BlockedNetwork
+
+    return {"ip": (BlockedIP, "ip_address"), "network": (BlockedNetwork, "network")}
+
+
+def _existing(model, field, values):
+    """{value: (expires_at, reason)} of the rows already blocking `values`."""
+    rows = model.objects.filter(**{f"{field}__in": values}).values_list(field, "expires_at", "reason")
+    return {value: (expires_at, reason) for value, expires_at, reason in rows}
+
+
+def _renews(row, expires_at, reason, retag):
+    """Whether an existing (expires_at, reason) row should take these."""
+    current_expiry, current_reason = row
+    if (current_expiry, current_reason) == (expires_at, reason):
+        return False
+    if current_reason != reason and not retag:
+        return False
+    # Never shorten a block, whoever asks.
+    return later_expiry(current_expiry, expires_at) == expires_at
+
+
+def import_blocks(entries, expires_at=None, reason="", chunk_size=5000, dry_run=False, retag=False):
+    """
+    Block every entry of `entries` ((kind, value) pairs, read lazily)
+    with `expires_at` and `reason`. Entries not blocked yet are created.
+    Existing rows with the same reason are renewed when that lengthens
+    them (an expiring or expired feed entry), with one UPDATE per chunk;
+    a block is never shortened. Rows blocked for another reason (a manual
+    block, an escalation) are left alone unless `retag`, which the block_ip
+    command passes for a single entry so that blocking an address by hand
+    takes over, and lengthens, an escalated block. Returns {"created",
+    "updated", "existing"}, where "existing" counts rows left as they were.
+    """
+    models = _models()
+    created = updated = existing = 0
+    with blocklist_batch():
+        for kind, chunk in _chunks(entries, chunk_size):
+            model, field = models[kind]
+            with transaction.atomic():
+                present = _existing(model, field, chunk)
+                new = [value for value in chunk if value not in present]
+                differing = [value for value, row in present.items() if _renews(row, expires_at, reason, retag)]
+                if not dry_run:
+                    model.objects.bulk_create(
+                        [model(**{field: value}, expires_at=expires_at, reason=reason) for value in new],
+                        batch_size=1000,
+                        ignore_conflicts=True,
+                    )
+                    if differing:
+                        model.objects.filter(**{f"{field}__in": differing}).update(
+                            expires_at=expires_at, reason=reason
+                        )
+            created += len(new)
+            updated += len(differing)
+            existing += len(present) - len(differing)
+        if (created or updated) and not dry_run:
+            blocklist_changed()
+    return {"created": created, "updated": updated, "existing": existing}
+
+
+def unblock(entries, chunk_size=5000, dry_run=False, reason=None):
+    """
+    Remove the blocks for every entry (only those with `reason`, if
+    given). Returns {"removed"}.
+    """
+    models = _models()
+    removed = 0
+    with blocklist_batch():
+        for kind, chunk in _chunks(entries, chunk_size):
+            model, field = models[kind]
+            matching = model.objects.filter(**{f"{field}__in": chunk})
+            if reason is not None:
+                matching = matching.filter(reason=reason)
+            with transaction.atomic():
+                removed += matching.count() if dry_run else matching.delete()[0]
+    return {"removed": removed}
+
+
+def sync_blocks(entries, reason, expires_at=None, chunk_size=5000, dry_run=False):
+    """
+    Make the blocks tagged `reason` match the feed exactly: add what is
+    missing (and renew listed ones, see import_blocks) and remove tagged
+    blocks the feed no longer lists. Blocks with any other reason are
+    never touched, whether the feed lists them or not. The feed is held in memory to compute the difference.
+    Returns {"created", "updated", "existing", "removed"}.
+    """
+    wanted = {"ip": set(), "network": set()}
+    for kind, value in entries:
+        wanted[kind].add(value)
+
+    stale = []
+    for kind, (model, field) in _models().items():
+        for value in model.objects.filter(reason=reason).values_list(field, flat=True).iterator():
+            if value not in wanted[kind]:
+                stale.append((kind, value))
+
+    feed = ((kind, value) for kind, values in wanted.items() for value in values)
+    with blocklist_batch():
+        result = import_blocks(feed, expires_at, reason, chunk_size, dry_run)
+        result.update(unblock(stale, chunk_size, dry_run, reason=reason))
+    return result
+
+
+def export_blocks(out, include_expired=False):
+    """Write one entry per line to `out` (addresses, then networks); returns the count."""
+    written = 0
+    for model, field in _models().values():
+        rows = model.objects.order_by(field)
+        if not include_expired:
+            rows = rows.filter(active_blocks())
+        for value in rows.values_list(field, flat=True).iterator(chunk_size=5000):
+            out.write(f"{value}\n")
+            written += 1
+    return written
@@ -0,0 +1,180 @@
+import ipaddress
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .radix import NetworkMatcher
+
+BLOCKLIST_VERSION_KEY = "ip_tracking:blocklist_version"
+
+
+def bump_blocklist_version():
+    """
+    Publish a new blocklist version so every worker reloads its snapshot.
+
+    Called from the BlockedIP save/delete signals. Bulk writes
+    (bulk_create, queryset.update) bypass signals and must call this
+    themselves once they are done, or run inside blocklist_batch().
+
+    Inside a transaction the bump waits for the commit (and is dropped
+    on rollback): a worker reloading on the new version must already
+    see the rows, or it would keep the old snapshot until the next bump.
+    """
+    transaction.on_commit(_publish_blocklist_version)
+
+
+def _publish_blocklist_version():
+    cache.set(BLOCKLIST_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+_batch_state = threading.local()
+
+
+def blocklist_batch_active():
+    return getattr(_batch_state, "depth", 0) > 0
+
+
+@contextmanager
+def blocklist_batch():
+    """
+    Group many blocklist writes into one version bump.
+
+    Inside the block, the save/delete signal handlers skip their
+    per-row bump; a single bump is published on exit (if anything was
+    written).
+    """
+    _batch_state.depth = getattr(_batch_state, "depth", 0) + 1
+    _batch_state.dirty = getattr(_batch_state, "dirty", False)
+    try:
+        yield
+    finally:
+        _batch_state.depth -= 1
+        if _batch_state.depth == 0 and _batch_state.dirty:
+            _batch_state.dirty = False
+            bump_blocklist_version()
+
+
+def blocklist_changed():
+    """Bump the version now, or once at the end of the current blocklist_batch()."""
+    if blocklist_batch_active():
+        _batch_state.dirty = True
+    else:
+        bump_blocklist_version()
+
+
+def later_expiry(a, b):
+    """The later of two block expiry times, where None means never."""
+    if a is None or b is None:
+        return None
+    return max(a, b)
+
+
+def active_blocks(now=None):
+    """Filter for entries that have not expired (uses the expires_at index)."""
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=now or timezone.now())
+
+
+class BlocklistSnapshot:
+    """
+    Per-process, in-memory copy of the BlockedIP and BlockedNetwork tables.
+
+    Single addresses are a frozenset membership test; CIDR blocks are
+    flattened into sorted address ranges when loaded, so a lookup is one
+    bisect over them (O(log n) comparisons in C).
+
+    The shared version key is polled at most once every
+    IP_TRACKING_BLOCKLIST_REFRESH_SECONDS, and the tables are only re-read
+    when that key has changed, so a new block reaches every worker within
+    that delay without touching the DB per request. Only unexpired
+    entries are loaded; the snapshot also reloads once its earliest
+    expiry has passed, so expired blocks stop applying even before the
+    sweep deletes them.
+    """
+
+    _UNLOADED = object()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._addresses = frozenset()
+        self._networks = NetworkMatcher()
+        self._version = self._UNLOADED
+        self._checked_at = float("-inf")
+        self._next_expiry = float("inf")
+
+    @property
+    def refresh_seconds(self):
+        return getattr(settings, "IP_TRACKING_BLOCKLIST_REFRESH_SECONDS", 5)
+
+    def is_blocked(self, ip):
+        if self.refresh_due():
+            self.refresh()
+        return self.contains(ip)
+
+    async def ais_blocked(self, ip):
+        """Async variant: the occasional refresh runs in a worker thread."""
+        if self.refresh_due():
+            await sync_to_async(self.refresh)()
+        return self.contains(ip)
+
+    def refresh_due(self):
+        return time.monotonic() - self._checked_at >= self.refresh_seconds
+
+    def contains(self, ip):
+        """Membership test against the current snapshot (no refresh, no I/O)."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return address in self._addresses or address in self._networks
+
+    def refresh(self, force=False):
+        """Reload from the DB if the shared version key has moved."""
+        with self._lock:
+            if not force and time.monotonic() - self._checked_at < self.refresh_seconds:
+                # Another thread refreshed while we waited for the lock.
+                return
+            version = cache.get(BLOCKLIST_VERSION_KEY)
+            if (
+                force
+                or self._version is self._UNLOADED
+                or version != self._version
+                or time.time() >= self._next_expiry
+            ):
+                self._addresses, self._networks, self._next_expiry = self._load()
+                self._version = version
+            self._checked_at = time.monotonic()
+
+    def _load(self):
+        from .models import BlockedIP, BlockedNetwork
+
+        now = timezone.now()
+        next_expiry = float("inf")
+        addresses = set()
+        for ip, expires_at in BlockedIP.objects.filter(active_blocks(now)).values_list(
+            "ip_address", "expires_at"
+        ).iterator():
+            addresses.add(ipaddress.ip_address(ip))
+            if expires_at is not None:
+                next_expiry = min(next_expiry, expires_at.timestamp())
+        networks = NetworkMatcher()
+        for network, expires_at in BlockedNetwork.objects.filter(active_blocks(now)).values_list(
+            "network", "expires_at"
+        ).iterator():
+            networks.add(network)
+            if expires_at is not None:
+                next_expiry = min(next_expiry, expires_at.timestamp())
+        return frozenset(addresses), networks, next_expiry
+
+    def __len__(self):
+        return len(self._addresses) + len(self._networks)
+
+
+blocklist = BlocklistSnapshot()
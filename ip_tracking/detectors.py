@@ -0,0 +1,480 @@
+"""
+Pluggable anomaly detectors over one columnar batch of RequestLog rows.
+
+The window is read with a single query into NumPy arrays (see
+WindowBatch). Every detector in IP_TRACKING_DETECTORS then works on
+those arrays and the per-IP features the batch computes once and
+shares, so adding a detector adds neither a query nor another pass in
+Python over the rows. A detector is any class with a `rule` and a
+`detect(batch, now)` method returning Finding tuples:
+
+    class TooManyPosts(Detector):
+        rule = "my_rule"
+
+        def detect(self, batch, now):
+            ...
+"""
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from itertools import repeat
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils.module_loading import import_string
+
+from .findings import Finding, record_findings, sensitive_path_rule, window_start
+from .interning import path_names
+from .iputils import unpack_ip
+
+try:
+    import numpy as np
+except ImportError:  # detection falls back to the SQL modes
+    np = None
+
+DEFAULT_DETECTORS = [
+    "ip_tracking.detectors.RateDetector",
+    "ip_tracking.detectors.SensitivePathDetector",
+    "ip_tracking.detectors.RegularIntervalDetector",
+    "ip_tracking.detectors.PathFanoutDetector",
+    "ip_tracking.detectors.ErrorRatioDetector",
+]
+
+
+class WindowBatch:
+    """
+    RequestLog rows of one window as parallel arrays, sorted by
+    (ip_id, timestamp):
+
+    - ``ip_ids`` / ``path_ids``: dense int32 ids into ``ips`` / ``paths``
+    - ``timestamps``: float64 epoch seconds
+    - ``status``: int16 response status (0 when unknown)
+
+    Shared per-IP features (``counts``, ``starts``, ``gaps``,
+    ``distinct_paths``) are computed on first use.
+    """
+
+    def __init__(self, ips, paths, ip_ids, path_ids, timestamps, status, presorted=False):
+        if not presorted:
+            order = np.lexsort((timestamps, ip_ids))
+            ip_ids, path_ids, timestamps, status = (
+                ip_ids[order], path_ids[order], timestamps[order], status[order]
+            )
+        self.ips = ips
+        self.paths = paths
+        self.ip_ids = ip_ids
+        self.path_ids = path_ids
+        self.timestamps = timestamps
+        self.status = status
+        self._features = {}
+
+    def __getstate__(self):
+        # Ship only the columns to worker processes; features are recomputed there.
+        state = self.__dict__.copy()
+        state["_features"] = {}
+        return state
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a batch from (ip, timestamp, path, status_code) tuples in one pass."""
+        ip_index, path_index = {}, {}
+        ip_ids, path_ids, timestamps, status = [], [], [], []
+        for ip, timestamp, path, status_code in rows:
+            ip_ids.append(ip_index.setdefault(ip, len(ip_index)))
+            path_ids.append(path_index.setdefault(path, len(path_index)))
+            timestamps.append(timestamp.timestamp())
+            status.append(status_code or 0)
+        return cls(
+            list(ip_index),
+            list(path_index),
+            np.array(ip_ids, dtype=np.int32),
+            np.array(path_ids, dtype=np.int32),
+            np.array(timestamps, dtype=np.float64),
+            np.array(status, dtype=np.int16),
+        )
+
+    @classmethod
+    def from_queryset(cls, queryset, chunk_size=10000):
+        """
+        Stream RequestLog rows into a batch. Path ids are kept through
+        the pass and replaced by their interned paths once at the end.
+        """
+        rows = (
+            queryset.order_by()
+            .values_list("ip", "timestamp", "path_id", "status_code")
+            .iterator(chunk_size=chunk_size)
+        )
+        ips = {}
+        batch = cls.from_rows(
+            (
+                (ips.get(packed) or ips.setdefault(packed, unpack_ip(packed)), timestamp, path_id, status_code)
+                for packed, timestamp, path_id, status_code in rows
+            )
+        )
+        names = path_names(batch.paths)
+        batch.paths = [names[path_id] for path_id in batch.paths]
+        return batch
+
+    def split(self, partitions):
+        """
+        Shard the batch by IP hash into `partitions` sub-batches. Every
+        row of an IP lands in the same shard and keeps its order, so
+        per-IP features are unchanged.
+        """
+        shard_of_ip = np.array([partition_of(ip, partitions) for ip in self.ips], dtype=np.int32)
+        shard_of_row = shard_of_ip[self.ip_ids]
+        shards = []
+        for shard in range(partitions):
+            ip_ids = np.flatnonzero(shard_of_ip == shard)
+            local_id = np.full(len(self.ips), -1, dtype=np.int32)
+            local_id[ip_ids] = np.arange(len(ip_ids), dtype=np.int32)
+            rows = shard_of_row == shard
+            shards.append(WindowBatch(
+                [self.ips[ip_id] for ip_id in ip_ids],
+                self.paths,
+                local_id[self.ip_ids[rows]],
+                self.path_ids[rows],
+                self.timestamps[rows],
+                self.status[rows],
+                presorted=True,
+            ))
+        return shards
+
+    def __len__(self):
+        return len(self.ip_ids)
+
+    def _feature(self, name, compute):
+        value = self._features.get(name)
+        if value is None:
+            value = self._features[name] = compute()
+        return value
+
+    @property
+    def counts(self):
+        """Requests per IP, indexed by ip_id."""
+        return self._feature("counts", lambda: np.bincount(self.ip_ids, minlength=len(self.ips)))
+
+    @property
+    def starts(self):
+        """Offset of each IP's first row in the sorted arrays."""
+        return self._feature("starts", lambda: np.concatenate(([0], np.cumsum(self.counts)[:-1])))
+
+    @property
+    def gaps(self):
+        """Seconds since the same IP's previous request (NaN on its first row)."""
+        def compute():
+            gaps = np.empty(len(self), dtype=np.float64)
+            if len(self):
+                gaps[0] = np.nan
+                gaps[1:] = np.diff(self.timestamps)
+                gaps[self.starts[self.counts > 0]] = np.nan
+            return gaps
+        return self._feature("gaps", compute)
+
+    @property
+    def distinct_paths(self):
+        """Number of different paths requested per IP."""
+        def compute():
+            pairs = np.unique(self.ip_ids.astype(np.int64) * len(self.paths) + self.path_ids)
+            return np.bincount(pairs // max(len(self.paths), 1), minlength=len(self.ips))
+        return self._feature("distinct_paths", compute)
+
+    def per_ip_sum(self, values):
+        """Sum `values` (one per row) per IP."""
+        return np.bincount(self.ip_ids, weights=values, minlength=len(self.ips))
+
+
+class Detector:
+    """Base class; subclasses set `rule` and implement detect()."""
+
+    rule = None
+
+    def detect(self, batch, now):
+        raise NotImplementedError
+
+    def finding(self, batch, ip_id, hits, reason, now, rule=None):
+        return Finding(batch.ips[ip_id], rule or self.rule, window_start(now), int(hits), reason, now)
+
+
+class RateDetector(Detector):
+    """More than IP_TRACKING_DETECT_RATE_THRESHOLD requests in the window."""
+
+    rule = "rate"
+
+    def __init__(self):
+        self.threshold = getattr(settings, "IP_TRACKING_DETECT_RATE_THRESHOLD", 100)
+
+    def detect(self, batch, now):
+        counts = batch.counts
+        for ip_id in np.flatnonzero(counts > self.threshold):
+            total = counts[ip_id]
+            yield self.finding(
+                batch, ip_id, total,
+                f"Exceeded {self.threshold} requests in the past hour ({total} requests)", now,
+            )
+
+
+class SensitivePathDetector(Detector):
+    """
+    Requests under IP_TRACKING_SENSITIVE_PATHS. A prefix matches the path
+    itself and anything below it ("/admin" matches "/admin/login/", not
+    "/administrator"). Only the batch's distinct paths are walked through
+    the prefix trie; rows are then matched with one array lookup.
+    """
+
+    rule = "sensitive_path"
+
+    def __init__(self):
+        self.prefixes = list(getattr(settings, "IP_TRACKING_SENSITIVE_PATHS", ["/admin", "/login"]))
+        self._trie = {}
+        for index, prefix in enumerate(self.prefixes):
+            node = self._trie
+            for char in prefix.rstrip("/"):
+                node = node.setdefault(char, {})
+            node[""] = index
+
+    def match(self, path):
+        """Index of the longest sensitive prefix covering `path`, or -1."""
+        node = self._trie
+        best = -1
+        for position, char in enumerate(path):
+            node = node.get(char)
+            if node is None:
+                return best
+            if "" in node and (position + 1 == len(path) or path[position + 1] == "/"):
+                best = node[""]
+        return best
+
+    def detect(self, batch, now):
+        path_prefix = np.array([self.match(path) for path in batch.paths] or [-1], dtype=np.int32)
+        row_prefix = path_prefix[batch.path_ids]
+        hit = row_prefix >= 0
+        if not hit.any():
+            return
+        keys, hits = np.unique(
+            batch.ip_ids[hit].astype(np.int64) * len(self.prefixes) + row_prefix[hit],
+            return_counts=True,
+        )
+        for key, count in zip(keys, hits):
+            ip_id, prefix_index = divmod(int(key), len(self.prefixes))
+            prefix = self.prefixes[prefix_index]
+            yield self.finding(
+                batch, ip_id, count, f"Accessed sensitive path: {prefix}", now,
+                rule=sensitive_path_rule(prefix),
+            )
+
+
+class RegularIntervalDetector(Detector):
+    """
+    Machine-like timing: at least IP_TRACKING_DETECT_INTERVAL_MIN_REQUESTS
+    requests whose inter-arrival times have a coefficient of variation
+    below IP_TRACKING_DETECT_INTERVAL_MAX_CV.
+    """
+
+    rule = "regular_interval"
+
+    def __init__(self):
+        self.min_requests = getattr(settings, "IP_TRACKING_DETECT_INTERVAL_MIN_REQUESTS", 20)
+        self.max_cv = getattr(settings, "IP_TRACKING_DETECT_INTERVAL_MAX_CV", 0.1)
+
+    def detect(self, batch, now):
+        gaps = batch.gaps
+        valid = ~np.isnan(gaps)
+        values = np.where(valid, gaps, 0.0)
+        n = batch.per_ip_sum(valid.astype(np.float64))
+        total = batch.per_ip_sum(values)
+        squares = batch.per_ip_sum(values * values)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = total / n
+            std = np.sqrt(np.maximum(squares / n - mean * mean, 0.0))
+            cv = std / mean
+        candidates = (batch.counts >= self.min_requests) & (mean > 0) & (cv < self.max_cv)
+        for ip_id in np.flatnonzero(candidates):
+            yield self.finding(
+                batch, ip_id, batch.counts[ip_id],
+                f"Requests at a regular {mean[ip_id]:.2f}s interval (cv {cv[ip_id]:.3f})", now,
+            )
+
+
+class PathFanoutDetector(Detector):
+    """More than IP_TRACKING_DETECT_FANOUT_THRESHOLD distinct paths (scanning)."""
+
+    rule = "path_fanout"
+
+    def __init__(self):
+        self.threshold = getattr(settings, "IP_TRACKING_DETECT_FANOUT_THRESHOLD", 50)
+
+    def detect(self, batch, now):
+        distinct = batch.distinct_paths
+        for ip_id in np.flatnonzero(distinct > self.threshold):
+            yield self.finding(
+                batch, ip_id, batch.counts[ip_id], f"Requested {distinct[ip_id]} distinct paths", now,
+            )
+
+
+class ErrorRatioDetector(Detector):
+    """
+    At least IP_TRACKING_DETECT_ERROR_MIN_REQUESTS requests with a known
+    status, of which more than IP_TRACKING_DETECT_ERROR_RATIO were 4xx.
+    """
+
+    rule = "error_ratio"
+
+    def __init__(self):
+        self.min_requests = getattr(settings, "IP_TRACKING_DETECT_ERROR_MIN_REQUESTS", 20)
+        self.ratio = getattr(settings, "IP_TRACKING_DETECT_ERROR_RATIO", 0.5)
+
+    def detect(self, batch, now):
+        status = batch.status
+        known = batch.per_ip_sum((status > 0).astype(np.float64))
+        errors = batch.per_ip_sum(((status >= 400) & (status < 500)).astype(np.float64))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = errors / known
+        for ip_id in np.flatnonzero((known >= self.min_requests) & (ratio > self.ratio)):
+            yield self.finding(
+                batch, ip_id, errors[ip_id],
+                f"{ratio[ip_id]:.0%} of {int(known[ip_id])} requests returned 4xx", now,
+            )
+
+
+_detectors = None
+_detectors_lock = threading.Lock()
+
+
+def get_detectors():
+    global _detectors
+    if _detectors is None:
+        with _detectors_lock:
+            if _detectors is None:
+                paths = getattr(settings, "IP_TRACKING_DETECTORS", DEFAULT_DETECTORS)
+                _detectors = [import_string(path)() for path in paths]
+    return _detectors
+
+
+def reset_detectors():
+    global _detectors
+    _detectors = None
+
+
+def partition_of(ip, partitions):
+    """Stable shard number for `ip` (same in every process, unlike hash())."""
+    return zlib.crc32(ip.encode()) % partitions
+
+
+def ip_ranges(queryset, partitions):
+    """
+    Split the IPs of `queryset` into at most `partitions` contiguous
+    ranges of packed addresses holding about the same number of rows,
+    from one GROUP BY ip query (a row per IP, not per request). Returns
+    [(lower, upper)] bounds for in_ip_range(); None is unbounded.
+    """
+    counts = list(queryset.order_by("ip").values_list("ip").annotate(rows=Count("id")))
+    target = sum(rows for _ip, rows in counts) / partitions
+    bounds, seen = [None], 0
+    for packed, rows in counts:
+        if len(bounds) < partitions and seen >= target * len(bounds):
+            bounds.append(bytes(packed))
+        seen += rows
+    bounds.append(None)
+    return list(zip(bounds, bounds[1:]))
+
+
+def in_ip_range(lower, upper):
+    """Q for RequestLog rows with lower <= ip < upper (packed, None = unbounded)."""
+    condition = Q()
+    if lower is not None:
+        condition &= Q(ip__gte=lower)
+    if upper is not None:
+        condition &= Q(ip__lt=upper)
+    return condition
+
+
+def _finding_key(finding):
+    return finding.ip_address, finding.rule
+
+
+def run_detectors(batch, now, detectors=None):
+    """Run every detector over `batch` and return all findings, sorted by (ip, rule)."""
+    findings = []
+    if len(batch):
+        for detector in detectors if detectors is not None else get_detectors():
+            findings.extend(detector.detect(batch, now))
+    return sorted(findings, key=_finding_key)
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _detect_shard(batch, now):
+    return run_detectors(batch, now)
+
+
+def run_partitioned(batch, now, partitions, max_workers=None):
+    """
+    Run the registry over `partitions` IP-hash shards of `batch` in a
+    process pool and merge the findings. Detectors only look at one
+    IP's rows at a time, so the merged, sorted result is the same for
+    any number of partitions.
+
+    A daemonic process (a Celery prefork worker) may not start the
+    pool, so there the batch is run whole in this process instead.
+    """
+    if partitions <= 1 or len(batch) == 0 or multiprocessing.current_process().daemon:
+        return run_detectors(batch, now)
+    max_workers = max_workers or min(partitions, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as pool:
+        results = pool.map(_detect_shard, batch.split(partitions), repeat(now))
+        findings = [finding for shard in results for finding in shard]
+    return sorted(findings, key=_finding_key)
+
+
+def detect_window(now, window=timedelta(hours=1), partitions=None, executor=None):
+    """
+    Load the trailing window once, run the registry and store the
+    findings.
+
+    With IP_TRACKING_DETECTION_PARTITIONS > 1 the detectors run on IP
+    shards, either in a local process pool ("process"), which splits
+    the one loaded batch by IP hash, or as a Celery chord of
+    detect_partition tasks ("celery"). For the chord the window's IPs
+    are first cut into ranges of about equal row counts (ip_ranges()),
+    and each task's query selects only its range, through the (ip,
+    timestamp) index, so no task reads another shard's rows. Inside a
+    Celery prefork worker, which cannot start a process pool, "process"
+    falls back to "celery".
+    """
+    from .models import RequestLog
+
+    if np is None:
+        raise RuntimeError("The 'pipeline' detection mode requires NumPy")
+    partitions = partitions or getattr(settings, "IP_TRACKING_DETECTION_PARTITIONS", 1)
+    executor = executor or getattr(settings, "IP_TRACKING_DETECTION_EXECUTOR", "process")
+    if executor == "process" and multiprocessing.current_process().daemon:
+        executor = "celery"
+    if partitions > 1 and executor == "celery":
+        from .tasks import detect_partition, store_partition_findings
+        from celery import chord
+
+        since = now - window
+        ranges = ip_ranges(RequestLog.objects.filter(timestamp__gte=since), partitions)
+        result = chord(
+            detect_partition.s(
+                lower and lower.hex(), upper and upper.hex(), since.isoformat(), now.isoformat()
+            )
+            for lower, upper in ranges
+        )(store_partition_findings.s(now.isoformat()))
+        return {"partitions": len(ranges), "task_id": result.id}
+    if executor not in ("process", "celery"):
+        raise ValueError(f"Unknown detection executor: {executor!r}")
+
+    batch = WindowBatch.from_queryset(RequestLog.objects.filter(timestamp__gte=now - window))
+    findings = run_partitioned(batch, now, partitions)
+    return {"rows": len(batch), "ips": len(batch.ips), "flagged": record_findings(findings)}
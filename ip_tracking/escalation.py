@@ -0,0 +1,144 @@
+"""
+Promote SuspiciousIP findings to expiring blocks, and sweep expired ones.
+
+Policies come from IP_TRACKING_ESCALATION_POLICIES, e.g.
+
+    {"name": "severe-rate", "rule": "rate", "min_hits": 1000, "ttl": 86400}
+    {"name": "repeat", "rule": "rate", "min_findings": 3, "within": 86400, "ttl": 3600}
+
+- ``rule``: finding rule to match; a trailing "*" matches a prefix
+  ("sensitive_path:*"). Omit to match every rule. The defaults only
+  act on "rate" findings: a sensitive_path finding takes a single
+  request, so blocking on them alone would block anyone who opens the
+  admin login a few times. "rate_estimate" findings from the realtime
+  tracker never match: their counts can be inflated by other IPs, and
+  the hourly "rate" finding confirms them from the logs.
+- ``min_hits``: only findings with at least this many hits count.
+- ``min_findings``: number of matching findings (IP x rule x window)
+  needed within ``within`` seconds (default 1 hour).
+- ``ttl``: block duration in seconds; None blocks permanently.
+
+Findings are only as trustworthy as the logged client IP, which is
+REMOTE_ADDR unless IP_TRACKING_TRUSTED_PROXIES is set. Behind a proxy
+that is not listed there every client logs as the proxy, so the
+scheduled task only escalates with IP_TRACKING_ESCALATION_ENABLED.
+
+A finding escalates once: it is stamped with escalated_at and only
+counts as new again when later activity moves its last_seen past that.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .blocklist import blocklist_batch, blocklist_changed, later_expiry
+from .findings import RULE_RATE_ESTIMATE, rule_filter
+
+DEFAULT_POLICIES = [
+    {"name": "severe-rate", "rule": "rate", "min_hits": 1000, "ttl": 24 * 60 * 60},
+    {"name": "repeat-offender", "rule": "rate", "min_findings": 3, "within": 24 * 60 * 60, "ttl": 60 * 60},
+]
+
+_CHUNK = 500
+
+
+def _pending():
+    """Findings never escalated, or seen again since they last were."""
+    return Q(escalated_at__isnull=True) | Q(last_seen__gt=F("escalated_at"))
+
+
+def match_policy(policy, now):
+    """IPs that `policy` wants blocked right now."""
+    from .models import SuspiciousIP
+
+    findings = SuspiciousIP.objects.filter(
+        rule_filter(policy.get("rule")),
+        last_seen__gte=now - timedelta(seconds=policy.get("within", 60 * 60)),
+    ).exclude(rule=RULE_RATE_ESTIMATE)
+    if policy.get("min_hits"):
+        findings = findings.filter(hits__gte=policy["min_hits"])
+    min_findings = policy.get("min_findings", 1)
+    if min_findings <= 1:
+        return set(findings.filter(_pending()).values_list("ip_address", flat=True).distinct())
+    return set(
+        findings.order_by()
+        .values("ip_address")
+        .annotate(findings=Count("id"), fresh=Count("id", filter=_pending()))
+        .filter(findings__gte=min_findings, fresh__gt=0)
+        .values_list("ip_address", flat=True)
+    )
+
+
+def escalate(now=None, policies=None):
+    """
+    Evaluate every policy (one query each) and create or extend BlockedIP
+    entries for the matched IPs. An existing block is only ever
+    lengthened. Publishes a single blocklist version bump.
+    """
+    from .models import BlockedIP, SuspiciousIP
+
+    now = now or timezone.now()
+    if policies is None:
+        policies = getattr(settings, "IP_TRACKING_ESCALATION_POLICIES", DEFAULT_POLICIES)
+
+    wanted = {}  # ip -> (expires_at, reason)
+    for policy in policies:
+        ttl = policy.get("ttl")
+        expires_at = None if ttl is None else now + timedelta(seconds=ttl)
+        reason = f"Escalated by policy {policy.get('name', '?')}"
+        for ip in match_policy(policy, now):
+            if ip in wanted and later_expiry(wanted[ip][0], expires_at) == wanted[ip][0]:
+                continue
+            wanted[ip] = (expires_at, reason)
+    if not wanted:
+        return {"blocked": 0, "extended": 0}
+
+    ips = list(wanted)
+    existing = {}
+    for start in range(0, len(ips), _CHUNK):
+        existing.update(
+            BlockedIP.objects.filter(ip_address__in=ips[start:start + _CHUNK])
+            .in_bulk(field_name="ip_address")
+        )
+
+    new, extended = [], []
+    for ip, (expires_at, reason) in wanted.items():
+        block = existing.get(ip)
+        if block is None:
+            new.append(BlockedIP(ip_address=ip, expires_at=expires_at, reason=reason))
+        elif block.expires_at is not None and later_expiry(block.expires_at, expires_at) != block.expires_at:
+            block.expires_at = expires_at
+            block.reason = reason
+            extended.append(block)
+
+    with blocklist_batch():
+        BlockedIP.objects.bulk_create(new, batch_size=_CHUNK, ignore_conflicts=True)
+        BlockedIP.objects.bulk_update(extended, ["expires_at", "reason"], batch_size=_CHUNK)
+        for start in range(0, len(ips), _CHUNK):
+            SuspiciousIP.objects.filter(_pending(), ip_address__in=ips[start:start + _CHUNK]).update(
+                escalated_at=now
+            )
+        if new or extended:
+            blocklist_changed()
+    return {"blocked": len(new), "extended": len(extended)}
+
+
+def sweep_expired_blocks(now=None, chunk_size=1000):
+    """
+    Delete expired BlockedIP/BlockedNetwork rows in chunks, using the
+    expires_at index, and publish one blocklist version bump.
+    """
+    from .models import BlockedIP, BlockedNetwork
+
+    now = now or timezone.now()
+    removed = 0
+    with blocklist_batch():
+        for model in (BlockedIP, BlockedNetwork):
+            expired = model.objects.filter(expires_at__lte=now).order_by("expires_at")
+            while True:
+                pks = list(expired.values_list("pk", flat=True)[:chunk_size])
+                if not pks:
+                    break
+                removed += model.objects.filter(pk__in=pks).delete()[0]
+    return {"removed": removed}
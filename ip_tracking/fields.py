@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import models
+from django.db.models import F, Value
+from django.utils import timezone as django_timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class EpochMicrosecondsField(models.DateTimeField):
+    """
+    A DateTimeField stored as a 64-bit integer of microseconds since the
+    Unix epoch (UTC) instead of the backend's datetime type.
+
+    On SQLite that is 6-8 bytes per value in rows and indexes rather than
+    a 26-character string. Comparisons, ranges, ordering, Min/Max and
+    the truncate() expression below work as usual; Django's date/time
+    transforms (``__date``, ``__hour``, Trunc*/Extract*) do not.
+    """
+
+    def get_internal_type(self):
+        return "BigIntegerField"
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if isinstance(value, datetime):
+            if django_timezone.is_naive(value):
+                value = django_timezone.make_aware(value, timezone.utc)
+            return (value - EPOCH) // MICROSECOND
+        return value
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        value = EPOCH + timedelta(microseconds=value)
+        return value if settings.USE_TZ else django_timezone.make_naive(value, timezone.utc)
+
+    def to_python(self, value):
+        if isinstance(value, int):
+            return self.from_db_value(value, None, None)
+        return super().to_python(value)
+
+    @classmethod
+    def truncate(cls, name, seconds):
+        """Expression for field `name` rounded down to a multiple of `seconds`."""
+        micros = models.ExpressionWrapper(F(name), output_field=models.BigIntegerField())
+        return models.ExpressionWrapper(micros - micros % Value(seconds * 1_000_000), output_field=cls())
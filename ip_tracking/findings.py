@@ -0,0 +1,156 @@
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .blocklist import active_blocks
+from .logquery import keyset_after
+
+FINDINGS_VERSION_KEY = "ip_tracking:findings_version"
+
+RULE_RATE = "rate"
+# Realtime tracker findings. Their hits are count-min estimates, which a
+# hash collision can inflate, so they are kept apart from the exact "rate"
+# findings of detect_anomalies and never escalated to blocks.
+RULE_RATE_ESTIMATE = "rate_estimate"
+SENSITIVE_PATH_RULE_PREFIX = "sensitive_path:"
+
+WINDOW = timedelta(hours=1)
+
+# One detector result. `hits` is the number of requests behind the
+# latest detection (e.g. the hourly count for the rate rule).
+Finding = namedtuple("Finding", "ip_address rule window_start hits reason seen_at")
+
+
+def sensitive_path_rule(path):
+    return f"{SENSITIVE_PATH_RULE_PREFIX}{path}"
+
+
+def rule_filter(rule):
+    """Q for a rule name; a trailing "*" matches a prefix ("sensitive_path:*"), None matches all."""
+    if rule is None:
+        return Q()
+    if rule.endswith("*"):
+        return Q(rule__startswith=rule[:-1])
+    return Q(rule=rule)
+
+
+def bump_findings_version():
+    """
+    Publish a new findings version. Cached findings listings are keyed
+    on it (with the blocklist version), so they go stale on every write.
+
+    Like bump_blocklist_version, inside a transaction the bump waits for
+    the commit: a listing rebuilt before then would be cached under the
+    new version without the rows.
+    """
+    transaction.on_commit(_publish_findings_version)
+
+
+def _publish_findings_version():
+    cache.set(FINDINGS_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def window_start(moment=None):
+    """Start of the hourly window that `moment` (default: now) falls in."""
+    moment = moment or timezone.now()
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_findings(findings, batch_size=500):
+    """
+    Upsert findings into SuspiciousIP, one row per (ip, rule, window).
+
+    Findings for a key already stored update its hits, reason and
+    last_seen in place (detected_at keeps the first sighting), so
+    re-running a detector never adds rows for the same offender. Hits
+    never go down: the finding with the most hits wins for each key,
+    among those of this call and the stored row (a realtime estimate
+    must not lower the hourly count detect_anomalies stored, nor the
+    reverse). The stored rows are read with select_for_update() in the
+    upsert's transaction. Returns the number of distinct keys written.
+    """
+    from .models import SuspiciousIP
+
+    merged = {}
+    for finding in findings:
+        key = (finding.ip_address, finding.rule, finding.window_start)
+        current = merged.get(key)
+        if current is None or (finding.hits, finding.seen_at) > (current.hits, current.seen_at):
+            merged[key] = finding
+    if not merged:
+        return 0
+
+    with transaction.atomic():
+        keys = list(merged)
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            stored = SuspiciousIP.objects.select_for_update().filter(
+                ip_address__in={key[0] for key in chunk}, window_start__in={key[2] for key in chunk}
+            ).values_list("ip_address", "rule", "window_start", "hits", "reason", "last_seen")
+            for ip_address, rule, start_of_window, hits, reason, last_seen in stored:
+                finding = merged.get((ip_address, rule, start_of_window))
+                if finding is not None and hits > finding.hits:
+                    merged[ip_address, rule, start_of_window] = finding._replace(
+                        hits=hits, reason=reason, seen_at=max(last_seen, finding.seen_at)
+                    )
+
+        SuspiciousIP.objects.bulk_create(
+            [
+                SuspiciousIP(
+                    ip_address=finding.ip_address,
+                    rule=finding.rule,
+                    window_start=finding.window_start,
+                    hits=finding.hits,
+                    reason=finding.reason,
+                    detected_at=finding.seen_at,
+                    last_seen=finding.seen_at,
+                )
+                for finding in merged.values()
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["ip_address", "rule", "window_start"],
+            update_fields=["hits", "reason", "last_seen"],
+        )
+    bump_findings_version()
+    return len(merged)
+
+
+def list_findings(rule=None, since=None, until=None, cursor=None, limit=50, now=None):
+    """
+    One page of SuspiciousIP rows, most recently detected first, and the
+    cursor of the next page (None on the last one).
+
+    `since`/`until` bound last_seen. Blocked status is computed in the
+    same query: each row is annotated with whether an active BlockedIP
+    exists for its address and when that block ends (`blocked_until`,
+    None for permanent blocks), instead of a query per row.
+    """
+    from .models import BlockedIP, SuspiciousIP
+
+    now = now or timezone.now()
+    blocks = BlockedIP.objects.filter(active_blocks(now), ip_address=OuterRef("ip_address"))
+    findings = SuspiciousIP.objects.filter(rule_filter(rule))
+    if since is not None:
+        findings = findings.filter(last_seen__gte=since)
+    if until is not None:
+        findings = findings.filter(last_seen__lt=until)
+    rows = list(
+        keyset_after(findings, cursor, "detected_at")
+        .annotate(is_blocked=Exists(blocks), blocked_until=Subquery(blocks.values("expires_at")[:1]))
+        .order_by("-detected_at", "-id")
+        .values(
+            "id", "ip_address", "rule", "window_start", "hits", "reason", "detected_at", "last_seen",
+            "is_blocked", "blocked_until",
+        )[:limit + 1]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]["detected_at"], rows[-1]["id"])
+    return rows, next_cursor
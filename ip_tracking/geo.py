@@ -0,0 +1,675 @@
+import asyncio
+import bisect
+import csv
+import ipaddress
+import logging
+import sys
+import threading
+import time
+from array import array
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .iputils import ip_to_int
+from .lru import LRUCache
+from .metrics import (
+    geo_cache_hits, geo_cache_misses, geo_cache_seconds, geo_cache_stale, geo_outbound_seconds,
+)
+
+try:
+    import httpx
+except ImportError:  # async lookups fall back to the sync client in a thread
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+EMPTY_GEO = {"country": None, "city": None}
+
+
+class GeoLookupError(Exception):
+    """A remote provider failed (error status, timeout, bad payload)."""
+
+
+class GeoBackend:
+    """
+    Resolves an IP address to {"country": ..., "city": ...}.
+
+    `lookup` returns None when the backend has no answer, so the next
+    backend in IP_TRACKING_GEO_BACKENDS gets a chance, and raises
+    GeoLookupError when the provider itself failed. Remote backends have
+    their results cached; local ones are cheaper than the cache.
+    """
+
+    remote = False
+
+    def lookup(self, ip):
+        raise NotImplementedError
+
+    async def alookup(self, ip):
+        return await sync_to_async(self.lookup, thread_sensitive=False)(ip)
+
+    def lookup_many(self, ips):
+        """
+        Resolve a batch; returns {ip: geo_data} for the IPs answered.
+
+        Remote backends should override this with a batch request.
+        """
+        results = {}
+        for ip in ips:
+            geo_data = self.lookup(ip)
+            if geo_data is not None:
+                results[ip] = geo_data
+        return results
+
+
+class IPAPIBackend(GeoBackend):
+    """Free ip-api.com HTTP API (no key, rate limited, blocking)."""
+
+    remote = True
+
+    def __init__(self):
+        self.url = getattr(settings, "IP_TRACKING_GEO_HTTP_URL", "http://ip-api.com/json/{ip}")
+        self.batch_url = getattr(
+            settings,
+            "IP_TRACKING_GEO_HTTP_BATCH_URL",
+            "http://ip-api.com/batch?fields=status,country,city,query",
+        )
+        self.batch_size = 100  # ip-api.com batch limit
+        self.timeout = getattr(settings, "IP_TRACKING_GEO_HTTP_TIMEOUT", 5)
+        self._client = None
+        self._client_loop = None
+
+    def lookup(self, ip):
+        try:
+            response = requests.get(self.url.format(ip=ip), timeout=self.timeout)
+            return self._parse(response.status_code, response.json)
+        except GeoLookupError:
+            raise
+        except Exception as exc:
+            logger.debug("Geolocation lookup failed for %s", ip, exc_info=True)
+            raise GeoLookupError(str(exc)) from exc
+
+    async def alookup(self, ip):
+        if httpx is None:
+            return await super().alookup(ip)
+        try:
+            response = await self._async_client().get(self.url.format(ip=ip))
+            return self._parse(response.status_code, response.json)
+        except GeoLookupError:
+            raise
+        except Exception as exc:
+            logger.debug("Geolocation lookup failed for %s", ip, exc_info=True)
+            raise GeoLookupError(str(exc)) from exc
+
+    def lookup_many(self, ips):
+        """Resolve up to 100 IPs per request through the ip-api.com batch endpoint."""
+        results = {}
+        ips = list(ips)
+        for start in range(0, len(ips), self.batch_size):
+            chunk = ips[start:start + self.batch_size]
+            try:
+                response = requests.post(self.batch_url, json=chunk, timeout=self.timeout)
+            except Exception as exc:
+                raise GeoLookupError(str(exc)) from exc
+            if response.status_code != 200:
+                raise GeoLookupError(f"ip-api.com batch returned HTTP {response.status_code}")
+            for ip, data in zip(chunk, response.json()):
+                results[ip] = {"country": data.get("country"), "city": data.get("city")}
+        return results
+
+    def _async_client(self):
+        """One pooled AsyncClient per event loop (clients can't cross loops)."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            )
+            self._client_loop = loop
+        return self._client
+
+    @staticmethod
+    def _parse(status_code, json):
+        if status_code != 200:
+            raise GeoLookupError(f"ip-api.com returned HTTP {status_code}")
+        data = json()
+        # status "fail" (private/reserved ranges) is a valid "unknown" answer.
+        return {
+            "country": data.get("country"),
+            "city": data.get("city"),
+        }
+
+
+class RangeFileBackend(GeoBackend):
+    """
+    Offline lookups against an IP-range CSV (IP_TRACKING_GEO_DATABASE).
+
+    Each row is ``start,end,country,city`` where start/end are IP
+    addresses or integers (a header row is skipped). Ranges are kept as
+    sorted integer arrays with an interned location table, and a lookup
+    is a single binary search, i.e. microseconds and no I/O.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, "IP_TRACKING_GEO_DATABASE", None)
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def lookup(self, ip):
+        if self._tables is None:
+            self._load()
+        parsed = ip_to_int(ip)
+        if parsed is None:
+            return None
+        version, key = parsed
+        starts, ends, location_ids, locations = self._tables[version]
+        index = bisect.bisect_right(starts, key) - 1
+        if index >= 0 and key <= ends[index]:
+            return locations[location_ids[index]]
+        return None
+
+    async def alookup(self, ip):
+        if self._tables is None:
+            await sync_to_async(self._load, thread_sensitive=False)()
+        return self.lookup(ip)
+
+    def _load(self):
+        with self._lock:
+            if self._tables is not None:
+                return
+            ranges = {4: [], 6: []}
+            locations = []
+            location_index = {}
+            if self.path:
+                with open(self.path, newline="", encoding="utf-8") as handle:
+                    for row in csv.reader(handle):
+                        parsed = self._parse_row(row)
+                        if parsed is None:
+                            continue
+                        version, start, end, location = parsed
+                        if location not in location_index:
+                            location_index[location] = len(locations)
+                            locations.append({"country": location[0], "city": location[1]})
+                        ranges[version].append((start, end, location_index[location]))
+            else:
+                logger.warning("RangeFileBackend enabled without IP_TRACKING_GEO_DATABASE")
+
+            tables = {}
+            for version, rows in ranges.items():
+                rows.sort()
+                # IPv4 fits in 32-bit unsigned arrays; IPv6 needs Python ints.
+                container = (lambda values: array("I", values)) if version == 4 else list
+                tables[version] = (
+                    container(row[0] for row in rows),
+                    container(row[1] for row in rows),
+                    array("I", (row[2] for row in rows)),
+                    locations,
+                )
+            self._tables = tables
+
+    @staticmethod
+    def _parse_row(row):
+        if len(row) < 3:
+            return None
+        try:
+            start = ipaddress.ip_address(int(row[0]) if row[0].isdigit() else row[0])
+            end = ipaddress.ip_address(int(row[1]) if row[1].isdigit() else row[1])
+        except ValueError:
+            return None  # header or malformed row
+        if start.version != end.version:
+            return None
+        country = row[2] or None
+        city = (row[3] if len(row) > 3 else "") or None
+        return start.version, int(start), int(end), (country, city)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing provider.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    `allow()` returns False for `reset_timeout` seconds; then a single
+    trial call is let through (half-open), which closes the breaker on
+    success or re-opens it on failure.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class _GeoEntry:
+    """Compact in-process form of a cached lookup (~72 bytes + strings)."""
+
+    __slots__ = ("country", "city", "fresh_until")
+
+    def __init__(self, country, city, fresh_until):
+        self.country = country
+        self.city = city
+        self.fresh_until = fresh_until
+
+    @classmethod
+    def from_shared(cls, entry):
+        # Shared-cache entries are (country, city, fresh_until) tuples;
+        # plain dicts written by older versions are treated as fresh.
+        if isinstance(entry, dict):
+            return cls(entry.get("country"), entry.get("city"), float("inf"))
+        return cls(*entry)
+
+    @staticmethod
+    def sizeof(key, entry):
+        size = sys.getsizeof(key) + sys.getsizeof(entry) + 100
+        for value in (entry.country, entry.city):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class _Flight:
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class GeoLocator:
+    """
+    Runs the configured backend chain: local backends first, then the
+    shared cache, then remote backends (whose answer is cached).
+
+    For the remote path:
+    - concurrent misses for one IP share a single provider call
+      (per process; sync and async callers each have their own table);
+    - failures are cached for `negative_timeout` instead of the full TTL;
+    - an entry past its TTL is still served for `stale_timeout` seconds
+      while one background refresh runs (stale-while-revalidate);
+    - a circuit breaker skips the provider after repeated failures.
+
+    An optional in-process LRU (`local_cache`) sits in front of the shared
+    cache so repeat visitors don't pay a cache round trip (a file read
+    with FileBasedCache) on every request.
+    """
+
+    def __init__(
+        self,
+        backends,
+        cache_timeout=60 * 60 * 24,
+        negative_timeout=300,
+        stale_timeout=60 * 60,
+        breaker=None,
+        local_cache=None,
+    ):
+        self.local_backends = [backend for backend in backends if not backend.remote]
+        self.remote_backends = [backend for backend in backends if backend.remote]
+        self.cache_timeout = cache_timeout
+        self.negative_timeout = negative_timeout
+        self.stale_timeout = stale_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.local_cache = local_cache
+        self.wait_timeout = max(
+            [getattr(backend, "timeout", 5) for backend in self.remote_backends] or [5]
+        )
+
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._ainflight = {}
+        self._background_tasks = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.breaker_rejections = 0
+
+    @classmethod
+    def from_settings(cls):
+        paths = getattr(settings, "IP_TRACKING_GEO_BACKENDS", ["ip_tracking.geo.IPAPIBackend"])
+        return cls(
+            [import_string(path)() for path in paths],
+            cache_timeout=getattr(settings, "IP_TRACKING_GEO_CACHE_TIMEOUT", 60 * 60 * 24),
+            negative_timeout=getattr(settings, "IP_TRACKING_GEO_NEGATIVE_CACHE_TIMEOUT", 300),
+            stale_timeout=getattr(settings, "IP_TRACKING_GEO_STALE_TIMEOUT", 60 * 60),
+            breaker=CircuitBreaker(
+                failure_threshold=getattr(settings, "IP_TRACKING_GEO_BREAKER_THRESHOLD", 5),
+                reset_timeout=getattr(settings, "IP_TRACKING_GEO_BREAKER_RESET_TIMEOUT", 30),
+            ),
+            local_cache=LRUCache(
+                maxsize=getattr(settings, "IP_TRACKING_GEO_LOCAL_CACHE_SIZE", 10000),
+                ttl=getattr(settings, "IP_TRACKING_GEO_LOCAL_CACHE_TTL", 60),
+                max_bytes=getattr(settings, "IP_TRACKING_GEO_LOCAL_CACHE_MAX_BYTES", None),
+                sizeof=_GeoEntry.sizeof,
+            ),
+        )
+
+    def stats(self):
+        shared_total = self.shared_hits + self.shared_misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "breaker_rejections": self.breaker_rejections,
+            "breaker_open": self.breaker.is_open,
+            "shared": {
+                "hits": self.shared_hits,
+                "misses": self.shared_misses,
+                "hit_ratio": self.shared_hits / shared_total if shared_total else 0.0,
+            },
+            "local": self.local_cache.stats() if self.local_cache is not None else None,
+        }
+
+    @staticmethod
+    def _cache_key(ip):
+        return f"geo_{ip}"
+
+    def _local_get(self, ip):
+        if self.local_cache is None:
+            return None
+        return self.local_cache.get(ip)
+
+    def _local_set(self, ip, entry, timeout):
+        if self.local_cache is not None:
+            self.local_cache.set(ip, entry, ttl=timeout)
+
+    def _from_shared(self, ip, cached):
+        if cached is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        entry = _GeoEntry.from_shared(cached)
+        self._local_set(ip, entry, entry.fresh_until - time.time() + self.stale_timeout)
+        return entry
+
+    def _serve(self, entry):
+        """Return (geo_data, fresh) for a cached entry and count it."""
+        fresh = time.time() < entry.fresh_until
+        if fresh:
+            self.hits += 1
+            geo_cache_hits.inc()
+        else:
+            self.stale += 1
+            geo_cache_stale.inc()
+        return {"country": entry.country, "city": entry.city}, fresh
+
+    def _store(self, ip, geo_data, failed, stale=None):
+        """
+        Build the entry for a resolved lookup; returns (key, shared value,
+        timeout). A failed refresh of a `stale` entry keeps its answer and
+        only pushes its next refresh back by the negative timeout.
+        """
+        ttl = self.negative_timeout if failed else self.cache_timeout
+        timeout = ttl if failed else ttl + self.stale_timeout
+        if failed and stale is not None:
+            geo_data = {"country": stale.country, "city": stale.city}
+            timeout = ttl + self.stale_timeout
+        entry = _GeoEntry(geo_data.get("country"), geo_data.get("city"), time.time() + ttl)
+        self._local_set(ip, entry, timeout)
+        return self._cache_key(ip), (entry.country, entry.city, entry.fresh_until), timeout
+
+    # Sync path
+
+    def lookup(self, ip):
+        for backend in self.local_backends:
+            geo_data = backend.lookup(ip)
+            if geo_data is not None:
+                return geo_data
+
+        if not self.remote_backends:
+            return EMPTY_GEO
+
+        started = time.perf_counter()
+        entry = self._local_get(ip)
+        if entry is None:
+            entry = self._from_shared(ip, cache.get(self._cache_key(ip)))
+        geo_cache_seconds.observe(time.perf_counter() - started)
+        if entry is not None:
+            geo_data, fresh = self._serve(entry)
+            if not fresh:
+                self._refresh_in_background(ip, entry)
+            return geo_data
+
+        self.misses += 1
+        geo_cache_misses.inc()
+        return self._single_flight(ip)
+
+    def _single_flight(self, ip, stale=None):
+        with self._inflight_lock:
+            flight = self._inflight.get(ip)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[ip] = _Flight()
+        if not leader:
+            self.coalesced += 1
+            flight.event.wait(self.wait_timeout)
+            return flight.result or EMPTY_GEO
+
+        try:
+            flight.result = self._resolve(ip, stale)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[ip]
+            flight.event.set()
+        return flight.result
+
+    def _refresh_in_background(self, ip, stale):
+        if ip in self._inflight:
+            return
+        threading.Thread(target=self._single_flight, args=(ip, stale), daemon=True).start()
+
+    def _resolve(self, ip, stale=None):
+        if not self.breaker.allow():
+            self.breaker_rejections += 1
+            return EMPTY_GEO
+        geo_data, failed = EMPTY_GEO, True
+        started = time.perf_counter()
+        for backend in self.remote_backends:
+            try:
+                result = backend.lookup(ip)
+            except GeoLookupError:
+                continue
+            geo_data, failed = result or EMPTY_GEO, False
+            break
+        geo_outbound_seconds.observe(time.perf_counter() - started)
+        self._record(failed)
+        key, value, timeout = self._store(ip, geo_data, failed, stale)
+        cache.set(key, value, timeout)
+        return {"country": value[0], "city": value[1]}
+
+    def _record(self, failed):
+        if failed:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    # Batch path (deferred enrichment)
+
+    def lookup_many(self, ips):
+        """
+        Resolve many IPs at once for background enrichment.
+
+        Returns {ip: geo_data} for every IP that got a definitive answer.
+        IPs whose remote lookup failed (or was refused by the breaker) are
+        left out so the caller can retry them later. Stale cache entries
+        are accepted as answers.
+        """
+        results = {}
+        remaining = []
+        for ip in ips:
+            for backend in self.local_backends:
+                geo_data = backend.lookup(ip)
+                if geo_data is not None:
+                    results[ip] = geo_data
+                    break
+            else:
+                remaining.append(ip)
+
+        if not self.remote_backends:
+            results.update((ip, EMPTY_GEO) for ip in remaining)
+            return results
+
+        cached = cache.get_many([self._cache_key(ip) for ip in remaining])
+        unresolved = []
+        for ip in remaining:
+            entry = cached.get(self._cache_key(ip))
+            if entry is None:
+                unresolved.append(ip)
+            else:
+                entry = _GeoEntry.from_shared(entry)
+                results[ip] = {"country": entry.country, "city": entry.city}
+
+        for backend in self.remote_backends:
+            if not unresolved:
+                break
+            if not self.breaker.allow():
+                self.breaker_rejections += 1
+                break
+            try:
+                answered = backend.lookup_many(unresolved)
+            except GeoLookupError:
+                self._record(failed=True)
+                continue
+            self._record(failed=False)
+            to_cache = {}
+            for ip, geo_data in answered.items():
+                key, value, _timeout = self._store(ip, geo_data, failed=False)
+                to_cache[key] = value
+                results[ip] = geo_data
+            cache.set_many(to_cache, timeout=self.cache_timeout + self.stale_timeout)
+            unresolved = [ip for ip in unresolved if ip not in answered]
+        return results
+
+    # Async path
+
+    async def alookup(self, ip):
+        for backend in self.local_backends:
+            geo_data = await backend.alookup(ip)
+            if geo_data is not None:
+                return geo_data
+
+        if not self.remote_backends:
+            return EMPTY_GEO
+
+        started = time.perf_counter()
+        entry = self._local_get(ip)
+        if entry is None:
+            entry = self._from_shared(ip, await cache.aget(self._cache_key(ip)))
+        geo_cache_seconds.observe(time.perf_counter() - started)
+        if entry is not None:
+            geo_data, fresh = self._serve(entry)
+            if not fresh:
+                self._arefresh_in_background(ip, entry)
+            return geo_data
+
+        self.misses += 1
+        geo_cache_misses.inc()
+        return await self._asingle_flight(ip)
+
+    async def _asingle_flight(self, ip, stale=None, retry=True):
+        future = self._ainflight.get(ip)
+        if future is not None:
+            self.coalesced += 1
+            result = await asyncio.shield(future)
+            if result is None:
+                # The leader was cancelled; that is not this request's doing.
+                return await self._asingle_flight(ip, stale, retry=False) if retry else EMPTY_GEO
+            return result
+
+        future = self._ainflight[ip] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._aresolve(ip, stale)
+        except asyncio.CancelledError:
+            future.set_result(None)
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._ainflight[ip]
+        return result
+
+    def _arefresh_in_background(self, ip, stale):
+        if ip in self._ainflight:
+            return
+        task = asyncio.get_running_loop().create_task(self._asingle_flight(ip, stale))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _aresolve(self, ip, stale=None):
+        if not self.breaker.allow():
+            self.breaker_rejections += 1
+            return EMPTY_GEO
+        geo_data, failed = EMPTY_GEO, True
+        started = time.perf_counter()
+        for backend in self.remote_backends:
+            try:
+                result = await backend.alookup(ip)
+            except GeoLookupError:
+                continue
+            geo_data, failed = result or EMPTY_GEO, False
+            break
+        geo_outbound_seconds.observe(time.perf_counter() - started)
+        self._record(failed)
+        key, value, timeout = self._store(ip, geo_data, failed, stale)
+        await cache.aset(key, value, timeout)
+        return {"country": value[0], "city": value[1]}
+
+
+_geolocator = None
+_geolocator_lock = threading.Lock()
+
+
+def get_geolocator():
+    global _geolocator
+    if _geolocator is None:
+        with _geolocator_lock:
+            if _geolocator is None:
+                _geolocator = GeoLocator.from_settings()
+    return _geolocator
+
+
+def reset_geolocator():
+    global _geolocator
+    _geolocator = None
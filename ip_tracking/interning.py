@@ -0,0 +1,282 @@
+"""
+Interned dimension values for the compact RequestLog schema.
+
+RequestLog keeps the client IP packed to 4/16 bytes and refers to its
+path and (country, city) by integer id into LogPath / GeoLocation.
+There are few distinct paths and locations next to the number of
+requests, so each process keeps value <-> id maps in memory and only
+queries the dimension tables for values it has not seen yet; missing
+values are created with one bulk insert per batch.
+
+Paths come from clients, so LogPath is capped at
+IP_TRACKING_INTERN_MAX_PATHS rows: once full, paths not stored yet are
+logged as OVERFLOW_PATH. retention.purge_request_logs() deletes the
+paths and locations no log refers to any more. Only keys this process
+has just written logs with are cached for writing (reading old logs
+does not cache their ids), so those ids are backed by recent logs and
+are not pruned; should one be pruned all the same, insert_request_logs()
+drops the caches and builds the rows again.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+
+from .iputils import pack_ip
+from .lru import LRUCache
+
+PATH_MAX_LENGTH = 255
+NO_LOCATION = ("", "")
+# Stands in for new paths once LogPath is full; no request path lacks the leading "/".
+OVERFLOW_PATH = "<other>"
+
+_CHUNK = 500
+
+
+def location_key(country, city):
+    """(country, city) as stored in GeoLocation, with None mapped to ""."""
+    return country or "", city or ""
+
+
+class Interner:
+    """
+    value <-> id cache in front of a dimension table with a unique key.
+
+    Keys are plain values for a single-field table and tuples otherwise.
+    Both maps are LRU caches of `max_size` entries that expire after
+    `ttl` seconds, so rows pruned from the table drop out of them too.
+    Only ids() fills the key -> id map used for writing: values() reads
+    ids of old rows, which may be pruned while still cached.
+
+    With `max_rows`, the table is not grown past that many rows: keys
+    that would be created beyond it map to the id of `overflow` instead
+    (and are not cached, so a flood of them cannot evict real keys).
+    """
+
+    def __init__(self, model, fields, max_size=10000, ttl=3600, max_rows=None, overflow=None):
+        self.model = model
+        self.fields = tuple(fields)
+        self.max_size = max_size
+        self.max_rows = max_rows
+        self.overflow = overflow
+        self._ids = LRUCache(maxsize=max_size, ttl=ttl)
+        self._values = LRUCache(maxsize=max_size, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def _as_key(self, row):
+        return row[0] if len(self.fields) == 1 else tuple(row)
+
+    def _remember(self, pairs, ids=True):
+        for key, pk in pairs.items():
+            if ids:
+                self._ids.set(key, pk)
+            self._values.set(pk, key)
+
+    def _spill(self, absent):
+        """The keys of `absent` that would take the table past max_rows."""
+        if self.max_rows is None or not absent:
+            return []
+        room = max(self.max_rows - self.model.objects.count(), 0)
+        return [key for key in absent if key != self.overflow][room:]
+
+    def _fetch(self, keys):
+        found = {}
+        for start in range(0, len(keys), _CHUNK):
+            chunk = keys[start:start + _CHUNK]
+            if len(self.fields) == 1:
+                condition = Q(**{f"{self.fields[0]}__in": chunk})
+            else:
+                condition = Q()
+                for key in chunk:
+                    condition |= Q(**dict(zip(self.fields, key)))
+            for row in self.model.objects.filter(condition).values_list("pk", *self.fields):
+                found[self._as_key(row[1:])] = row[0]
+        return found
+
+    def ids(self, keys):
+        """Return {key: id} for `keys`, creating the ones not stored yet."""
+        result = {}
+        missing = []
+        for key in keys:
+            pk = self._ids.get(key)
+            if pk is None:
+                missing.append(key)
+            else:
+                result[key] = pk
+        self.hits += len(result)
+        if not missing:
+            return result
+        self.misses += len(missing)
+
+        found = self._fetch(missing)
+        absent = [key for key in missing if key not in found]
+        spilled = self._spill(absent)
+        if spilled:
+            spilled_keys = set(spilled)
+            absent = [key for key in absent if key not in spilled_keys]
+            if self.overflow not in found and self.overflow not in absent:
+                found.update(self._fetch([self.overflow]))
+                if self.overflow not in found:
+                    absent.append(self.overflow)
+        if absent:
+            self.model.objects.bulk_create(
+                [
+                    self.model(**dict(zip(self.fields, (key,) if len(self.fields) == 1 else key)))
+                    for key in absent
+                ],
+                batch_size=_CHUNK,
+                ignore_conflicts=True,
+            )
+            found.update(self._fetch(absent))
+        # Inside a transaction, ids of rows created here are only cached
+        # once they are committed.
+        transaction.on_commit(lambda: self._remember(found))
+        result.update(found)
+        for key in spilled:
+            result[key] = found[self.overflow]
+        return result
+
+    def values(self, ids):
+        """Return {id: key} for `ids`."""
+        result = {}
+        missing = []
+        for pk in ids:
+            key = self._values.get(pk)
+            if key is None:
+                missing.append(pk)
+            else:
+                result[pk] = key
+        found = {}
+        for start in range(0, len(missing), _CHUNK):
+            for row in self.model.objects.filter(pk__in=missing[start:start + _CHUNK]).values_list(
+                "pk", *self.fields
+            ):
+                found[row[0]] = self._as_key(row[1:])
+        if found:
+            self._remember({key: pk for pk, key in found.items()}, ids=False)
+            result.update(found)
+        return result
+
+    def stats(self):
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        self._ids.clear()
+        self._values.clear()
+
+
+_path_interner = None
+_location_interner = None
+_interner_lock = threading.Lock()
+
+
+def get_path_interner():
+    global _path_interner
+    if _path_interner is None:
+        with _interner_lock:
+            if _path_interner is None:
+                from .models import LogPath
+
+                _path_interner = Interner(
+                    LogPath,
+                    ["path"],
+                    getattr(settings, "IP_TRACKING_INTERN_CACHE_SIZE", 10000),
+                    getattr(settings, "IP_TRACKING_INTERN_CACHE_TTL", 3600),
+                    max_rows=getattr(settings, "IP_TRACKING_INTERN_MAX_PATHS", 50000),
+                    overflow=OVERFLOW_PATH,
+                )
+    return _path_interner
+
+
+def get_location_interner():
+    global _location_interner
+    if _location_interner is None:
+        with _interner_lock:
+            if _location_interner is None:
+                from .models import GeoLocation
+
+                _location_interner = Interner(
+                    GeoLocation,
+                    ["country", "city"],
+                    getattr(settings, "IP_TRACKING_INTERN_CACHE_SIZE", 10000),
+                    getattr(settings, "IP_TRACKING_INTERN_CACHE_TTL", 3600),
+                )
+    return _location_interner
+
+
+def reset_interners():
+    global _path_interner, _location_interner
+    with _interner_lock:
+        _path_interner = None
+        _location_interner = None
+
+
+def location_ids(pairs):
+    """{(country, city): GeoLocation id or None} for raw geo pairs."""
+    keys = {pair: location_key(*pair) for pair in pairs}
+    ids = get_location_interner().ids({key for key in keys.values() if key != NO_LOCATION})
+    return {pair: ids.get(key) for pair, key in keys.items()}
+
+
+def build_request_logs(records):
+    """
+    Unsaved RequestLog instances for queued records, in
+    logwriter.LOG_FIELD_NAMES order. Paths and locations are interned
+    in bulk for the whole batch.
+    """
+    from .models import RequestLog
+
+    path_ids = get_path_interner().ids({record[1][:PATH_MAX_LENGTH] for record in records})
+    locations = location_ids({(record[3], record[4]) for record in records})
+    return [
+        RequestLog(
+            ip=pack_ip(ip),
+            path_id=path_ids[path[:PATH_MAX_LENGTH]],
+            timestamp=timestamp,
+            location_id=locations[(country, city)],
+            geo_pending=geo_pending,
+            status_code=status_code,
+        )
+        for ip, path, timestamp, country, city, geo_pending, status_code in records
+    ]
+
+
+def insert_request_logs(records, batch_size=None):
+    """
+    Insert RequestLog rows for queued records and return them.
+
+    An IntegrityError may come from a path or location id cached here
+    but pruned by another process, so the interner caches are dropped
+    and the rows built and inserted once more before giving up. Foreign
+    keys are checked on commit, so this only helps outside a transaction.
+    """
+    try:
+        return _insert_request_logs(records, batch_size)
+    except IntegrityError:
+        get_path_interner().clear()
+        get_location_interner().clear()
+    return _insert_request_logs(records, batch_size)
+
+
+def _insert_request_logs(records, batch_size):
+    from .models import RequestLog
+
+    rows = build_request_logs(records)
+    if len(rows) == 1 and not connection.in_atomic_block:
+        rows[0].save(force_insert=True)  # one statement, committed on its own
+    else:
+        with transaction.atomic():
+            RequestLog.objects.bulk_create(rows, batch_size=batch_size)
+    return rows
+
+
+def path_names(ids):
+    """{LogPath id: path}."""
+    return get_path_interner().values(ids)
+
+
+def locations_by_id(ids):
+    """{GeoLocation id: (country, city)}."""
+    return get_location_interner().values(ids)
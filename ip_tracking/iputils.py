@@ -0,0 +1,93 @@
+import ipaddress
+import socket
+
+from django.conf import settings
+
+_from_bytes = int.from_bytes
+
+
+def ip_to_int(ip):
+    """
+    Parse an IP address into ``(version, integer)``, or None if invalid.
+
+    Uses inet_pton, which is several times faster than
+    ``ipaddress.ip_address`` on the request path.
+    """
+    if not ip:
+        return None
+    try:
+        if ":" in ip:
+            return 6, _from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big")
+        return 4, _from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+_trusted_proxies = ((), ())  # (setting value, parsed networks)
+
+
+def _trusted_networks():
+    global _trusted_proxies
+    spec = tuple(getattr(settings, "IP_TRACKING_TRUSTED_PROXIES", ()))
+    if spec != _trusted_proxies[0]:
+        _trusted_proxies = (spec, tuple(ipaddress.ip_network(network, strict=False) for network in spec))
+    return _trusted_proxies[1]
+
+
+def _is_trusted(ip, networks):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def ip_in_networks(ip, networks):
+    """True if `ip` falls in any of `networks` (addresses or CIDR strings)."""
+    return _is_trusted(ip, [ipaddress.ip_network(network, strict=False) for network in networks])
+
+
+def get_trusted_client_ip(request):
+    """
+    Client IP for decisions a client must not be able to steer (the
+    blocklist, logs and findings, rate limits): REMOTE_ADDR, unless that is one of
+    IP_TRACKING_TRUSTED_PROXIES. Then X-Forwarded-For is read from the
+    right, where each trusted proxy appended the address it saw, and the
+    first hop that is not a trusted proxy is the client; entries a
+    client put on the left themselves are never reached.
+    """
+    remote = request.META.get("REMOTE_ADDR")
+    networks = _trusted_networks()
+    if not networks or not _is_trusted(remote, networks):
+        return remote
+    hops = [hop.strip() for hop in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+    hops = [hop for hop in hops if hop]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, networks):
+            return hop
+    return hops[0] if hops else remote
+
+
+def pack_ip(ip):
+    """
+    Pack an IP address into its network-order bytes (4 for IPv4, 16 for
+    IPv6), the form RequestLog stores. Unparseable input packs to b"".
+    """
+    if not ip:
+        return b""
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return socket.inet_pton(socket.AF_INET, ip)
+    except (OSError, TypeError, ValueError):
+        return b""
+
+
+def unpack_ip(packed):
+    """Inverse of pack_ip; accepts bytes or a memoryview from the database."""
+    packed = bytes(packed)
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed)
+    if len(packed) == 16:
+        return socket.inet_ntop(socket.AF_INET6, packed)
+    return ""
@@ -0,0 +1,184 @@
+"""
+Filtering, keyset pagination and streaming export of RequestLog rows.
+
+Rows are served newest first, ordered on (timestamp, id). A page cursor
+is the (timestamp, id) of the last row served, so the next page is one
+index range scan starting right after it: page 10,000 costs the same as
+page 1, and rows written meanwhile never shift the pages. Exports walk
+the same keyset in fixed-size batches, so memory stays flat however many
+rows match, and no database cursor is held open between batches.
+
+Only the RequestLog columns are selected; paths and locations are
+resolved through the intern caches instead of joins.
+"""
+import base64
+import binascii
+import csv
+import json
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .fields import EPOCH, MICROSECOND
+from .interning import locations_by_id, path_names
+from .iputils import pack_ip, unpack_ip
+
+LOG_COLUMNS = ("id", "ip", "timestamp", "path_id", "location_id", "status_code")
+EXPORT_FIELDS = ("id", "ip_address", "timestamp", "path", "country", "city", "status_code")
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 2000
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    micros = (timestamp - EPOCH) // MICROSECOND
+    return base64.urlsafe_b64encode(f"{micros}.{pk}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    """(timestamp, id) from encode_cursor(); raises InvalidQuery."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        micros, pk = raw.split(".")
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidQuery("cursor is not valid")
+
+
+def _parse_time(name, value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise InvalidQuery(f"{name} must be an ISO 8601 datetime")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_filters(params):
+    """
+    Validate query parameters (ip, path, country, since, until) into
+    keyword arguments for filter_logs; raises InvalidQuery.
+    """
+    filters = {}
+    if params.get("ip"):
+        filters["ip"] = pack_ip(params["ip"])
+        if not filters["ip"]:
+            raise InvalidQuery("ip must be an IPv4 or IPv6 address")
+    if params.get("path"):
+        filters["path_prefix"] = params["path"]
+    if params.get("country"):
+        filters["country"] = params["country"]
+    for name in ("since", "until"):
+        if params.get(name):
+            filters[name] = _parse_time(name, params[name])
+    return filters
+
+
+def filter_logs(ip=None, path_prefix=None, country=None, since=None, until=None):
+    """
+    RequestLog rows matching every given filter. `ip` is packed
+    (iputils.pack_ip); `since` is inclusive and `until` exclusive.
+    """
+    from .models import GeoLocation, LogPath, RequestLog
+
+    logs = RequestLog.objects.all()
+    if ip is not None:
+        logs = logs.filter(ip=ip)
+    if path_prefix is not None:
+        logs = logs.filter(path_id__in=LogPath.objects.filter(path__startswith=path_prefix).values("id"))
+    if country is not None:
+        logs = logs.filter(location_id__in=GeoLocation.objects.filter(country=country).values("id"))
+    if since is not None:
+        logs = logs.filter(timestamp__gte=since)
+    if until is not None:
+        logs = logs.filter(timestamp__lt=until)
+    return logs
+
+
+def keyset_after(queryset, cursor, field="timestamp"):
+    """Rows after `cursor` = (value, id) in ("-field", "-id") order."""
+    if cursor is None:
+        return queryset
+    value, pk = cursor
+    # field__lte is implied by the OR, but gives the planner a range to
+    # seek to instead of scanning the index from the newest row.
+    return queryset.filter(
+        Q(**{f"{field}__lte": value}), Q(**{f"{field}__lt": value}) | Q(**{field: value}, id__lt=pk)
+    )
+
+
+def _fetch(queryset, cursor, limit):
+    return list(
+        keyset_after(queryset, cursor).order_by("-timestamp", "-id").values_list(*LOG_COLUMNS)[:limit]
+    )
+
+
+def _as_dicts(rows):
+    paths = path_names({row[3] for row in rows})
+    locations = locations_by_id({row[4] for row in rows if row[4] is not None})
+    result = []
+    for pk, ip, timestamp, path_id, location_id, status_code in rows:
+        country, city = locations.get(location_id, ("", ""))
+        result.append({
+            "id": pk,
+            "ip_address": unpack_ip(ip),
+            "timestamp": timestamp.isoformat(),
+            "path": paths.get(path_id, ""),
+            "country": country or None,
+            "city": city or None,
+            "status_code": status_code,
+        })
+    return result
+
+
+def log_page(queryset, cursor=None, limit=50):
+    """
+    One page of rows as dicts, and the cursor of the next page (None on
+    the last one). `cursor` is a decode_cursor() tuple.
+    """
+    rows = _fetch(queryset, cursor, limit + 1)
+    next_cursor = encode_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+    return _as_dicts(rows[:limit]), next_cursor
+
+
+def iter_log_batches(queryset, batch_size=EXPORT_BATCH_SIZE, max_rows=None):
+    """
+    Every matching row (the newest `max_rows`, if given) as dicts, newest
+    first, one list per keyset batch.
+    """
+    cursor = None
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        rows = _fetch(queryset, cursor, size)
+        if rows:
+            yield _as_dicts(rows)
+        if len(rows) < size:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        cursor = rows[-1][2], rows[-1][0]
+
+
+def ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(row) + "\n" for row in batch)
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(batches):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for batch in batches:
+        yield "".join(writer.writerow([row[field] for field in EXPORT_FIELDS]) for row in batch)
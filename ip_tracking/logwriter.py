@@ -0,0 +1,194 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+BLOCK = "block"
+
+# Order of the values in a queued record.
+LOG_FIELD_NAMES = ("ip_address", "path", "timestamp", "country", "city", "geo_pending", "status_code")
+
+
+class RequestLogWriter:
+    """
+    Buffers RequestLog rows in memory and writes them with bulk_create.
+
+    The middleware enqueues a small tuple per request; a daemon thread
+    flushes whenever `batch_size` rows are waiting or `flush_interval`
+    seconds have passed, whichever comes first. When the queue is full,
+    `overflow` decides between dropping the oldest row (counted in
+    `dropped`) and blocking the request until the flusher catches up.
+    Pending rows are flushed at interpreter exit.
+
+    A batch the database rejects as a whole for a row's data (an
+    IntegrityError or DataError) is retried one row at a time, so only
+    the offending rows are lost and counted in `failed`; any other error
+    (the database being down) fails the whole batch.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=0.25, max_queue=10000, overflow=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow!r}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._flush_lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            batch_size=getattr(settings, "IP_TRACKING_LOG_BATCH_SIZE", 500),
+            flush_interval=getattr(settings, "IP_TRACKING_LOG_FLUSH_INTERVAL", 0.25),
+            max_queue=getattr(settings, "IP_TRACKING_LOG_QUEUE_SIZE", 10000),
+            overflow=getattr(settings, "IP_TRACKING_LOG_OVERFLOW", DROP_OLDEST),
+        )
+
+    def enqueue(self, ip_address, path, timestamp, country=None, city=None, geo_pending=False,
+                status_code=None):
+        record = (ip_address, path, timestamp, country, city, geo_pending, status_code)
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == BLOCK and not self._stopping:
+                    while len(self._queue) >= self.max_queue and not self._stopping:
+                        self._cond.notify_all()
+                        self._cond.wait()
+                else:
+                    self._queue.popleft()
+                    self.dropped += 1
+            self._queue.append(record)
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            "queue_depth": len(self._queue),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "flushes": self.flushes,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the flusher thread and write whatever is still queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while self._queue:
+            self.flush()
+
+    def flush(self):
+        """Write up to one batch of queued rows; returns the number written."""
+        with self._flush_lock:
+            with self._cond:
+                count = min(len(self._queue), self.batch_size)
+                batch = [self._queue.popleft() for _ in range(count)]
+                self._cond.notify_all()
+            if not batch:
+                return 0
+            return self._write(batch)
+
+    def _write(self, batch):
+        from .interning import insert_request_logs
+
+        try:
+            close_old_connections()
+            insert_request_logs(batch, batch_size=self.batch_size)
+        except (IntegrityError, DataError):
+            written = self._write_each(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d request log rows", len(batch))
+            return 0
+        else:
+            written = len(batch)
+        self.written += written
+        self.flushes += 1
+        return written
+
+    def _write_each(self, batch):
+        from .interning import insert_request_logs
+
+        written = 0
+        for record in batch:
+            try:
+                insert_request_logs([record])
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to write request log row %r", record)
+            else:
+                written += 1
+        return written
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                while not self._stopping and len(self._queue) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            self.flush()
+            if len(self._queue) < self.batch_size:
+                deadline = time.monotonic() + self.flush_interval
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """
+    Return this process's writer, starting its flusher on first use.
+
+    The writer is created lazily (and re-created after a fork) so that
+    preforking servers don't inherit a parent's queue or dead thread.
+    """
+    global _writer, _writer_pid
+    pid = os.getpid()
+    if _writer is None or _writer_pid != pid:
+        with _writer_lock:
+            if _writer is None or _writer_pid != pid:
+                writer = RequestLogWriter.from_settings()
+                writer.start()
+                atexit.register(writer.stop)
+                _writer, _writer_pid = writer, pid
+    return _writer
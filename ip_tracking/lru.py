@@ -0,0 +1,94 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-entry overhead of the OrderedDict slot + linked-list node.
+_SLOT_OVERHEAD = 100
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe in-process LRU with a per-entry TTL.
+
+    Capacity is limited by entry count (`maxsize`) and optionally by an
+    approximate byte budget (`max_bytes`). `sizeof(key, value)` estimates
+    an entry's footprint; the running total is kept in `bytes` so the
+    tier can be sized from real numbers.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60.0, max_bytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes or None
+        self._sizeof = sizeof or self.default_sizeof
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def default_sizeof(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + _SLOT_OVERHEAD
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item[0]
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        size = self._sizeof(key, value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (
+                self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        _value, _expires_at, size = self._data.pop(key)
+        self.bytes -= size
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hit_ratio(),
+        }
@@ -1,18 +1,122 @@
-from django.core.management.base import BaseCommand
-from ip_tracking.models import BlockedIP
+import os
+import sys
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ip_tracking.blockfeed import FeedReader, export_blocks, import_blocks, normalize_entry, sync_blocks, unblock
 
 
 class Command(BaseCommand):
-    help = "Block an IP address by adding it to the BlockedIP model."
+    help = (
+        "Block IP addresses or CIDR networks (e.g. 10.0.0.0/16, 2001:db8::/48), given as arguments "
+        "or read from feed files; also unblock, sync a feed, or export the blocklist."
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument("ip_address", type=str, help="IP address to block")
+        parser.add_argument("ip_address", nargs="*", help="IP addresses or CIDR networks to block")
+        parser.add_argument(
+            "--file", action="append", default=[], metavar="PATH",
+            help="Read entries from this file, one per line ('-' for stdin); repeatable",
+        )
+        parser.add_argument(
+            "--ttl", type=int, default=None,
+            help="Seconds until the block expires (default: permanent)",
+        )
+        parser.add_argument("--reason", default=None, help="Reason stored on the blocks")
+        parser.add_argument("--unblock", action="store_true", help="Remove the blocks for the entries instead")
+        parser.add_argument(
+            "--sync", action="store_true",
+            help="Make the blocks with --reason match the entries exactly, removing the ones not listed",
+        )
+        parser.add_argument(
+            "--export", nargs="?", const="-", default=None, metavar="PATH",
+            help="Write the active blocklist to PATH (default: stdout), one entry per line",
+        )
+        parser.add_argument("--include-expired", action="store_true", help="Also export expired blocks")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Entries per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Count the changes without writing them")
 
     def handle(self, *args, **kwargs):
-        ip_address = kwargs["ip_address"]
+        if kwargs["export"] is not None:
+            return self.export(kwargs["export"], kwargs["include_expired"])
+
+        if kwargs["unblock"] and kwargs["sync"]:
+            raise CommandError("--unblock and --sync cannot be combined")
+        if kwargs["sync"] and not kwargs["reason"]:
+            raise CommandError("--sync needs --reason, to tell the feed's blocks from the others")
+        if kwargs["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        if not kwargs["ip_address"] and not kwargs["file"]:
+            raise CommandError("Give IP addresses or networks, or --file")
+        for path in kwargs["file"]:
+            if path != "-" and not os.path.isfile(path):
+                raise CommandError(f"No such file: {path}")
+
+        ttl = kwargs["ttl"]
+        expires_at = None if ttl is None else timezone.now() + timedelta(seconds=ttl)
+
+        if len(kwargs["ip_address"]) == 1 and not kwargs["file"] and not kwargs["sync"]:
+            return self.single(kwargs["ip_address"][0], expires_at, kwargs)
+
+        with ExitStack() as stack:
+            feed = FeedReader(self.lines(kwargs["ip_address"], kwargs["file"], stack))
+            options = {"chunk_size": kwargs["chunk_size"], "dry_run": kwargs["dry_run"]}
+            if kwargs["unblock"]:
+                result = unblock(feed, reason=kwargs["reason"], **options)
+            elif kwargs["sync"]:
+                result = sync_blocks(feed, kwargs["reason"], expires_at, **options)
+            else:
+                result = import_blocks(feed, expires_at, kwargs["reason"] or "", **options)
 
-        blocked, created = BlockedIP.objects.get_or_create(ip_address=ip_address)
-        if created:
-            self.stdout.write(self.style.SUCCESS(f"Successfully blocked IP: {ip_address}"))
+        prefix = "Would have " if kwargs["dry_run"] else ""
+        counts = ", ".join(f"{name} {count}" for name, count in result.items())
+        self.stdout.write(self.style.SUCCESS(f"{prefix}{counts}".capitalize()))
+        if feed.invalid_count:
+            sample = ", ".join(feed.invalid)
+            self.stdout.write(self.style.WARNING(f"Skipped {feed.invalid_count} invalid entries: {sample}"))
+
+    def single(self, value, expires_at, kwargs):
+        try:
+            kind, entry = normalize_entry(value)
+        except ValueError:
+            raise CommandError(f"Invalid IP address or network: {value}")
+
+        label = f"{'IP' if kind == 'ip' else 'network'}: {entry}"
+        options = {"dry_run": kwargs["dry_run"]}
+        done = "Would have" if kwargs["dry_run"] else "Successfully"
+        if kwargs["unblock"]:
+            if unblock([(kind, entry)], reason=kwargs["reason"], **options)["removed"]:
+                self.stdout.write(self.style.SUCCESS(f"{done} unblocked {label}"))
+            else:
+                self.stdout.write(self.style.WARNING(f"{label} is not blocked."))
+            return
+
+        reason = kwargs["reason"] or ""
+        until = "" if expires_at is None else f" until {expires_at:%Y-%m-%d %H:%M:%S} UTC"
+        result = import_blocks([(kind, entry)], expires_at, reason, retag=True, **options)
+        if result["created"]:
+            self.stdout.write(self.style.SUCCESS(f"{done} blocked {label}{until}"))
+        elif result["updated"]:
+            until = until or " permanently"
+            self.stdout.write(self.style.SUCCESS(f"{done} updated the block on {label}{until}"))
         else:
-            self.stdout.write(self.style.WARNING(f"IP {ip_address} is already blocked."))
+            self.stdout.write(self.style.WARNING(f"{label} is already blocked."))
+
+    def lines(self, values, paths, stack):
+        yield from values
+        for path in paths:
+            if path == "-":
+                yield from sys.stdin
+            else:
+                yield from stack.enter_context(open(path, encoding="utf-8", errors="replace"))
+
+    def export(self, path, include_expired):
+        if path == "-":
+            written = export_blocks(self.stdout, include_expired)
+            self.stderr.write(f"Exported {written} entries")
+            return
+        with open(path, "w", encoding="utf-8") as out:
+            written = export_blocks(out, include_expired)
+        self.stdout.write(self.style.SUCCESS(f"Exported {written} entries to {path}"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ip_tracking.retention import purge_request_logs
+
+
+class Command(BaseCommand):
+    help = "Delete (and optionally archive) RequestLog rows older than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help="Keep this many days of logs (default: IP_TRACKING_LOG_RETENTION_DAYS)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=None, help="Rows per id-range chunk")
+        parser.add_argument("--archive", default=None, help="Append purged rows to this .csv.gz file")
+        parser.add_argument("--pause", type=float, default=None, help="Seconds to sleep between chunks")
+        parser.add_argument("--dry-run", action="store_true", help="Count the rows without deleting them")
+
+    def handle(self, *args, **kwargs):
+        if kwargs["days"] is not None and kwargs["days"] < 1:
+            raise CommandError("--days must be at least 1")
+
+        result = purge_request_logs(
+            days=kwargs["days"],
+            chunk_size=kwargs["chunk_size"],
+            archive=kwargs["archive"],
+            pause=kwargs["pause"],
+            dry_run=kwargs["dry_run"],
+        )
+
+        if result["cutoff"] is None:
+            self.stdout.write(self.style.WARNING(
+                "IP_TRACKING_LOG_RETENTION_DAYS is 0 (keep forever); nothing purged. Pass --days to purge anyway."
+            ))
+            return
+
+        verb = "Would purge" if kwargs["dry_run"] else "Purged"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {result['rows']} request log rows older than {result['cutoff']} "
+            f"in {result['chunks']} chunks ({result['seconds']:.2f}s); "
+            f"pruned {result['paths']} unused paths and {result['locations']} locations"
+        ))
@@ -0,0 +1,338 @@
+"""
+Counters and histograms for the request hot path and anomaly detection,
+rendered in the Prometheus text format by metrics_view.
+
+Every metric is declared in this module, so the whole set maps onto one
+fixed array of float64 slots: each labelled series is a precomputed
+offset into it, and recording a value is a bisect over the bucket bounds
+and two in-place additions under a lock. No label tuples, dicts or
+strings are built per observation, and there is no I/O.
+
+With IP_TRACKING_METRICS_DIR set, each process maps its array onto a
+file of its own in that directory (<pid>.metrics), and render() adds up
+every file there, so gunicorn workers (and Celery workers pointed at the
+same directory) are reported as one. Files of exited processes are kept
+so counters never go backwards; empty the directory on deploy. Without
+it the array lives in process memory and only the serving process is
+reported.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+
+HEADER = struct.Struct("8s8s")  # magic, layout digest
+MAGIC = b"IPTMETR1"
+SLOT_SIZE = 8
+FILE_SUFFIX = ".metrics"
+
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+DETECTION_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value):
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    def __init__(self, registry, name, documentation, labels, series):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.series = [tuple(values) for values in series]
+        self.offset = 0
+
+    def _series_offset(self, values):
+        try:
+            return self.offset + self.series.index(values) * self.series_width
+        except ValueError:
+            raise ValueError(f"{self.name} has no series {values!r}")
+
+    def describe(self):
+        return (self.kind, self.name, self.labels, self.series)
+
+    @property
+    def width(self):
+        return len(self.series) * self.series_width
+
+
+class Counter(_Metric):
+    kind = "counter"
+    series_width = 1
+
+    def child(self, *values):
+        return CounterChild(self.registry, self._series_offset(values))
+
+    def render(self, totals):
+        for index, values in enumerate(self.series):
+            value = totals[self.offset + index]
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+
+
+class CounterChild:
+    __slots__ = ("registry", "index")
+
+    def __init__(self, registry, index):
+        self.registry = registry
+        self.index = index
+
+    def inc(self, amount=1):
+        registry = self.registry
+        values = registry.values
+        if values is None:
+            values = registry.open()
+        # Neither addition can raise, so no try/finally (or `with`) overhead.
+        lock = registry.lock
+        lock.acquire()
+        values[self.index] += amount
+        lock.release()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labels, series, buckets):
+        super().__init__(registry, name, documentation, labels, series)
+        self.buckets = tuple(sorted(buckets))
+        # One slot per bucket, one for +Inf, one for the sum.
+        self.series_width = len(self.buckets) + 2
+
+    def child(self, *values):
+        return HistogramChild(self.registry, self._series_offset(values), self.buckets)
+
+    def describe(self):
+        return super().describe() + (self.buckets,)
+
+    def render(self, totals):
+        for index, values in enumerate(self.series):
+            base = self.offset + index * self.series_width
+            count = 0.0
+            for position, bound in enumerate(self.buckets + (float("inf"),)):
+                count += totals[base + position]
+                le = "+Inf" if position == len(self.buckets) else repr(bound)
+                labels = _format_labels(self.labels, values, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {_format_value(count)}"
+            labels = _format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {_format_value(totals[base + self.series_width - 1])}"
+            yield f"{self.name}_count{labels} {_format_value(count)}"
+
+
+class HistogramChild:
+    __slots__ = ("registry", "base", "sum_index", "bounds")
+
+    def __init__(self, registry, base, bounds):
+        self.registry = registry
+        self.base = base
+        self.sum_index = base + len(bounds) + 1
+        self.bounds = bounds
+
+    def observe(self, value):
+        registry = self.registry
+        values = registry.values
+        if values is None:
+            values = registry.open()
+        index = self.base + bisect_left(self.bounds, value)
+        lock = registry.lock
+        lock.acquire()
+        values[index] += 1
+        values[self.sum_index] += value
+        lock.release()
+
+
+class Registry:
+    """A fixed set of metrics backed by one array of float64 slots per process."""
+
+    def __init__(self):
+        self.metrics = []
+        self.size = 0
+        self.values = None
+        self.lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._mmap = None
+
+    def _add(self, metric):
+        metric.offset = self.size
+        self.size += metric.width
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=(), series=((),)):
+        return self._add(Counter(self, name, documentation, labels, series))
+
+    def histogram(self, name, documentation, labels=(), series=((),), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, documentation, labels, series, buckets))
+
+    def directory(self):
+        return getattr(settings, "IP_TRACKING_METRICS_DIR", "")
+
+    def header(self):
+        """File header: a magic string and a digest of the metric layout."""
+        layout = repr([metric.describe() for metric in self.metrics]).encode()
+        return HEADER.pack(MAGIC, hashlib.blake2b(layout, digest_size=8).digest())
+
+    def byte_length(self):
+        return HEADER.size + self.size * SLOT_SIZE
+
+    def open(self):
+        """Map this process's slots (zeroed unless its file already exists)."""
+        with self._open_lock:
+            if self.values is None:
+                self.values = self._map()
+        return self.values
+
+    def _map(self):
+        directory = self.directory()
+        length = self.byte_length()
+        if not directory:
+            return memoryview(bytearray(length))[HEADER.size:].cast("d")
+
+        os.makedirs(directory, exist_ok=True)
+        header = self.header()
+        fd = os.open(os.path.join(directory, f"{os.getpid()}{FILE_SUFFIX}"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != length or os.pread(fd, HEADER.size, 0) != header:
+                # New file, or left by a process with another metric layout.
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, length)
+                os.pwrite(fd, header, 0)
+            self._mmap = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+        return memoryview(self._mmap)[HEADER.size:].cast("d")
+
+    def reset(self):
+        """Forget this process's slots (after a fork, or a settings change)."""
+        self.values = None
+        self._mmap = None
+        self.lock = threading.Lock()
+        self._open_lock = threading.Lock()
+
+    def collect(self):
+        """Slot values summed over every process sharing the directory."""
+        own = self.open()
+        directory = self.directory()
+        if not directory:
+            return own.tolist()
+
+        header = self.header()
+        length = self.byte_length()
+        totals = array("d", bytes(self.size * SLOT_SIZE))
+        for name in os.listdir(directory):
+            if not name.endswith(FILE_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(directory, name), "rb") as handle:
+                    data = handle.read(length + 1)
+            except OSError:
+                continue  # removed meanwhile
+            if len(data) != length or data[:HEADER.size] != header:
+                continue
+            values = array("d", data[HEADER.size:])
+            for index, value in enumerate(values):
+                totals[index] += value
+        return totals
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (0.0.4)."""
+        totals = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(totals))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry.reset)
+
+MIDDLEWARE_STAGES = ("blocklist", "geo_cache", "geo_outbound", "log_write")
+REQUEST_OUTCOMES = ("blocked", "skipped", "logged")
+GEO_CACHE_RESULTS = ("hit", "stale", "miss")
+DETECTION_MODES = ("full", "incremental", "pipeline")
+
+_stage_seconds = registry.histogram(
+    "ip_tracking_middleware_stage_seconds",
+    "Time spent in each stage of IPLoggingMiddleware.",
+    ("stage",), [(stage,) for stage in MIDDLEWARE_STAGES],
+)
+_requests = registry.counter(
+    "ip_tracking_requests_total",
+    "Requests seen by IPLoggingMiddleware, by outcome.",
+    ("outcome",), [(outcome,) for outcome in REQUEST_OUTCOMES],
+)
+_geo_cache = registry.counter(
+    "ip_tracking_geo_cache_lookups_total",
+    "Geolocation cache lookups (in-process, then shared cache), by result.",
+    ("result",), [(result,) for result in GEO_CACHE_RESULTS],
+)
+_detection_runs = registry.counter(
+    "ip_tracking_detection_runs_total",
+    "detect_anomalies runs.",
+    ("mode",), [(mode,) for mode in DETECTION_MODES],
+)
+_detection_rows = registry.counter(
+    "ip_tracking_detection_rows_total",
+    "Request log rows scanned by detect_anomalies.",
+    ("mode",), [(mode,) for mode in DETECTION_MODES],
+)
+_detection_findings = registry.counter(
+    "ip_tracking_detection_findings_total",
+    "Findings recorded by detect_anomalies.",
+    ("mode",), [(mode,) for mode in DETECTION_MODES],
+)
+_detection_seconds = registry.histogram(
+    "ip_tracking_detection_seconds",
+    "Duration of detect_anomalies runs.",
+    ("mode",), [(mode,) for mode in DETECTION_MODES], buckets=DETECTION_BUCKETS,
+)
+
+blocklist_seconds = _stage_seconds.child("blocklist")
+geo_cache_seconds = _stage_seconds.child("geo_cache")
+geo_outbound_seconds = _stage_seconds.child("geo_outbound")
+log_write_seconds = _stage_seconds.child("log_write")
+
+requests_blocked = _requests.child("blocked")
+requests_skipped = _requests.child("skipped")
+requests_logged = _requests.child("logged")
+
+geo_cache_hits = _geo_cache.child("hit")
+geo_cache_stale = _geo_cache.child("stale")
+geo_cache_misses = _geo_cache.child("miss")
+
+_detection = {
+    mode: (
+        _detection_runs.child(mode),
+        _detection_rows.child(mode),
+        _detection_findings.child(mode),
+        _detection_seconds.child(mode),
+    )
+    for mode in DETECTION_MODES
+}
+
+
+def record_detection(mode, rows, findings, seconds):
+    runs, scanned, found, duration = _detection[mode]
+    runs.inc()
+    scanned.inc(rows)
+    found.inc(findings)
+    duration.observe(seconds)
+
+
+def render():
+    return registry.render()
@@ -1,9 +1,18 @@
+from time import perf_counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.http import HttpResponseForbidden
 from django.utils.deprecation import MiddlewareMixin
 from django.utils import timezone
-from django.core.cache import cache
-import requests
-from .models import RequestLog, BlockedIP
+from .blocklist import blocklist
+from .geo import EMPTY_GEO, get_geolocator
+from .iputils import get_trusted_client_ip
+from .interning import insert_request_logs
+from .logwriter import BLOCK, get_log_writer
+from .metrics import blocklist_seconds, log_write_seconds, requests_blocked, requests_logged, requests_skipped
+from .pathrules import get_path_rules
+from .realtime import get_rate_tracker
 
 
 class IPLoggingMiddleware(MiddlewareMixin):
@@ -11,59 +20,149 @@ class IPLoggingMiddleware(MiddlewareMixin):
     Middleware that:
     - Blocks blacklisted IPs
     - Logs request details
-    - Adds geolocation (country, city) with caching
+    - Adds geolocation (country, city) via pluggable backends
+    - Skips or samples logging per path (IP_TRACKING_PATH_RULES); the
+      blocklist still applies to every path
+    - Counts every request in a fixed-memory sketch and flags IPs over
+      IP_TRACKING_REALTIME_THRESHOLD as they cross it (written to
+      SuspiciousIP by a background thread)
+
+    Under ASGI the request is handled natively on the event loop (async
+    blocklist check, async geolocation, non-blocking log enqueue) unless
+    IP_TRACKING_ASYNC_MIDDLEWARE is False, in which case Django runs
+    process_request in a thread as for any sync middleware.
+
+    The blocklist check, geolocation and log write are timed into
+    ip_tracking.metrics histograms.
     """
 
     def get_client_ip(self, request):
-        """Retrieve client IP address (handles proxies)."""
-        x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(",")[0].strip()
-        else:
-            ip = request.META.get("REMOTE_ADDR")
-        return ip
+        """
+        Client IP for blocking, logging and rate tracking: REMOTE_ADDR, or
+        the X-Forwarded-For hop that IP_TRACKING_TRUSTED_PROXIES vouch for.
+        """
+        return get_trusted_client_ip(request)
 
     def get_geolocation(self, ip):
-        """Fetch geolocation data (with 24h cache) using free API."""
-        cache_key = f"geo_{ip}"
-        cached_data = cache.get(cache_key)
-
-        if cached_data:
-            return cached_data
-
-        try:
-            # Using a free IP geolocation API
-            response = requests.get(f"http://ip-api.com/json/{ip}", timeout=5)
-            if response.status_code == 200:
-                data = response.json()
-                geo_data = {
-                    "country": data.get("country"),
-                    "city": data.get("city"),
-                }
-            else:
-                geo_data = {"country": None, "city": None}
-        except Exception:
-            geo_data = {"country": None, "city": None}
+        """Resolve (country, city) through the configured geolocation backends."""
+        return get_geolocator().lookup(ip)
+
+    async def aget_geolocation(self, ip):
+        return await get_geolocator().alookup(ip)
+
+    def track_rate(self, ip):
+        if getattr(settings, "IP_TRACKING_REALTIME_DETECTION", True):
+            get_rate_tracker().hit(ip)
 
-        # Cache for 24 hours
-        cache.set(cache_key, geo_data, timeout=60 * 60 * 24)
-        return geo_data
+    def geo_deferred(self):
+        return getattr(settings, "IP_TRACKING_GEO_MODE", "inline") == "deferred"
+
+    def log_fields(self, request, ip, geo_data):
+        """
+        RequestLog field values in writer order, up to the response
+        status. `geo_data` is None in deferred mode, which leaves the row
+        for enrich_request_logs.
+        """
+        if geo_data is None:
+            return ip, request.path, timezone.now(), None, None, True
+        return ip, request.path, timezone.now(), geo_data.get("country"), geo_data.get("city"), False
+
+    def log_request(self, request, fields, status_code):
+        """Write the RequestLog row now, or hand it to the batch writer."""
+        started = perf_counter()
+        fields = (*fields, status_code)
+        if getattr(settings, "IP_TRACKING_LOG_MODE", "sync") == "buffered":
+            get_log_writer().enqueue(*fields)
+        else:
+            self.write_log(fields)
+        log_write_seconds.observe(perf_counter() - started)
+
+    def write_log(self, fields):
+        """Insert one RequestLog row (paths/locations come from the intern cache)."""
+        insert_request_logs([fields])
 
     def process_request(self, request):
         ip = self.get_client_ip(request)
 
-        # 🚫 Block if IP is blacklisted
-        if BlockedIP.objects.filter(ip_address=ip).exists():
+        # 🚫 Block if IP is blacklisted (in-memory snapshot, no DB query)
+        started = perf_counter()
+        blocked = blocklist.is_blocked(ip)
+        blocklist_seconds.observe(perf_counter() - started)
+        if blocked:
+            requests_blocked.inc()
+            return HttpResponseForbidden("Your IP has been blocked.")
+
+        # 📈 Real-time request-rate tracking (in memory, flags written off-thread)
+        self.track_rate(ip)
+
+        # 🧹 Path exclusion / sampling
+        rule = get_path_rules().match(request.path)
+        if not rule.should_log():
+            requests_skipped.inc()
+            return None
+        requests_logged.inc()
+
+        # 🌍 Geolocation lookup (deferred mode: enrich_request_logs fills it in)
+        if not rule.geolocate:
+            geo_data = EMPTY_GEO
+        else:
+            geo_data = None if self.geo_deferred() else self.get_geolocation(ip)
+
+        # ✅ Log request once the response status is known
+        request._ip_tracking_log = self.log_fields(request, ip, geo_data)
+
+    def process_response(self, request, response):
+        fields = getattr(request, "_ip_tracking_log", None)
+        if fields is not None:
+            self.log_request(request, fields, response.status_code)
+        return response
+
+    async def alog_request(self, request, fields, status_code):
+        started = perf_counter()
+        fields = (*fields, status_code)
+        if getattr(settings, "IP_TRACKING_LOG_MODE", "sync") == "buffered":
+            writer = get_log_writer()
+            if writer.overflow == BLOCK:
+                # A full queue would block the event loop; wait in a thread instead.
+                await sync_to_async(writer.enqueue, thread_sensitive=False)(*fields)
+            else:
+                writer.enqueue(*fields)
+        else:
+            await sync_to_async(self.write_log)(fields)
+        log_write_seconds.observe(perf_counter() - started)
+
+    async def aprocess_request(self, request):
+        ip = self.get_client_ip(request)
+
+        started = perf_counter()
+        blocked = await blocklist.ais_blocked(ip)
+        blocklist_seconds.observe(perf_counter() - started)
+        if blocked:
+            requests_blocked.inc()
             return HttpResponseForbidden("Your IP has been blocked.")
 
-        # 🌍 Geolocation lookup
-        geo_data = self.get_geolocation(ip)
-
-        # ✅ Log request
-        RequestLog.objects.create(
-            ip_address=ip,
-            path=request.path,
-            timestamp=timezone.now(),
-            country=geo_data.get("country"),
-            city=geo_data.get("city"),
-        )
+        self.track_rate(ip)
+
+        rule = get_path_rules().match(request.path)
+        if not rule.should_log():
+            requests_skipped.inc()
+            return None
+        requests_logged.inc()
+
+        if not rule.geolocate:
+            geo_data = EMPTY_GEO
+        else:
+            geo_data = None if self.geo_deferred() else await self.aget_geolocation(ip)
+        request._ip_tracking_log = self.log_fields(request, ip, geo_data)
+
+    async def __acall__(self, request):
+        if not getattr(settings, "IP_TRACKING_ASYNC_MIDDLEWARE", True):
+            return await super().__acall__(request)
+        response = await self.aprocess_request(request)
+        if response is not None:
+            return response
+        response = await self.get_response(request)
+        fields = getattr(request, "_ip_tracking_log", None)
+        if fields is not None:
+            await self.alog_request(request, fields, response.status_code)
+        return response
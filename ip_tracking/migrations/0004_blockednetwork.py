@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0003_suspiciousip_requestlog_city_requestlog_country'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedNetwork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(max_length=49, unique=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0004_blockednetwork'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='geo_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('geo_pending', True)), fields=['ip_address'], name='requestlog_geo_pending_idx'),
+        ),
+    ]
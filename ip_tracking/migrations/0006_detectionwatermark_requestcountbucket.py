@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0005_requestlog_geo_pending_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RequestCountBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField()),
+                ('minute', models.DateTimeField()),
+                ('requests', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['minute'], name='requestcountbucket_minute_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ip_address', 'minute'), name='requestcountbucket_ip_minute_uniq')],
+            },
+        ),
+    ]
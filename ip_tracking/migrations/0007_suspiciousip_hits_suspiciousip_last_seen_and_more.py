@@ -0,0 +1,73 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:41
+
+import re
+
+import django.utils.timezone
+from django.db import migrations, models
+
+SENSITIVE_REASON = re.compile(r"^Accessed sensitive path: (?P<path>.+)$")
+REQUEST_COUNT = re.compile(r"\((?:real-time estimate: )?(?P<hits>\d+) requests\)$")
+
+
+def backfill_keys(apps, schema_editor):
+    """Derive rule/window/hits from the free-text reason and drop duplicates."""
+    SuspiciousIP = apps.get_model("ip_tracking", "SuspiciousIP")
+    seen = {}
+    duplicates = []
+    for row in SuspiciousIP.objects.order_by("detected_at", "id").iterator():
+        sensitive = SENSITIVE_REASON.match(row.reason)
+        count = REQUEST_COUNT.search(row.reason)
+        row.rule = f"sensitive_path:{sensitive['path']}" if sensitive else "rate" if count else "legacy"
+        row.window_start = row.detected_at.replace(minute=0, second=0, microsecond=0)
+        row.hits = int(count["hits"]) if count else 1
+        row.last_seen = row.detected_at
+        key = (row.ip_address, row.rule, row.window_start)
+        first = seen.get(key)
+        if first is None:
+            seen[key] = row
+            continue
+        first.hits = max(first.hits, row.hits)
+        first.last_seen = row.detected_at
+        first.reason = row.reason
+        duplicates.append(row.pk)
+    SuspiciousIP.objects.filter(pk__in=duplicates).delete()
+    SuspiciousIP.objects.bulk_update(
+        seen.values(), ["rule", "window_start", "hits", "last_seen", "reason"], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0006_detectionwatermark_requestcountbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='hits',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='rule',
+            field=models.CharField(default='legacy', max_length=100),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='suspiciousip',
+            name='window_start',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='suspiciousip',
+            constraint=models.UniqueConstraint(fields=('ip_address', 'rule', 'window_start'), name='suspiciousip_ip_rule_window_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0007_suspiciousip_hits_suspiciousip_last_seen_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0009_blockedip_expires_at_blockedip_reason_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['timestamp'], name='requestlog_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['ip_address', 'timestamp'], name='requestlog_ip_timestamp_idx'),
+        ),
+    ]
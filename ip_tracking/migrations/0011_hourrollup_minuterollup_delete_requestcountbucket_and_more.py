@@ -0,0 +1,56 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0010_requestlog_requestlog_timestamp_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('path', models.CharField(max_length=255)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MinuteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('path', models.CharField(max_length=255)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='RequestCountBucket',
+        ),
+        migrations.AddIndex(
+            model_name='hourrollup',
+            index=models.Index(fields=['ip_address', 'bucket'], name='hourrollup_ip_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourrollup',
+            constraint=models.UniqueConstraint(fields=('bucket', 'ip_address', 'path', 'country'), name='hourrollup_key_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='minuterollup',
+            index=models.Index(fields=['ip_address', 'bucket'], name='minuterollup_ip_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='minuterollup',
+            constraint=models.UniqueConstraint(fields=('bucket', 'ip_address', 'path', 'country'), name='minuterollup_key_uniq'),
+        ),
+    ]
@@ -0,0 +1,225 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:12
+
+import socket
+
+import django.db.models.deletion
+import django.utils.timezone
+import ip_tracking.fields
+from django.db import migrations, models
+
+CHUNK = 5000
+
+
+def _pack(ip):
+    try:
+        return socket.inet_pton(socket.AF_INET6 if ":" in ip else socket.AF_INET, ip)
+    except (OSError, TypeError, ValueError):
+        return b""
+
+
+def _unpack(packed):
+    packed = bytes(packed)
+    if len(packed) not in (4, 16):
+        return ""
+    return socket.inet_ntop(socket.AF_INET if len(packed) == 4 else socket.AF_INET6, packed)
+
+
+def _intern(model, keys, fields, cache):
+    missing = [key for key in keys if key not in cache]
+    if missing:
+        model.objects.bulk_create(
+            [model(**dict(zip(fields, key))) for key in missing], ignore_conflicts=True
+        )
+        for row in model.objects.values_list("id", *fields).iterator():
+            cache[row[1:]] = row[0]
+
+
+def compact_rows(apps, schema_editor):
+    """Pack IPs and timestamps and point every row at its interned path and location."""
+    RequestLog = apps.get_model("ip_tracking", "RequestLog")
+    LogPath = apps.get_model("ip_tracking", "LogPath")
+    GeoLocation = apps.get_model("ip_tracking", "GeoLocation")
+    paths, locations = {}, {}
+    last_id = 0
+    while True:
+        rows = list(
+            RequestLog.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "ip_address", "timestamp", "path", "country", "city")[:CHUNK]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        _intern(LogPath, {(row[3][:255],) for row in rows}, ("path",), paths)
+        wanted = {(row[4] or "", row[5] or "") for row in rows} - {("", "")}
+        _intern(GeoLocation, wanted, ("country", "city"), locations)
+        RequestLog.objects.bulk_update(
+            [
+                RequestLog(
+                    id=row_id,
+                    ip=_pack(ip),
+                    timestamp_us=timestamp,
+                    path_ref_id=paths[(path[:255],)],
+                    location_id=locations.get((country or "", city or "")),
+                )
+                for row_id, ip, timestamp, path, country, city in rows
+            ],
+            ["ip", "timestamp_us", "path_ref", "location"],
+            batch_size=500,
+        )
+
+
+def expand_rows(apps, schema_editor):
+    RequestLog = apps.get_model("ip_tracking", "RequestLog")
+    last_id = 0
+    while True:
+        rows = list(
+            RequestLog.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "ip", "timestamp_us", "path_ref__path", "location__country", "location__city")[
+                :CHUNK
+            ]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        RequestLog.objects.bulk_update(
+            [
+                RequestLog(
+                    id=row_id, ip_address=_unpack(ip), timestamp=timestamp, path=path, country=country, city=city
+                )
+                for row_id, ip, timestamp, path, country, city in rows
+            ],
+            ["ip_address", "timestamp", "path", "country", "city"],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0011_hourrollup_minuterollup_delete_requestcountbucket_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeoLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('country', 'city'), name='geolocation_country_city_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LogPath',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='requestlog_timestamp_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='requestlog_ip_timestamp_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='requestlog',
+            name='requestlog_geo_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='ip',
+            field=models.BinaryField(default=b'', max_length=16),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='timestamp_us',
+            field=ip_tracking.fields.EpochMicrosecondsField(null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='path_ref',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.logpath'),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='location',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.geolocation'),
+        ),
+        # Nullable before the copy, so that unapplying can re-add and refill them.
+        migrations.AlterField(
+            model_name='requestlog',
+            name='ip_address',
+            field=models.GenericIPAddressField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(compact_rows, expand_rows),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='ip_address',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='timestamp',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='path',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='country',
+        ),
+        migrations.RemoveField(
+            model_name='requestlog',
+            name='city',
+        ),
+        migrations.RenameField(
+            model_name='requestlog',
+            old_name='timestamp_us',
+            new_name='timestamp',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='timestamp',
+            field=ip_tracking.fields.EpochMicrosecondsField(default=django.utils.timezone.now),
+        ),
+        migrations.RenameField(
+            model_name='requestlog',
+            old_name='path_ref',
+            new_name='path',
+        ),
+        migrations.AlterField(
+            model_name='requestlog',
+            name='path',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='ip_tracking.logpath'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['timestamp'], name='requestlog_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['ip', 'timestamp'], name='requestlog_ip_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('geo_pending', True)), fields=['ip'], name='requestlog_geo_pending_idx'),
+        ),
+    ]
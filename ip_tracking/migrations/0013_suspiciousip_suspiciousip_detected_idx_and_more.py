@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0012_geolocation_logpath_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='suspiciousip',
+            index=models.Index(fields=['detected_at'], name='suspiciousip_detected_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='suspiciousip',
+            index=models.Index(fields=['last_seen'], name='suspiciousip_last_seen_idx'),
+        ),
+    ]
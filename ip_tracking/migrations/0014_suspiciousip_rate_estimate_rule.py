@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:40
+
+from django.db import migrations
+
+REALTIME_REASON = "(real-time estimate: "
+
+
+def retag_estimates(apps, schema_editor):
+    """Realtime findings were stored as "rate"; move them to "rate_estimate"."""
+    SuspiciousIP = apps.get_model("ip_tracking", "SuspiciousIP")
+    SuspiciousIP.objects.filter(rule="rate", reason__contains=REALTIME_REASON).update(rule="rate_estimate")
+
+
+def untag_estimates(apps, schema_editor):
+    SuspiciousIP = apps.get_model("ip_tracking", "SuspiciousIP")
+    exact = SuspiciousIP.objects.filter(rule="rate")
+    for row in SuspiciousIP.objects.filter(rule="rate_estimate").iterator():
+        if exact.filter(ip_address=row.ip_address, window_start=row.window_start).exists():
+            row.delete()  # the exact count of that window is kept
+        else:
+            row.rule = "rate"
+            row.save(update_fields=["rule"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0013_suspiciousip_suspiciousip_detected_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(retag_estimates, untag_estimates),
+    ]
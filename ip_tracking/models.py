@@ -1,13 +1,61 @@
 from django.db import models
 from django.utils import timezone
 
+from .fields import EpochMicrosecondsField
+from .iputils import unpack_ip
+
+
+class LogPath(models.Model):
+    """Interned request path, referenced by RequestLog; see ip_tracking.interning."""
+    path = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return self.path
+
+
+class GeoLocation(models.Model):
+    """Interned (country, city) pair, referenced by RequestLog."""
+    country = models.CharField(max_length=100, blank=True, default="")
+    city = models.CharField(max_length=100, blank=True, default="")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["country", "city"], name="geolocation_country_city_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.city}, {self.country}" if self.city else self.country
+
 
 class RequestLog(models.Model):
-    ip_address = models.GenericIPAddressField()
-    timestamp = models.DateTimeField(default=timezone.now)
-    path = models.CharField(max_length=255)
-    country = models.CharField(max_length=100, blank=True, null=True)  # 🌍 new
-    city = models.CharField(max_length=100, blank=True, null=True)      # 🌍 new
+    """
+    One logged request, in compact form: the client IP packed to 4/16
+    bytes, the timestamp as integer microseconds, and the path and
+    location as ids into small interned tables.
+    """
+    ip = models.BinaryField(max_length=16)  # iputils.pack_ip
+    timestamp = EpochMicrosecondsField(default=timezone.now)
+    path = models.ForeignKey(LogPath, on_delete=models.PROTECT, related_name="+", db_index=False)
+    location = models.ForeignKey(  # None = unknown, or not resolved yet (geo_pending)
+        GeoLocation, on_delete=models.PROTECT, related_name="+", db_index=False, blank=True, null=True
+    )
+    geo_pending = models.BooleanField(default=False)  # set in deferred geo mode
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["timestamp"], name="requestlog_timestamp_idx"),
+            models.Index(fields=["ip", "timestamp"], name="requestlog_ip_timestamp_idx"),
+            models.Index(
+                fields=["ip"],
+                condition=models.Q(geo_pending=True),
+                name="requestlog_geo_pending_idx",
+            ),
+        ]
+
+    @property
+    def ip_address(self):
+        return unpack_ip(self.ip)
 
     def __str__(self):
         return f"{self.ip_address} - {self.path} at {self.timestamp}"
@@ -15,15 +63,90 @@ class RequestLog(models.Model):
 
 class BlockedIP(models.Model):
     ip_address = models.GenericIPAddressField(unique=True)
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)  # None = permanent
+    reason = models.TextField(blank=True, default="")
 
     def __str__(self):
         return f"Blocked: {self.ip_address}"
 
 
+class BlockedNetwork(models.Model):
+    network = models.CharField(max_length=49, unique=True)  # CIDR, e.g. "10.0.0.0/16"
+    expires_at = models.DateTimeField(blank=True, null=True, db_index=True)  # None = permanent
+    reason = models.TextField(blank=True, default="")
+
+    def __str__(self):
+        return f"Blocked: {self.network}"
+
+
+class TrafficRollup(models.Model):
+    """Request counts per (bucket, IP, path, country); see ip_tracking.rollups."""
+    bucket = models.DateTimeField()
+    ip_address = models.GenericIPAddressField()
+    path = models.CharField(max_length=255)
+    country = models.CharField(max_length=100, blank=True, default="")  # "" = unknown
+    requests = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)  # 4xx responses
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.ip_address} {self.path} - {self.requests} at {self.bucket}"
+
+
+class MinuteRollup(TrafficRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "ip_address", "path", "country"], name="minuterollup_key_uniq"
+            ),
+        ]
+        indexes = [models.Index(fields=["ip_address", "bucket"], name="minuterollup_ip_bucket_idx")]
+
+
+class HourRollup(TrafficRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "ip_address", "path", "country"], name="hourrollup_key_uniq"
+            ),
+        ]
+        indexes = [models.Index(fields=["ip_address", "bucket"], name="hourrollup_ip_bucket_idx")]
+
+
+class DetectionWatermark(models.Model):
+    """Last RequestLog id consumed by an incremental job."""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+
+
 class SuspiciousIP(models.Model):
+    """One finding per (IP, detector rule, hourly window), updated in place."""
     ip_address = models.GenericIPAddressField()
+    rule = models.CharField(max_length=100)  # e.g. "rate", "rate_estimate", "sensitive_path:/login"
+    window_start = models.DateTimeField()
+    hits = models.PositiveIntegerField(default=1)
     reason = models.TextField()
-    detected_at = models.DateTimeField(default=timezone.now)
+    detected_at = models.DateTimeField(default=timezone.now)  # first sighting
+    last_seen = models.DateTimeField(default=timezone.now)
+    escalated_at = models.DateTimeField(blank=True, null=True)  # last promoted to a block
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ip_address", "rule", "window_start"],
+                name="suspiciousip_ip_rule_window_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["detected_at"], name="suspiciousip_detected_idx"),
+            models.Index(fields=["last_seen"], name="suspiciousip_last_seen_idx"),
+        ]
 
     def __str__(self):
         return f"{self.ip_address} - {self.reason}"
\ No newline at end of file
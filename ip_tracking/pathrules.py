@@ -0,0 +1,106 @@
+import random
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+_TERMINAL = ""  # trie key marking the end of a prefix (paths never contain "")
+
+
+class PathRule:
+    __slots__ = ("pattern", "sample_rate", "geolocate")
+
+    def __init__(self, pattern, sample_rate=1.0, geolocate=True):
+        self.pattern = pattern
+        self.sample_rate = sample_rate
+        self.geolocate = geolocate
+
+    def should_log(self, _random=random.random):
+        rate = self.sample_rate
+        return rate >= 1.0 or (rate > 0.0 and _random() < rate)
+
+    def __repr__(self):
+        return f"PathRule({self.pattern!r}, sample_rate={self.sample_rate}, geolocate={self.geolocate})"
+
+
+class PathRules:
+    """
+    Decides per request whether to log/geolocate it, from IP_TRACKING_PATH_RULES.
+
+    Each rule has either a "prefix" or a "regex", plus an optional
+    "sample_rate" (0 excludes the path, 1 logs everything) and
+    "geolocate" flag. Prefixes live in a character trie, so the
+    longest matching prefix is found in one walk bounded by the path
+    length, not the number of rules. Regexes are compiled into a single
+    alternation and only consulted when no prefix matched; the first
+    listed regex wins. Unmatched paths use `default`.
+    """
+
+    def __init__(self, rules=(), default_sample_rate=1.0):
+        self.default = PathRule(None, default_sample_rate)
+        self._trie = {}
+        self._regex_rules = {}
+        alternatives = []
+        for index, spec in enumerate(rules):
+            rule = PathRule(
+                spec.get("prefix") or spec.get("regex"),
+                float(spec.get("sample_rate", 1.0)),
+                bool(spec.get("geolocate", True)),
+            )
+            if "prefix" in spec:
+                node = self._trie
+                for char in spec["prefix"]:
+                    node = node.setdefault(char, {})
+                node[_TERMINAL] = rule
+            elif "regex" in spec:
+                group = f"r{index}"
+                alternatives.append(f"(?P<{group}>{spec['regex']})")
+                self._regex_rules[group] = rule
+            else:
+                raise ImproperlyConfigured(f"Path rule needs a 'prefix' or 'regex': {spec!r}")
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            getattr(settings, "IP_TRACKING_PATH_RULES", ()),
+            default_sample_rate=getattr(settings, "IP_TRACKING_DEFAULT_SAMPLE_RATE", 1.0),
+        )
+
+    def match(self, path):
+        """Return the PathRule that applies to `path`."""
+        node = self._trie
+        best = None
+        for char in path:
+            node = node.get(char)
+            if node is None:
+                break
+            rule = node.get(_TERMINAL)
+            if rule is not None:
+                best = rule
+        if best is not None:
+            return best
+        if self._regex is not None:
+            match = self._regex.match(path)
+            if match is not None:
+                return self._regex_rules[match.lastgroup]
+        return self.default
+
+
+_path_rules = None
+_path_rules_lock = threading.Lock()
+
+
+def get_path_rules():
+    global _path_rules
+    if _path_rules is None:
+        with _path_rules_lock:
+            if _path_rules is None:
+                _path_rules = PathRules.from_settings()
+    return _path_rules
+
+
+def reset_path_rules():
+    global _path_rules
+    _path_rules = None
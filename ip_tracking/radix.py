@@ -0,0 +1,102 @@
+"""
+Longest-prefix matching of IPv4/IPv6 networks over sorted ranges.
+
+Two prefixes are either disjoint or one contains the other, so a set of
+them splits the address space into consecutive ranges, each covered by
+one most specific prefix (or none). Those ranges are kept as a sorted
+list of start addresses with the matching network alongside, plus a
+directory indexed by the top bits of an address (about 16 ranges per
+entry) giving the slice of the list to search. A lookup is one shift,
+two list reads and a bisect over that short slice, all in C: no per-bit
+or per-node work in Python, and a near constant number of comparisons
+however many prefixes are loaded. Inserting only records the prefix;
+the ranges are rebuilt, in O(n log n), on the first lookup after a
+change, so load every prefix before matching.
+"""
+import ipaddress
+from bisect import bisect_left, bisect_right
+
+
+class PrefixTable:
+    """Longest-prefix matcher for integer keys of a fixed bit width."""
+
+    def __init__(self, width):
+        self.width = width
+        self._prefixes = {}
+        self._ranges = None
+
+    def __len__(self):
+        return len(self._prefixes)
+
+    def insert(self, key, prefix_length, network=None):
+        """Store the prefix `key/prefix_length`; `network` is returned on match."""
+        host_bits = self.width - prefix_length
+        key = key >> host_bits << host_bits
+        self._prefixes[key, prefix_length] = (key, prefix_length) if network is None else network
+        self._ranges = None
+
+    def _build(self):
+        starts, networks = [], []
+
+        def mark(start, network):
+            # From `start` on, `network` is the most specific match.
+            if starts and starts[-1] == start:
+                networks[-1] = network
+            elif not networks or networks[-1] is not network:
+                starts.append(start)
+                networks.append(network)
+
+        width = self.width
+        open_ranges = []  # enclosing prefixes, innermost last: (end, network)
+        for (start, length), network in sorted(self._prefixes.items()):
+            while open_ranges and open_ranges[-1][0] <= start:
+                end, _ = open_ranges.pop()
+                mark(end, open_ranges[-1][1] if open_ranges else None)
+            mark(start, network)
+            open_ranges.append((start + (1 << (width - length)), network))
+        while open_ranges:
+            end, _ = open_ranges.pop()
+            mark(end, open_ranges[-1][1] if open_ranges else None)
+
+        bits = min(16, width, max(0, len(starts).bit_length() - 4))
+        shift = width - bits
+        directory = [bisect_left(starts, bucket << shift) for bucket in range(1 << bits)]
+        directory.append(len(starts))
+        return starts, networks, shift, directory
+
+    def longest_match(self, key):
+        """Return the most specific stored network containing `key`, or None."""
+        ranges = self._ranges
+        if ranges is None:
+            ranges = self._ranges = self._build()
+        starts, networks, shift, directory = ranges
+        bucket = key >> shift
+        index = bisect_right(starts, key, directory[bucket], directory[bucket + 1])
+        return networks[index - 1] if index else None
+
+
+class NetworkMatcher:
+    """IPv4 + IPv6 prefix matcher over `ipaddress` networks."""
+
+    def __init__(self, networks=()):
+        self._tables = {4: PrefixTable(32), 6: PrefixTable(128)}
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return sum(len(table) for table in self._tables.values())
+
+    def add(self, network):
+        network = ipaddress.ip_network(network, strict=False)
+        self._tables[network.version].insert(
+            int(network.network_address), network.prefixlen, network
+        )
+
+    def longest_match(self, address):
+        """Return the most specific network containing `address` (or None)."""
+        if not isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = ipaddress.ip_address(address)
+        return self._tables[address.version].longest_match(int(address))
+
+    def __contains__(self, address):
+        return self.longest_match(address) is not None
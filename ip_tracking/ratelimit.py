@@ -0,0 +1,287 @@
+"""
+Built-in rate limiting for ip_tracking (no Redis or django_ratelimit needed).
+
+Use it per view:
+
+    @ratelimit(key="ip", rate="5/m", method="POST")
+    def login_view(request): ...
+
+or for whole path prefixes with RateLimitMiddleware and
+IP_TRACKING_RATE_LIMITS. Counters live in-process by default
+(IP_TRACKING_RATELIMIT_STORE = "local", one node) or in the shared Django
+cache ("cache", multi-worker).
+
+The "ip" key is REMOTE_ADDR; X-Forwarded-For is only used when the
+request comes from one of IP_TRACKING_TRUSTED_PROXIES (see
+iputils.get_trusted_client_ip), so a client cannot get a fresh counter
+per request by sending a made-up header.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+
+from .iputils import get_trusted_client_ip
+
+TOKEN_BUCKET = "token_bucket"
+SLIDING_LOG = "sliding_log"
+SLIDING_WINDOW = "sliding_window"
+
+ALL = None  # ratelimit(method=ALL) limits every HTTP method
+
+_PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+_RATE_RE = re.compile(r"^(\d+)/(\d*)([smhd])$")
+
+RateLimitResult = namedtuple("RateLimitResult", "allowed limit remaining retry_after")
+
+
+def parse_rate(rate):
+    """Parse "5/m", "100/h" or "10/30s" into (limit, period_seconds)."""
+    match = _RATE_RE.match(rate)
+    if match is None:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}; expected e.g. '5/m' or '10/30s'")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * _PERIODS[unit]
+
+
+def get_key(request, key):
+    if callable(key):
+        return key(request)
+    if key == "ip":
+        return get_trusted_client_ip(request)
+    if key == "user_or_ip":
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return get_trusted_client_ip(request)
+    raise ImproperlyConfigured(f"Unknown rate limit key {key!r}")
+
+
+class LocalStore:
+    """
+    In-process counters for single-node deployments.
+
+    Supports token bucket and sliding-window log. State is kept per key
+    in an LRU-ordered dict capped at `max_keys` (the least recently
+    checked keys are evicted, so a flood of new addresses cannot reset
+    the counters of the ones being limited), so memory stays bounded
+    under IP churn.
+    """
+
+    algorithms = (TOKEN_BUCKET, SLIDING_LOG)
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._state = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, factory):
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = factory()
+            if len(self._state) > self.max_keys:
+                self._state.popitem(last=False)
+        else:
+            self._state.move_to_end(key)
+        return state
+
+    def hit(self, algorithm, key, limit, period, now):
+        with self._lock:
+            if algorithm == TOKEN_BUCKET:
+                return self._token_bucket(key, limit, period, now)
+            return self._sliding_log(key, limit, period, now)
+
+    def _token_bucket(self, key, limit, period, now):
+        # state = [tokens, last_refill]
+        state = self._get(key, lambda: [float(limit), now])
+        tokens = min(limit, state[0] + (now - state[1]) * limit / period)
+        state[1] = now
+        if tokens >= 1:
+            state[0] = tokens - 1
+            return RateLimitResult(True, limit, int(tokens - 1), 0.0)
+        state[0] = tokens
+        return RateLimitResult(False, limit, 0, (1 - tokens) * period / limit)
+
+    def _sliding_log(self, key, limit, period, now):
+        log = self._get(key, deque)
+        horizon = now - period
+        while log and log[0] <= horizon:
+            log.popleft()
+        if len(log) < limit:
+            log.append(now)
+            return RateLimitResult(True, limit, limit - len(log), 0.0)
+        return RateLimitResult(False, limit, 0, log[0] + period - now)
+
+    def clear(self):
+        with self._lock:
+            self._state.clear()
+
+
+class CacheStore:
+    """
+    Counters in a shared Django cache, for multi-worker deployments.
+
+    Uses a sliding-window counter: one atomic cache.incr per check on the
+    current fixed window, weighted with the previous window's total. incr
+    is atomic on Redis/Memcached; FileBasedCache implements it as get+set,
+    so counts can be slightly low under contention there.
+    """
+
+    algorithms = (SLIDING_WINDOW,)
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    def hit(self, algorithm, key, limit, period, now):
+        cache = caches[self.alias]
+        window = int(now // period)
+        current_key = f"rl:{key}:{window}"
+        previous_key = f"rl:{key}:{window - 1}"
+        cache.add(current_key, 0, timeout=period * 2)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:  # evicted between add and incr
+            cache.set(current_key, 1, timeout=period * 2)
+            current = 1
+        previous = cache.get(previous_key, 0)
+        weight = 1 - (now - window * period) / period
+        count = previous * weight + current
+        if count <= limit:
+            return RateLimitResult(True, limit, int(limit - count), 0.0)
+        return RateLimitResult(False, limit, 0, (window + 1) * period - now)
+
+
+_local_store = LocalStore()
+
+
+def get_store():
+    name = getattr(settings, "IP_TRACKING_RATELIMIT_STORE", "local")
+    if name == "local":
+        return _local_store
+    if name == "cache":
+        return CacheStore(getattr(settings, "IP_TRACKING_RATELIMIT_CACHE", "default"))
+    raise ImproperlyConfigured(f"Unknown IP_TRACKING_RATELIMIT_STORE {name!r}")
+
+
+class RateLimiter:
+    """
+    One limit (`rate` per `key`) in its own counter namespace (`group`).
+
+    `algorithm` defaults to token bucket on the local store and the
+    sliding-window counter on the cache store.
+    """
+
+    def __init__(self, rate, key="ip", group=None, algorithm=None, store=None):
+        self.rate = rate
+        self.limit, self.period = parse_rate(rate)
+        self.key = key
+        self.group = group or f"{key}:{rate}"
+        self.algorithm = algorithm
+        self.store = store
+
+    def check(self, request, now=None):
+        return self.check_key(get_key(request, self.key), now)
+
+    def check_key(self, key, now=None):
+        store = self.store or get_store()
+        algorithm = self.algorithm or store.algorithms[0]
+        if algorithm not in store.algorithms:
+            raise ImproperlyConfigured(
+                f"{type(store).__name__} does not support the {algorithm!r} algorithm"
+            )
+        return store.hit(
+            algorithm,
+            f"{self.group}:{key}",
+            self.limit,
+            self.period,
+            time.time() if now is None else now,
+        )
+
+
+def is_enabled():
+    return getattr(settings, "RATELIMIT_ENABLE", True)
+
+
+def limited_response(result):
+    response = JsonResponse(
+        {"status": "error", "message": "Rate limit exceeded"},
+        status=429,
+    )
+    response["Retry-After"] = str(max(1, int(result.retry_after + 0.999)))
+    return response
+
+
+def ratelimit(key="ip", rate="5/m", method=ALL, block=True, group=None, algorithm=None):
+    """
+    View decorator. Over the limit, returns 429 (block=True) or sets
+    ``request.limited = True`` and calls the view anyway.
+    """
+    methods = None if method is ALL else {m.upper() for m in ([method] if isinstance(method, str) else method)}
+
+    def decorator(view):
+        limiter = RateLimiter(
+            rate,
+            key=key,
+            group=group or f"{view.__module__}.{view.__qualname__}:{key}:{rate}",
+            algorithm=algorithm,
+        )
+
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if is_enabled() and (methods is None or request.method in methods):
+                result = limiter.check(request)
+                if not result.allowed:
+                    if block:
+                        return limited_response(result)
+                    request.limited = True
+            return view(request, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+class RateLimitMiddleware:
+    """
+    Applies IP_TRACKING_RATE_LIMITS to matching path prefixes, e.g.
+
+        IP_TRACKING_RATE_LIMITS = [
+            {"prefix": "/api/", "rate": "100/m", "key": "ip"},
+            {"prefix": "/login/", "rate": "5/m", "key": "ip", "method": "POST"},
+        ]
+
+    Every matching rule is checked. Place it after AuthenticationMiddleware
+    when using the "user_or_ip" key.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rules = []
+        for index, spec in enumerate(getattr(settings, "IP_TRACKING_RATE_LIMITS", ())):
+            method = spec.get("method")
+            self.rules.append((
+                spec["prefix"],
+                None if method is None else {method.upper()},
+                RateLimiter(
+                    spec["rate"],
+                    key=spec.get("key", "ip"),
+                    group=f"mw{index}:{spec['prefix']}",
+                    algorithm=spec.get("algorithm"),
+                ),
+            ))
+
+    def __call__(self, request):
+        if is_enabled():
+            path = request.path
+            for prefix, methods, limiter in self.rules:
+                if path.startswith(prefix) and (methods is None or request.method in methods):
+                    result = limiter.check(request)
+                    if not result.allowed:
+                        return limited_response(result)
+        return self.get_response(request)
@@ -0,0 +1,192 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .findings import RULE_RATE_ESTIMATE, Finding, record_findings, window_start
+from .lru import LRUCache
+from .sketch import SlidingCountMinSketch
+
+logger = logging.getLogger(__name__)
+
+
+class SuspiciousIPEmitter:
+    """
+    Upserts findings into SuspiciousIP from a daemon thread so the
+    request path never touches the database. Rows queued beyond `max_queue` are
+    dropped (counted in `dropped`).
+    """
+
+    def __init__(self, max_queue=1000, flush_interval=1.0):
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.emitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def emit(self, finding):
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._queue.append(finding)
+            self.emitted += 1
+            self._cond.notify()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="suspicious-ip-emitter", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        with self._cond:
+            batch = list(self._queue)
+            self._queue.clear()
+        if not batch:
+            return 0
+        try:
+            close_old_connections()
+            record_findings(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d suspicious IP rows", len(batch))
+            return 0
+        self.written += len(batch)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._queue and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            self.flush()
+
+
+class RateTracker:
+    """
+    Flags an IP the moment its request count over the last `window`
+    seconds goes above `threshold`.
+
+    Counts come from a SlidingCountMinSketch, so memory stays fixed no
+    matter how many distinct IPs are seen; flagged IPs are remembered in
+    a bounded LRU for one window so each is reported once. Because the
+    sketch can only overcount, no IP over the threshold is missed, but a
+    light IP sharing counters with heavy ones can be flagged early; size
+    `width` for the expected traffic. Its findings are therefore recorded
+    under RULE_RATE_ESTIMATE, which escalation never acts on.
+
+    With `sketch_file` every process opening that file counts into the
+    same sketch, so an IP is flagged once all workers together have seen
+    `threshold` requests from it. Without it each process counts only
+    the requests it serves: behind N workers an IP can make up to about
+    N x `threshold` requests before one of them flags it. Flagged IPs are
+    remembered per process either way, so each worker may report the
+    same IP once; findings are upserted, so that adds no rows.
+    """
+
+    def __init__(self, threshold=100, window=3600, slices=6, width=2 ** 15, depth=4,
+                 max_flagged=10000, emitter=None, sketch_file=None):
+        self.threshold = threshold
+        self.window = window
+        self.sketch = SlidingCountMinSketch(
+            width=width, depth=depth, window=window, slices=slices, path=sketch_file,
+        )
+        self.flagged = LRUCache(maxsize=max_flagged, ttl=window)
+        self.emitter = emitter
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    @classmethod
+    def from_settings(cls, emitter=None):
+        return cls(
+            threshold=getattr(settings, "IP_TRACKING_REALTIME_THRESHOLD", 100),
+            window=getattr(settings, "IP_TRACKING_REALTIME_WINDOW", 3600),
+            slices=getattr(settings, "IP_TRACKING_REALTIME_SLICES", 6),
+            width=getattr(settings, "IP_TRACKING_REALTIME_SKETCH_WIDTH", 2 ** 15),
+            depth=getattr(settings, "IP_TRACKING_REALTIME_SKETCH_DEPTH", 4),
+            emitter=emitter,
+            sketch_file=getattr(settings, "IP_TRACKING_REALTIME_SKETCH_FILE", ""),
+        )
+
+    def hit(self, ip, now=None):
+        """Count one request from `ip`; returns True if this request flagged it."""
+        with self._lock:
+            self.hits += 1
+            estimate = self.sketch.add(ip, time.time() if now is None else now)
+        if estimate <= self.threshold or self.flagged.get(ip) is not None:
+            return False
+        self.flagged.set(ip, estimate)
+        if self.emitter is not None:
+            period = "hour" if self.window == 3600 else f"{self.window} seconds"
+            seen_at = timezone.now()
+            self.emitter.emit(Finding(
+                ip, RULE_RATE_ESTIMATE, window_start(seen_at), estimate,
+                f"Exceeded {self.threshold} requests in the past {period} "
+                f"(real-time estimate: {estimate} requests)",
+                seen_at,
+            ))
+        return True
+
+    def close(self):
+        self.sketch.close()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "flagged": len(self.flagged),
+            "sketch_bytes": self.sketch.nbytes,
+        }
+
+
+_tracker = None
+_tracker_pid = None
+_tracker_lock = threading.Lock()
+
+
+def get_rate_tracker():
+    """Return this process's tracker (re-created after a fork, like the log writer)."""
+    global _tracker, _tracker_pid
+    pid = os.getpid()
+    if _tracker is None or _tracker_pid != pid:
+        with _tracker_lock:
+            if _tracker is None or _tracker_pid != pid:
+                emitter = SuspiciousIPEmitter()
+                emitter.start()
+                atexit.register(emitter.stop)
+                _tracker, _tracker_pid = RateTracker.from_settings(emitter), pid
+    return _tracker
+
+
+def reset_rate_tracker():
+    global _tracker
+    with _tracker_lock:
+        if _tracker is not None:
+            if _tracker.emitter is not None:
+                _tracker.emitter.stop()
+            if _tracker_pid == os.getpid():
+                _tracker.close()
+        _tracker = None
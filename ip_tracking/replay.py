@@ -0,0 +1,347 @@
+"""
+Replays request traces through the full MIDDLEWARE chain and measures
+what it costs (see the replay_traffic command).
+
+A trace is any iterable of TraceRequest(method, path, ip). load_trace()
+reads one from JSON lines ({"ip": ..., "path": ..., "method": ...};
+"ip_address" is accepted too, so a /api/v1/request-logs/?export=ndjson
+dump replays as-is), synthetic_trace() generates one with a given
+number of client IPs, a weighted path mix and a skewed IP popularity.
+
+Requests go through Django's test Client or straight into the
+WSGIHandler, so every middleware, URL resolution and view runs as in
+production. Geolocation is answered by StubGeoBackend, a "remote"
+backend that returns deterministic locations after an optional delay,
+so the geolocator's caches behave as they would with a real provider.
+Queries are counted on the replaying thread's connection; rows written
+by the buffered log writer's thread are reported from its own stats.
+
+The middleware writes RequestLogs, findings, geolocation entries and
+rate-limit counters, so by default replay() runs inside isolated(): a
+freshly migrated test database (the test runner's, dropped afterwards)
+and a local-memory cache, with the per-process state loaded from the
+real ones reset. Pass isolate=False only when the settings already
+point at throwaway stores (benchmarks.settings, a test case).
+"""
+import json
+import logging
+import random
+import time
+import zlib
+from collections import Counter, namedtuple
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client, override_settings
+
+from .blocklist import blocklist
+from .geo import GeoBackend, get_geolocator, reset_geolocator
+from .interning import get_location_interner, get_path_interner, reset_interners
+from .logwriter import get_log_writer
+from .realtime import reset_rate_tracker
+
+TraceRequest = namedtuple("TraceRequest", "method path ip")
+
+STUB_GEO_BACKEND = "ip_tracking.replay.StubGeoBackend"
+HOST = "testserver"
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+ISOLATED_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "replay"}}
+
+
+def load_trace(lines):
+    """TraceRequests from JSON lines; raises ValueError naming the bad line."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            ip = record.get("ip") or record["ip_address"]
+            yield TraceRequest(record.get("method", "GET").upper(), record["path"], ip)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise ValueError(f"line {number}: expected a JSON object with ip and path")
+
+
+def parse_path_mix(spec):
+    """
+    Paths and weights from "path=weight,path=weight" (weight defaults
+    to 1); raises ValueError.
+    """
+    paths, weights = [], []
+    for item in spec.split(","):
+        path, _, weight = item.strip().partition("=")
+        if not path.startswith("/"):
+            raise ValueError(f"path must start with '/': {path!r}")
+        paths.append(path)
+        weights.append(float(weight) if weight else 1.0)
+    if not paths or sum(weights) <= 0:
+        raise ValueError("the path mix needs a positive total weight")
+    return paths, weights
+
+
+def synthetic_trace(requests, ips, paths, weights=None, skew=1.2, seed=42):
+    """
+    `requests` GET requests from `ips` distinct addresses. With `skew`
+    > 0 IP popularity follows a Pareto distribution of that shape (a few
+    heavy hitters, a long tail); with 0 it is uniform.
+    """
+    rng = random.Random(seed)
+    pool = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in rng.sample(range(1, 1 << 24), ips)]
+    for _ in range(requests):
+        index = min(int(rng.paretovariate(skew)) - 1, ips - 1) if skew > 0 else rng.randrange(ips)
+        yield TraceRequest("GET", rng.choices(paths, weights)[0], pool[index])
+
+
+class StubGeoBackend(GeoBackend):
+    """Deterministic stand-in for a geolocation provider (no network)."""
+
+    remote = True
+    latency = 0.0
+
+    def lookup(self, ip):
+        if self.latency:
+            time.sleep(self.latency)
+        digest = zlib.crc32(ip.encode())
+        return {"country": f"Country {digest % 50}", "city": f"City {digest % 500}"}
+
+
+class QueryCounter:
+    """connection.execute_wrapper() callable counting statements and writes."""
+
+    def __init__(self):
+        self.queries = 0
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+def client_driver():
+    """Sends a TraceRequest through django.test.Client; returns the status."""
+    client = Client(HTTP_HOST=HOST)
+
+    def send(request):
+        return client.generic(request.method, request.path, REMOTE_ADDR=request.ip).status_code
+
+    return send
+
+
+def wsgi_driver():
+    """Sends a TraceRequest straight into a WSGIHandler; returns the status."""
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+    base = {
+        "SERVER_NAME": HOST,
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": HOST,
+        "SCRIPT_NAME": "",
+        "QUERY_STRING": "",
+        "wsgi.url_scheme": "http",
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(status)
+
+    def send(request):
+        path, _, query = request.path.partition("?")
+        environ = dict(
+            base,
+            REQUEST_METHOD=request.method,
+            PATH_INFO=path,
+            QUERY_STRING=query,
+            REMOTE_ADDR=request.ip,
+        )
+        environ["wsgi.input"] = BytesIO()
+        environ["wsgi.errors"] = BytesIO()
+        response = handler(environ, start_response)
+        try:
+            for _chunk in response:
+                pass
+        finally:
+            response.close()
+        return int(statuses.pop().split(None, 1)[0])
+
+    return send
+
+
+DRIVERS = {"client": client_driver, "wsgi": wsgi_driver}
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def _ratio(hits, misses):
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def _cache_counters():
+    """Monotonic (hits, misses) of the caches on the hot path."""
+    geo = get_geolocator().stats()
+    local = geo["local"] or {"hits": 0, "misses": 0}
+    paths = get_path_interner().stats()
+    locations = get_location_interner().stats()
+    return {
+        "geo_local": (local["hits"], local["misses"]),
+        "geo_shared": (geo["shared"]["hits"], geo["shared"]["misses"]),
+        "path_intern": (paths["hits"], paths["misses"]),
+        "location_intern": (locations["hits"], locations["misses"]),
+    }
+
+
+def _reset_process_state():
+    reset_interners()
+    reset_geolocator()
+    reset_rate_tracker()
+    blocklist.refresh(force=True)
+
+
+@contextmanager
+def isolated():
+    """
+    Point the default database at a new, migrated test database and the
+    cache at local memory until exit, then drop the database and restore
+    both. Interned ids, the geolocator, the real-time sketch and the
+    blocklist snapshot are reset on the way in and out, so nothing
+    loaded from one side is used on the other.
+    """
+    live_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CACHES=ISOLATED_CACHES, IP_TRACKING_METRICS_DIR=""):
+            _reset_process_state()
+            yield
+    finally:
+        connection.creation.destroy_test_db(live_name, verbosity=0)
+        # An in-memory test database keeps its connection open through
+        # destroy_test_db(); drop it now that NAME is the live one again.
+        connection.close()
+        _reset_process_state()
+
+
+def replay(trace, driver="client", warmup=0, stub_geo=True, geo_latency=0.0, isolate=True):
+    """
+    Send every request of `trace` through the middleware chain; the
+    first `warmup` ones are not measured. Returns a dict of results
+    (see format_report()). With `isolate` (the default) it runs in
+    isolated(), so the live database and cache are never touched.
+    """
+    overrides = {"ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, HOST]}
+    if stub_geo:
+        overrides["IP_TRACKING_GEO_BACKENDS"] = [STUB_GEO_BACKEND]
+        StubGeoBackend.latency = geo_latency
+
+    # 4xx responses in the trace would otherwise each log a warning.
+    request_logger = logging.getLogger("django.request")
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        with ExitStack() as stack:
+            if isolate:
+                stack.enter_context(isolated())
+            stack.enter_context(override_settings(**overrides))
+            return _replay(trace, DRIVERS[driver](), driver, warmup)
+    finally:
+        request_logger.setLevel(level)
+
+
+def _replay(trace, send, driver, warmup):
+    buffered = getattr(settings, "IP_TRACKING_LOG_MODE", "sync") == "buffered"
+    trace = iter(trace)
+    for request in islice(trace, warmup):
+        send(request)
+
+    counter = QueryCounter()
+    caches_before = _cache_counters()
+    provider_calls = get_geolocator().misses
+    writer_before = get_log_writer().stats() if buffered else None
+    latencies = []
+    statuses = Counter()
+    clock = time.perf_counter
+    with connection.execute_wrapper(counter):
+        started = clock()
+        for request in trace:
+            request_started = clock()
+            statuses[send(request)] += 1
+            latencies.append(clock() - request_started)
+        elapsed = clock() - started
+
+    if buffered:
+        writer = get_log_writer()
+        while writer.flush():
+            pass
+        writer_after = writer.stats()
+    caches_after = _cache_counters()
+    provider_calls = get_geolocator().misses - provider_calls
+
+    count = len(latencies)
+    latencies.sort()
+    caches = {}
+    for name, (hits, misses) in caches_after.items():
+        hits -= caches_before[name][0]
+        misses -= caches_before[name][1]
+        caches[name] = {"hits": hits, "misses": misses, "hit_ratio": _ratio(hits, misses)}
+    result = {
+        "driver": driver,
+        "requests": count,
+        "seconds": elapsed,
+        "requests_per_second": count / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies) / count * 1e3 if count else 0.0,
+            "p50": percentile(latencies, 0.50) * 1e3,
+            "p95": percentile(latencies, 0.95) * 1e3,
+            "p99": percentile(latencies, 0.99) * 1e3,
+            "max": latencies[-1] * 1e3 if count else 0.0,
+        },
+        "queries_per_request": counter.queries / count if count else 0.0,
+        "writes_per_request": counter.writes / count if count else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        "caches": caches,
+        "geo_provider_calls": provider_calls,
+        "log_writer": None,
+    }
+    if buffered:
+        result["log_writer"] = {
+            name: writer_after[name] - writer_before[name]
+            for name in ("enqueued", "written", "dropped", "failed", "flushes")
+        }
+    return result
+
+
+def format_report(result):
+    """Human-readable lines for a replay() result."""
+    latency = result["latency_ms"]
+    lines = [
+        f"{result['requests']} requests via {result['driver']} in {result['seconds']:.2f}s "
+        f"({result['requests_per_second']:.1f} req/s)",
+        f"latency ms: mean {latency['mean']:.3f}  p50 {latency['p50']:.3f}  p95 {latency['p95']:.3f}  "
+        f"p99 {latency['p99']:.3f}  max {latency['max']:.3f}",
+        f"per request: {result['queries_per_request']:.2f} queries, {result['writes_per_request']:.2f} writes",
+        "statuses: " + ", ".join(f"{status} x{count}" for status, count in result["statuses"].items()),
+    ]
+    for name, cache in result["caches"].items():
+        lines.append(
+            f"{name:16} hit ratio {cache['hit_ratio']:6.1%}  ({cache['hits']} hits, {cache['misses']} misses)"
+        )
+    lines.append(f"geo provider calls: {result['geo_provider_calls']}")
+    if result["log_writer"] is not None:
+        writer = result["log_writer"]
+        lines.append(
+            f"log writer: {writer['written']} rows in {writer['flushes']} flushes "
+            f"({writer['dropped']} dropped, {writer['failed']} failed)"
+        )
+    return lines
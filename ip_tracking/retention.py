@@ -0,0 +1,131 @@
+import csv
+import gzip
+import logging
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .interning import get_location_interner, get_path_interner
+from .iputils import unpack_ip
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ("id", "ip_address", "timestamp", "path", "country", "city", "status_code")
+# The columns behind ARCHIVE_FIELDS in the compact schema.
+ARCHIVE_COLUMNS = ("id", "ip", "timestamp", "path__path", "location__country", "location__city", "status_code")
+
+
+def _archive_rows(rows):
+    for row_id, ip, *rest in rows:
+        yield (row_id, unpack_ip(ip), *rest)
+
+
+def prune_dimensions(chunk_size=500):
+    """
+    Delete LogPath and GeoLocation rows no RequestLog refers to any
+    more. The referenced ids come from one DISTINCT scan per column
+    (RequestLog has no index on them, so per-id checks would each scan
+    it); orphans are then deleted in chunks, whose PROTECT check is one
+    more scan per chunk. A chunk that gained a reference from a writer
+    meanwhile fails that check (or the foreign key) and is kept.
+
+    Returns {"paths", "locations"}: the rows deleted.
+    """
+    from .models import GeoLocation, LogPath, RequestLog
+
+    pruned = {}
+    for name, model, column, interner in (
+        ("paths", LogPath, "path_id", get_path_interner()),
+        ("locations", GeoLocation, "location_id", get_location_interner()),
+    ):
+        used = set(RequestLog.objects.order_by().values_list(column, flat=True).distinct())
+        orphans = [pk for pk in model.objects.values_list("pk", flat=True).iterator() if pk not in used]
+        deleted = 0
+        for start in range(0, len(orphans), chunk_size):
+            chunk = model.objects.filter(pk__in=orphans[start:start + chunk_size])
+            try:
+                with transaction.atomic():
+                    deleted += chunk.delete()[0]
+            except IntegrityError:
+                logger.info("Kept %s referenced while pruning", model.__name__)
+        if deleted:
+            interner.clear()
+        pruned[name] = deleted
+    return pruned
+
+
+def purge_request_logs(days=None, chunk_size=None, archive=None, pause=None, dry_run=False):
+    """
+    Delete RequestLog rows older than `days` (IP_TRACKING_LOG_RETENTION_DAYS).
+
+    Rows are removed in id ranges of `chunk_size`, each its own short
+    DELETE, so no statement holds the write lock for long; `pause`
+    seconds are slept between chunks to let writers in. The id range is
+    bounded by the newest expired row and every chunk re-checks the
+    timestamp, so rows written out of order are never removed early.
+    With `archive`, each chunk is appended to that gzipped CSV file
+    before it is deleted (the header is only written to a new file).
+
+    `days` of 0 or None (after falling back to the setting) keeps logs
+    forever: nothing is deleted and "cutoff" is None.
+
+    After deleting rows it prunes the paths and locations left without
+    a log (prune_dimensions()), so client-supplied paths do not pile up.
+
+    Returns {"rows", "chunks", "seconds", "cutoff", "paths", "locations"}.
+    """
+    from .models import RequestLog
+
+    days = getattr(settings, "IP_TRACKING_LOG_RETENTION_DAYS", 30) if days is None else days
+    if not days:
+        return {"rows": 0, "chunks": 0, "seconds": 0.0, "cutoff": None, "paths": 0, "locations": 0}
+    chunk_size = chunk_size or getattr(settings, "IP_TRACKING_LOG_RETENTION_CHUNK_SIZE", 10000)
+    pause = getattr(settings, "IP_TRACKING_LOG_RETENTION_PAUSE", 0) if pause is None else pause
+    cutoff = timezone.now() - timedelta(days=days)
+    started = time.monotonic()
+
+    expired = RequestLog.objects.filter(timestamp__lt=cutoff)
+    bounds = expired.aggregate(low=Min("id"), high=Max("id"))
+    rows = chunks = 0
+    if bounds["high"] is not None:
+        writer = archive_file = None
+        if archive and not dry_run:
+            # Each run appends a gzip member; tell() restarts at 0 in every
+            # one, so look at the file itself to know if it has a header.
+            new_file = not os.path.exists(archive) or os.path.getsize(archive) == 0
+            archive_file = gzip.open(archive, "at", newline="")
+            writer = csv.writer(archive_file)
+            if new_file:
+                writer.writerow(ARCHIVE_FIELDS)
+        try:
+            low = bounds["low"]
+            while low <= bounds["high"]:
+                chunk = expired.filter(id__gte=low, id__lt=low + chunk_size)
+                if dry_run:
+                    rows += chunk.count()
+                else:
+                    if writer is not None:
+                        writer.writerows(
+                            _archive_rows(chunk.order_by("id").values_list(*ARCHIVE_COLUMNS).iterator())
+                        )
+                    rows += chunk.delete()[0]
+                chunks += 1
+                low += chunk_size
+                if pause and low <= bounds["high"]:
+                    time.sleep(pause)
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+
+    pruned = prune_dimensions() if rows and not dry_run else {"paths": 0, "locations": 0}
+    seconds = time.monotonic() - started
+    logger.info(
+        "Purged %d request log rows older than %s in %d chunks, and %d paths and %d locations (%.2fs)",
+        rows, cutoff, chunks, pruned["paths"], pruned["locations"], seconds,
+    )
+    return {"rows": rows, "chunks": chunks, "seconds": round(seconds, 3), "cutoff": cutoff.isoformat(), **pruned}
@@ -0,0 +1,237 @@
+"""
+Incremental per-minute and per-hour traffic rollups.
+
+rollup_request_logs() reads RequestLog rows past a stored watermark,
+groups them in SQL by (minute, IP, path, location) and adds the counts
+into MinuteRollup and HourRollup, keyed by country. Summaries and detection read these
+tables, whose size follows distinct (IP, path) pairs per bucket rather
+than requests, so raw logs can be kept for a much shorter time.
+
+Rows logged in deferred geo mode are rolled up under the unknown
+country ""; when enrich_request_logs later locates them,
+reassign_country() moves their counts to the real country.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+
+from .fields import EpochMicrosecondsField
+from .interning import locations_by_id, path_names
+from .iputils import unpack_ip
+
+WATERMARK_NAME = "rollups"
+ROLLUP_KEY = ("bucket", "ip_address", "path", "country")
+
+_CHUNK = 500
+
+
+def _merge(model, increments):
+    """Add {(bucket, ip, path, country): [requests, errors]} into `model`."""
+    if not increments:
+        return
+    buckets = {key[0] for key in increments}
+    ips = list({key[1] for key in increments})
+    for start in range(0, len(ips), _CHUNK):
+        existing = model.objects.filter(
+            bucket__in=buckets, ip_address__in=ips[start:start + _CHUNK]
+        ).values_list(*ROLLUP_KEY, "requests", "errors")
+        for bucket, ip, path, country, requests, errors in existing:
+            counts = increments.get((bucket, ip, path, country))
+            if counts is not None:
+                counts[0] += requests
+                counts[1] += errors
+    model.objects.bulk_create(
+        [
+            model(bucket=bucket, ip_address=ip, path=path, country=country, requests=requests, errors=errors)
+            for (bucket, ip, path, country), (requests, errors) in increments.items()
+        ],
+        batch_size=_CHUNK,
+        update_conflicts=True,
+        unique_fields=list(ROLLUP_KEY),
+        update_fields=["requests", "errors"],
+    )
+
+
+def rollup_request_logs(now=None):
+    """
+    Fold new RequestLog rows into the rollups.
+
+    At most IP_TRACKING_ROLLUP_BATCH_SIZE ids are consumed per call, so
+    a backlog is caught up over several runs. Rows younger than
+    IP_TRACKING_DETECTION_SETTLE_SECONDS are left for the next run,
+    giving concurrent writers time to commit rows with lower ids.
+
+    Returns {"rows", "ips"} where "ips" lists the IPs that got new counts.
+    """
+    from .models import DetectionWatermark, HourRollup, MinuteRollup, RequestLog
+
+    now = now or timezone.now()
+    settle = getattr(settings, "IP_TRACKING_DETECTION_SETTLE_SECONDS", 5)
+    batch_size = getattr(settings, "IP_TRACKING_ROLLUP_BATCH_SIZE", 100000)
+
+    with transaction.atomic():
+        watermark, _created = (
+            DetectionWatermark.objects.select_for_update().get_or_create(name=WATERMARK_NAME)
+        )
+        # Start from the next existing id so purged id ranges are skipped.
+        lower = RequestLog.objects.filter(id__gt=watermark.last_id).aggregate(lower=Min("id"))["lower"]
+        if lower is None:
+            return {"rows": 0, "ips": []}
+        upper = (
+            RequestLog.objects.filter(
+                id__gte=lower,
+                id__lt=lower + batch_size,
+                timestamp__lt=now - timedelta(seconds=settle),
+            )
+            .aggregate(upper=Max("id"))["upper"]
+        )
+        if upper is None:
+            return {"rows": 0, "ips": []}
+
+        grouped = list(
+            RequestLog.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            .order_by()
+            .annotate(minute=EpochMicrosecondsField.truncate("timestamp", 60))
+            .values_list("minute", "ip", "path_id", "location_id")
+            .annotate(
+                requests=Count("id"),
+                errors=Count("id", filter=Q(status_code__gte=400, status_code__lt=500)),
+            )
+        )
+        paths = path_names({row[2] for row in grouped})
+        locations = locations_by_id({row[3] for row in grouped if row[3] is not None})
+        minutes = defaultdict(lambda: [0, 0])
+        hours = defaultdict(lambda: [0, 0])
+        rows = 0
+        for minute, packed, path_id, location_id, requests, errors in grouped:
+            ip = unpack_ip(packed)
+            path = paths[path_id]
+            country = locations[location_id][0] if location_id is not None else ""
+            for counts in (
+                minutes[(minute, ip, path, country)],
+                hours[(minute.replace(minute=0), ip, path, country)],
+            ):
+                counts[0] += requests
+                counts[1] += errors
+            rows += requests
+
+        _merge(MinuteRollup, minutes)
+        _merge(HourRollup, hours)
+        watermark.last_id = upper
+        watermark.save(update_fields=["last_id", "updated_at"])
+
+    return {"rows": rows, "ips": sorted({key[1] for key in minutes})}
+
+
+def _take_unknown(model, decrements):
+    """
+    Subtract {(bucket, ip, path): [requests, errors]} from the
+    country="" rows of `model`; returns what was actually there to take
+    (rows already purged by retention contribute nothing).
+    """
+    buckets = {key[0] for key in decrements}
+    ips = list({key[1] for key in decrements})
+    taken = {}
+    changed, emptied = [], []
+    for start in range(0, len(ips), _CHUNK):
+        for row in model.objects.filter(bucket__in=buckets, ip_address__in=ips[start:start + _CHUNK], country=""):
+            counts = decrements.get((row.bucket, row.ip_address, row.path))
+            if counts is None:
+                continue
+            requests, errors = min(counts[0], row.requests), min(counts[1], row.errors)
+            taken[(row.bucket, row.ip_address, row.path)] = (requests, errors)
+            row.requests -= requests
+            row.errors -= errors
+            (changed if row.requests else emptied).append(row)
+    model.objects.bulk_update(changed, ["requests", "errors"], batch_size=_CHUNK)
+    model.objects.filter(id__in=[row.id for row in emptied]).delete()
+    return taken
+
+
+def reassign_country(logs, country):
+    """
+    Move the counts of `logs` (RequestLog rows about to be given a
+    location by geo enrichment) that were already rolled up under the
+    unknown country "" to `country`, in both granularities.
+
+    Call it in the same transaction as the update; it locks the rollup
+    watermark, so a concurrent rollup_request_logs() cannot fold the
+    rows in between. Returns the number of rows moved.
+    """
+    from .models import DetectionWatermark, HourRollup, MinuteRollup
+
+    if not country:
+        return 0
+    watermark = (
+        DetectionWatermark.objects.select_for_update()
+        .filter(name=WATERMARK_NAME)
+        .values_list("last_id", flat=True)
+        .first()
+    )
+    if not watermark:
+        return 0
+    grouped = list(
+        logs.filter(id__lte=watermark)
+        .order_by()
+        .annotate(minute=EpochMicrosecondsField.truncate("timestamp", 60))
+        .values_list("minute", "ip", "path_id")
+        .annotate(
+            requests=Count("id"),
+            errors=Count("id", filter=Q(status_code__gte=400, status_code__lt=500)),
+        )
+    )
+    if not grouped:
+        return 0
+    paths = path_names({row[2] for row in grouped})
+    minutes = defaultdict(lambda: [0, 0])
+    hours = defaultdict(lambda: [0, 0])
+    for minute, packed, path_id, requests, errors in grouped:
+        ip = unpack_ip(packed)
+        for counts in (minutes[(minute, ip, paths[path_id])], hours[(minute.replace(minute=0), ip, paths[path_id])]):
+            counts[0] += requests
+            counts[1] += errors
+
+    moved = 0
+    for model, decrements in ((MinuteRollup, minutes), (HourRollup, hours)):
+        taken = _take_unknown(model, decrements)
+        _merge(model, {
+            (bucket, ip, path, country): [requests, errors]
+            for (bucket, ip, path), (requests, errors) in taken.items()
+        })
+        if model is MinuteRollup:
+            moved = sum(requests for requests, _errors in taken.values())
+    return moved
+
+
+def purge_rollups(now=None):
+    """Drop minute/hour rollups past IP_TRACKING_{MINUTE,HOUR}_ROLLUP_RETENTION_DAYS."""
+    from .models import HourRollup, MinuteRollup
+
+    now = now or timezone.now()
+    removed = 0
+    for model, setting, default in (
+        (MinuteRollup, "IP_TRACKING_MINUTE_ROLLUP_RETENTION_DAYS", 2),
+        (HourRollup, "IP_TRACKING_HOUR_ROLLUP_RETENTION_DAYS", 90),
+    ):
+        days = getattr(settings, setting, default)
+        if days:
+            removed += model.objects.filter(bucket__lt=now - timedelta(days=days)).delete()[0]
+    return removed
+
+
+def summarize(model, since, by, limit=50):
+    """
+    Top `by` values ("ip_address", "country" or "path") by requests since
+    `since`, read from `model` (MinuteRollup or HourRollup).
+    """
+    return list(
+        model.objects.filter(bucket__gte=since)
+        .order_by()
+        .values(by)
+        .annotate(requests=Sum("requests"), errors=Sum("errors"))
+        .order_by("-requests", by)[:limit]
+    )
@@ -0,0 +1,65 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blocklist import blocklist_changed
+from .detectors import reset_detectors
+from .findings import bump_findings_version
+from .geo import reset_geolocator
+from .interning import reset_interners
+from .metrics import registry as metrics_registry
+from .pathrules import reset_path_rules
+from .realtime import reset_rate_tracker
+from .models import BlockedIP, BlockedNetwork, SuspiciousIP
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+@receiver(post_save, sender=BlockedNetwork)
+@receiver(post_delete, sender=BlockedNetwork)
+def blocked_ip_changed(sender, **kwargs):
+    """Tell every worker to reload its blocklist snapshot."""
+    blocklist_changed()
+
+
+@receiver(post_save, sender=SuspiciousIP)
+@receiver(post_delete, sender=SuspiciousIP)
+def suspicious_ip_changed(sender, **kwargs):
+    """Invalidate cached findings listings."""
+    bump_findings_version()
+
+
+@receiver(setting_changed)
+def geo_setting_changed(setting, **kwargs):
+    if setting.startswith("IP_TRACKING_GEO_"):
+        reset_geolocator()
+
+
+@receiver(setting_changed)
+def path_rules_setting_changed(setting, **kwargs):
+    if setting in ("IP_TRACKING_PATH_RULES", "IP_TRACKING_DEFAULT_SAMPLE_RATE"):
+        reset_path_rules()
+
+
+@receiver(setting_changed)
+def realtime_setting_changed(setting, **kwargs):
+    if setting.startswith("IP_TRACKING_REALTIME_"):
+        reset_rate_tracker()
+
+
+@receiver(setting_changed)
+def detector_setting_changed(setting, **kwargs):
+    if setting.startswith("IP_TRACKING_DETECT") or setting == "IP_TRACKING_SENSITIVE_PATHS":
+        reset_detectors()
+
+
+@receiver(setting_changed)
+def intern_setting_changed(setting, **kwargs):
+    if setting.startswith("IP_TRACKING_INTERN_"):
+        reset_interners()
+
+
+@receiver(setting_changed)
+def metrics_setting_changed(setting, **kwargs):
+    if setting == "IP_TRACKING_METRICS_DIR":
+        metrics_registry.reset()
@@ -0,0 +1,163 @@
+"""
+Fixed-memory streaming counters (no Django imports).
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+
+HEADER = struct.Struct("8s8s16sq")  # magic, layout digest, hash key, epoch
+MAGIC = b"IPTSKCH1"
+NO_EPOCH = -1
+
+
+class SlidingCountMinSketch:
+    """
+    Count-min sketch over a sliding time window.
+
+    The window is split into `slices` sub-sketches of `depth` x `width`
+    32-bit counters; the oldest slice is zeroed as time moves on, so
+    counts cover the last `window` seconds (to slice granularity).
+    Memory is fixed at slices * depth * width * 4 bytes however many
+    distinct keys are added.
+
+    Estimates never undercount. They may overcount by about
+    e / width * (events in the window), with probability 1 - e**-depth.
+
+    Without `path` the counters live in process memory and keys are
+    hashed with Python's per-process hash(), so the sketch only counts
+    what this process adds. With `path` they are mapped from that file,
+    which every process opening it shares: keys are hashed with
+    blake2b under a random key stored in the file, and add() and
+    estimate() hold an exclusive flock() on it. Opening a file written
+    with another width, depth, window or slice count starts it afresh.
+    The file lock does not order threads of one process; callers
+    serialise those as for an in-memory sketch.
+    """
+
+    def __init__(self, width=2 ** 15, depth=4, window=3600, slices=6, path=None):
+        if width & (width - 1):
+            raise ValueError("width must be a power of two")
+        self.width = width
+        self.depth = depth
+        self.window = window
+        self.slices = slices
+        self.slice_seconds = window / slices
+        self.path = path or None
+        self._mask = width - 1
+        self._size = depth * width
+        self._fd = None
+        self._mmap = None
+        # The slices of one counter sit next to each other, so a windowed
+        # count is sum() over a contiguous run and expiring a slice is one
+        # strided assignment.
+        if self.path is None:
+            self._counts = array("I", bytes(4 * self._size * slices))
+            self._state = array("q", [NO_EPOCH])
+            self._hash = hash
+        else:
+            self._open()
+
+    def _header(self, key):
+        layout = repr((self.width, self.depth, self.window, self.slices)).encode()
+        return HEADER.pack(MAGIC, hashlib.blake2b(layout, digest_size=8).digest(), key, NO_EPOCH)
+
+    def _open(self):
+        length = HEADER.size + 4 * self._size * self.slices
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                layout = self._header(bytes(16))[:16]
+                if os.fstat(fd).st_size != length or os.pread(fd, 16, 0) != layout:
+                    # New file, or left by a sketch of another shape.
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, length)
+                    os.pwrite(fd, self._header(os.urandom(16)), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._mmap = mmap.mmap(fd, length)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        view = memoryview(self._mmap)
+        key = bytes(view[16:32])
+        self._state = view[32:HEADER.size].cast("q")
+        self._counts = view[HEADER.size:].cast("I")
+        self._hash = lambda item: int.from_bytes(
+            hashlib.blake2b(str(item).encode(), digest_size=8, key=key).digest(), "little"
+        )
+
+    def close(self):
+        """Unmap the shared file (no-op for an in-memory sketch)."""
+        if self._fd is None:
+            return
+        self._state.release()
+        self._counts.release()
+        self._mmap.close()
+        os.close(self._fd)
+        self._fd = self._mmap = None
+
+    @property
+    def nbytes(self):
+        return 4 * self._size * self.slices
+
+    def _bases(self, key):
+        h = self._hash(key)
+        step = (h >> 16) | 1
+        mask = self._mask
+        width = self.width
+        slices = self.slices
+        return [(row * width + ((h + row * step) & mask)) * slices for row in range(self.depth)]
+
+    def _advance(self, now):
+        epoch = int(now // self.slice_seconds)
+        state = self._state
+        if state[0] == NO_EPOCH:
+            state[0] = epoch
+        elif epoch > state[0]:
+            zeros = array("I", bytes(4 * self._size))
+            for expired in range(state[0] + 1, state[0] + 1 + min(epoch - state[0], self.slices)):
+                self._counts[expired % self.slices::self.slices] = zeros
+            state[0] = epoch
+        return state[0] % self.slices
+
+    def _lock(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def add(self, key, now, count=1):
+        """Count `key` at time `now` and return its new windowed estimate."""
+        bases = self._bases(key)
+        self._lock()
+        try:
+            current = self._advance(now)
+            counts = self._counts
+            slices = self.slices
+            estimate = None
+            for base in bases:
+                counts[base + current] += count
+                total = sum(counts[base:base + slices])
+                if estimate is None or total < estimate:
+                    estimate = total
+        finally:
+            self._unlock()
+        return estimate
+
+    def estimate(self, key, now):
+        bases = self._bases(key)
+        self._lock()
+        try:
+            self._advance(now)
+            counts = self._counts
+            slices = self.slices
+            return min(sum(counts[base:base + slices]) for base in bases)
+        finally:
+            self._unlock()
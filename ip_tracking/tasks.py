@@ -1,32 +1,228 @@
 # ip_tracking/tasks.py
+import operator
+import time
+from collections import defaultdict
+from functools import reduce
 from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
 from django.utils import timezone
-from datetime import timedelta
-from .models import RequestLog, SuspiciousIP
+from datetime import datetime, timedelta
+from .detectors import WindowBatch, detect_window, in_ip_range, run_detectors
+from .escalation import escalate, sweep_expired_blocks
+from .findings import RULE_RATE, Finding, record_findings, sensitive_path_rule, window_start
+from .geo import get_geolocator
+from .interning import location_ids
+from .iputils import unpack_ip
+from .metrics import record_detection
+from .models import MinuteRollup, RequestLog
+from .retention import purge_request_logs
+from .rollups import purge_rollups, reassign_country, rollup_request_logs
 
 SENSITIVE_PATHS = ["/admin", "/login"]
+REQUEST_THRESHOLD = 100  # requests per hour
+
+
+def _sensitive_aliases():
+    paths = getattr(settings, "IP_TRACKING_SENSITIVE_PATHS", SENSITIVE_PATHS)
+    return {f"sensitive_{i}": path for i, path in enumerate(paths)}
+
+
+def _under(path):
+    """Match `path` itself and anything below it ("/admin" -> "/admin/login/")."""
+    return Q(path=path) | Q(path__startswith=path.rstrip("/") + "/")
+
+
+def _rate_threshold():
+    return getattr(settings, "IP_TRACKING_DETECT_RATE_THRESHOLD", REQUEST_THRESHOLD)
+
+
+def _rate_finding(ip, total, now):
+    return Finding(
+        ip, RULE_RATE, window_start(now), total,
+        f"Exceeded {_rate_threshold()} requests in the past hour ({total} requests)", now,
+    )
+
+
+def _sensitive_finding(ip, path, hits, now):
+    return Finding(
+        ip, sensitive_path_rule(path), window_start(now), hits,
+        f"Accessed sensitive path: {path}", now,
+    )
+
 
 @shared_task
-def detect_anomalies():
-    one_hour_ago = timezone.now() - timedelta(hours=1)
-    logs = RequestLog.objects.filter(timestamp__gte=one_hour_ago)
-
-    # Group by IP and count requests
-    ip_counts = {}
-    for log in logs:
-        ip_counts[log.ip_address] = ip_counts.get(log.ip_address, 0) + 1
-
-        # Check sensitive paths
-        if log.path in SENSITIVE_PATHS:
-            SuspiciousIP.objects.get_or_create(
-                ip_address=log.ip_address,
-                reason=f"Accessed sensitive path: {log.path}"
-            )
+def detect_anomalies(mode=None):
+    """
+    Flag IPs that exceeded IP_TRACKING_DETECT_RATE_THRESHOLD requests in the past hour or
+    hit a sensitive path.
+
+    `mode` (default IP_TRACKING_DETECTION_MODE) is "full", which
+    evaluates every IP seen in the trailing hour, "incremental", which
+    only re-evaluates IPs with traffic since the previous run, or
+    "pipeline", which loads the raw hour once and runs the
+    IP_TRACKING_DETECTORS registry over it (see ip_tracking.detectors;
+    needs NumPy). "full" and "incremental" first bring the rollups up
+    to date and then read MinuteRollup instead of raw logs.
+
+    Runs, rows scanned, findings and duration go to ip_tracking.metrics.
+    """
+    mode = mode or getattr(settings, "IP_TRACKING_DETECTION_MODE", "full")
+    if mode not in ("full", "incremental", "pipeline"):
+        raise ValueError(f"Unknown detection mode: {mode!r}")
+    started = time.perf_counter()
+    if mode == "pipeline":
+        result = detect_window(timezone.now())
+    else:
+        rolled = rollup_request_logs()
+        ips = rolled["ips"] if mode == "incremental" else None
+        result = _detect_from_rollups(ips)
+        result.update(rows=rolled["rows"], ips=len(rolled["ips"]))
+    # A partitioned pipeline run only dispatches; its shards aren't counted here.
+    record_detection(mode, result.get("rows", 0), result.get("flagged", 0), time.perf_counter() - started)
+    return result
+
 
-    # Flag IPs exceeding 100 requests/hour
-    for ip, count in ip_counts.items():
-        if count > 100:
-            SuspiciousIP.objects.get_or_create(
-                ip_address=ip,
-                reason=f"Exceeded 100 requests in the past hour ({count} requests)"
+def _detect_from_rollups(ips=None):
+    """
+    Sum the last hour of MinuteRollup per IP (all IPs, or just `ips`),
+    with a conditional sum per sensitive path, and upsert the findings.
+    The grouped query returns only flagged IPs, and its cost follows the
+    number of rollup rows, not requests.
+    """
+    now = timezone.now()
+    one_hour_ago = now - timedelta(hours=1)
+    threshold = _rate_threshold()
+    sensitive = _sensitive_aliases()
+    window = (
+        MinuteRollup.objects.filter(bucket__gt=one_hour_ago)
+        .order_by()
+        .values("ip_address")
+        .annotate(
+            total=Sum("requests"),
+            **{alias: Sum("requests", filter=_under(path)) for alias, path in sensitive.items()},
+        )
+        .filter(
+            reduce(
+                operator.or_,
+                [Q(total__gt=threshold)] + [Q(**{f"{alias}__gt": 0}) for alias in sensitive],
             )
+        )
+    )
+    if ips is None:
+        flagged = list(window)
+    else:
+        flagged = []
+        for start in range(0, len(ips), 500):
+            flagged.extend(window.filter(ip_address__in=ips[start:start + 500]))
+
+    findings = []
+    for row in flagged:
+        ip = row["ip_address"]
+        for alias, path in sensitive.items():
+            if row[alias]:
+                findings.append(_sensitive_finding(ip, path, row[alias], now))
+        if row["total"] > threshold:
+            findings.append(_rate_finding(ip, row["total"], now))
+    return {"flagged": record_findings(findings)}
+
+
+@shared_task
+def detect_partition(lower, upper, since, now):
+    """
+    Celery side of the partitioned pipeline: load and scan only the rows
+    of IPs in [lower, upper), hex-encoded packed addresses (None is
+    unbounded) from detectors.ip_ranges(). Findings are returned as
+    JSON-friendly [ip, rule, hits, reason] lists for
+    store_partition_findings.
+    """
+    now = datetime.fromisoformat(now)
+    lower = None if lower is None else bytes.fromhex(lower)
+    upper = None if upper is None else bytes.fromhex(upper)
+    batch = WindowBatch.from_queryset(
+        RequestLog.objects.filter(in_ip_range(lower, upper), timestamp__gte=datetime.fromisoformat(since))
+    )
+    return [
+        [finding.ip_address, finding.rule, finding.hits, finding.reason]
+        for finding in run_detectors(batch, now)
+    ]
+
+
+@shared_task
+def store_partition_findings(results, now):
+    """Chord callback: merge every shard's findings in (ip, rule) order and store them."""
+    now = datetime.fromisoformat(now)
+    rows = sorted((row for shard in results for row in shard), key=lambda row: (row[0], row[1]))
+    findings = [Finding(ip, rule, window_start(now), hits, reason, now) for ip, rule, hits, reason in rows]
+    return {"flagged": record_findings(findings)}
+
+
+@shared_task
+def escalate_suspicious_ips():
+    """
+    Apply IP_TRACKING_ESCALATION_POLICIES (if IP_TRACKING_ESCALATION_ENABLED),
+    then drop blocks that have expired.
+    """
+    if getattr(settings, "IP_TRACKING_ESCALATION_ENABLED", False):
+        result = escalate()
+    else:
+        result = {"blocked": 0, "extended": 0}
+    result.update(sweep_expired_blocks())
+    return result
+
+
+@shared_task
+def purge_old_request_logs():
+    """Apply IP_TRACKING_LOG_RETENTION_DAYS (0 disables it) and the rollup retention."""
+    result = purge_request_logs()
+    result["rollups"] = purge_rollups()
+    return result
+
+
+@shared_task
+def rollup_traffic():
+    """Fold new RequestLog rows into MinuteRollup/HourRollup."""
+    result = rollup_request_logs()
+    return {"rows": result["rows"], "ips": len(result["ips"])}
+
+
+@shared_task
+def enrich_request_logs(max_ips=None):
+    """
+    Fill in country/city for rows logged in deferred geo mode.
+
+    Resolves each distinct pending IP once (in batches through the
+    geolocation backends) and updates rows with one UPDATE per
+    (location, chunk of IPs), so the cost follows the number of distinct
+    IPs rather than the number of requests. IPs whose lookup failed stay
+    pending for the next run.
+    """
+    max_ips = max_ips or getattr(settings, "IP_TRACKING_GEO_ENRICH_BATCH_SIZE", 1000)
+    packed = list(
+        RequestLog.objects.filter(geo_pending=True)
+        .order_by()
+        .values_list("ip", flat=True)
+        .distinct()[:max_ips]
+    )
+    if not packed:
+        return {"ips": 0, "resolved": 0, "rows": 0}
+    ips = {unpack_ip(value): bytes(value) for value in packed}
+
+    resolved = get_geolocator().lookup_many(list(ips))
+
+    by_location = defaultdict(list)
+    for ip, geo_data in resolved.items():
+        by_location[(geo_data.get("country"), geo_data.get("city"))].append(ips[ip])
+    location_id = location_ids(by_location)
+
+    rows = 0
+    for location, location_ips in by_location.items():
+        for start in range(0, len(location_ips), 500):
+            pending = RequestLog.objects.filter(geo_pending=True, ip__in=location_ips[start:start + 500])
+            with transaction.atomic():
+                # Rows already rolled up were counted under the unknown country.
+                reassign_country(pending, location[0])
+                rows += pending.update(location_id=location_id[location], geo_pending=False)
+
+    return {"ips": len(ips), "resolved": len(resolved), "rows": rows}
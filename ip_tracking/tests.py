@@ -1,3 +1,1153 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import ipaddress
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import CommandError
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .geo import EMPTY_GEO, GeoBackend, GeoLocator, GeoLookupError, RangeFileBackend
+from .interning import (
+    OVERFLOW_PATH, Interner, get_path_interner, insert_request_logs, path_names, reset_interners,
+)
+from .blocklist import BLOCKLIST_VERSION_KEY, BlocklistSnapshot, blocklist
+from .blockfeed import FeedReader, import_blocks, sync_blocks
+from .detectors import WindowBatch, in_ip_range, ip_ranges, run_detectors, run_partitioned
+from .escalation import DEFAULT_POLICIES, escalate
+from .findings import Finding, record_findings, window_start
+from .iputils import unpack_ip
+from . import logwriter
+from .logwriter import BLOCK, DROP_OLDEST, RequestLogWriter
+from .middleware import IPLoggingMiddleware
+from .pathrules import PathRule, PathRules
+from .logquery import decode_cursor, filter_logs, iter_log_batches, log_page
+from .metrics import Registry
+from .models import (
+    BlockedIP, BlockedNetwork, GeoLocation, HourRollup, LogPath, MinuteRollup, RequestLog, SuspiciousIP,
+)
+from .radix import NetworkMatcher
+from .ratelimit import CacheStore, LocalStore, RateLimiter, SLIDING_LOG, TOKEN_BUCKET, get_key
+from .realtime import RateTracker
+from .replay import STUB_GEO_BACKEND, StubGeoBackend, replay, synthetic_trace
+from .retention import ARCHIVE_FIELDS, purge_request_logs
+from .rollups import rollup_request_logs
+from .tasks import detect_anomalies, detect_partition, enrich_request_logs, escalate_suspicious_ips
+
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    IP_TRACKING_GEO_BACKENDS=[],
+    IP_TRACKING_METRICS_DIR="",
+)
+class IPTrackingTestCase(TestCase):
+    """Isolated cache, no network geolocation, fresh per-process singletons."""
+
+    def setUp(self):
+        cache.clear()
+        reset_interners()
+        blocklist.refresh(force=True)  # drop blocks a previous test left in the process snapshot
+
+    def log(self, ip, path="/", timestamp=None, country=None, city=None, status_code=200, geo_pending=False):
+        """Write one RequestLog row the way the middleware does."""
+        timestamp = timestamp or timezone.now()
+        return insert_request_logs([(ip, path, timestamp, country, city, geo_pending, status_code)])[0]
+
+
+class RetentionTests(IPTrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = self.log("10.0.0.1", timestamp=timezone.now() - timedelta(days=40))
+        self.new = self.log("10.0.0.2")
+
+    def test_purges_rows_older_than_days(self):
+        result = purge_request_logs(days=30, pause=0)
+        self.assertEqual(result["rows"], 1)
+        self.assertEqual(list(RequestLog.objects.values_list("id", flat=True)), [self.new.id])
+
+    @override_settings(IP_TRACKING_LOG_RETENTION_DAYS=0)
+    def test_zero_retention_keeps_everything(self):
+        result = purge_request_logs(pause=0)
+        self.assertEqual(
+            result, {"rows": 0, "chunks": 0, "seconds": 0.0, "cutoff": None, "paths": 0, "locations": 0}
+        )
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+    @override_settings(IP_TRACKING_LOG_RETENTION_DAYS=0)
+    def test_command_keeps_everything_with_zero_retention(self):
+        call_command("purge_request_logs", stdout=StringIO())
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+    def test_command_rejects_non_positive_days(self):
+        for days in ("0", "-1"):
+            with self.assertRaises(CommandError):
+                call_command("purge_request_logs", "--days", days, stdout=StringIO())
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+    def test_prunes_paths_and_locations_only_old_logs_used(self):
+        self.log("10.0.0.4", "/old-only/", timestamp=timezone.now() - timedelta(days=40), country="Ghana")
+        self.log("10.0.0.5", "/kept/", country="Togo")
+
+        result = purge_request_logs(days=30, pause=0)
+
+        self.assertEqual((result["paths"], result["locations"]), (1, 1))
+        self.assertEqual(sorted(LogPath.objects.values_list("path", flat=True)), ["/", "/kept/"])
+        self.assertEqual(list(GeoLocation.objects.values_list("country", flat=True)), ["Togo"])
+        # The pruned path is interned afresh when it shows up again.
+        self.log("10.0.0.4", "/old-only/")
+        self.assertTrue(LogPath.objects.filter(path="/old-only/").exists())
+
+    def test_reading_old_logs_does_not_cache_their_ids_for_writing(self):
+        old = self.log("10.0.0.4", "/old-only/", timestamp=timezone.now() - timedelta(days=40))
+        self.assertEqual(path_names([old.path_id]), {old.path_id: "/old-only/"})
+
+        # Another process purges the log and prunes its path.
+        RequestLog.objects.filter(pk=old.pk).delete()
+        LogPath.objects.filter(pk=old.path_id).delete()
+
+        row = self.log("10.0.0.4", "/old-only/")
+        self.assertEqual(LogPath.objects.get(pk=row.path_id).path, "/old-only/")
+
+    def test_archive_has_a_single_header_across_runs(self):
+        archive = os.path.join(tempfile.mkdtemp(), "logs.csv.gz")
+        purge_request_logs(days=30, pause=0, archive=archive)
+        self.log("10.0.0.3", timestamp=timezone.now() - timedelta(days=40))
+        purge_request_logs(days=30, pause=0, archive=archive)
+
+        with gzip.open(archive, "rt", newline="") as handle:
+            rows = list(csv.reader(handle))
+        self.assertEqual(rows[0], list(ARCHIVE_FIELDS))
+        self.assertEqual([row[1] for row in rows[1:]], ["10.0.0.1", "10.0.0.3"])
+
+
+class NetworkMatcherTests(SimpleTestCase):
+    def test_most_specific_network_wins(self):
+        matcher = NetworkMatcher(["10.0.0.0/8", "10.1.0.0/16", "10.1.2.0/24", "10.1.2.3/32", "2001:db8::/32"])
+        cases = {
+            "10.9.9.9": "10.0.0.0/8",
+            "10.1.9.9": "10.1.0.0/16",
+            "10.1.2.9": "10.1.2.0/24",
+            "10.1.2.3": "10.1.2.3/32",
+            "10.1.3.0": "10.1.0.0/16",  # back out of the /24
+            "10.2.0.0": "10.0.0.0/8",  # and out of the /16
+            "2001:db8:ffff::1": "2001:db8::/32",
+        }
+        for address, network in cases.items():
+            self.assertEqual(matcher.longest_match(address), ipaddress.ip_network(network))
+        for address in ("9.255.255.255", "11.0.0.0", "2001:db9::", "::ffff:10.0.0.1"):
+            self.assertNotIn(address, matcher)
+
+    def test_matches_a_linear_scan(self):
+        rng = random.Random(7)
+        networks = [
+            ipaddress.ip_network((rng.getrandbits(8) << 24 | rng.getrandbits(24), rng.randint(1, 32)), strict=False)
+            for _ in range(500)
+        ]
+        matcher = NetworkMatcher(networks)
+        for _ in range(2000):
+            address = ipaddress.ip_address(rng.getrandbits(32))
+            containing = [network for network in networks if address in network]
+            expected = max(containing, key=lambda network: network.prefixlen) if containing else None
+            self.assertEqual(matcher.longest_match(address), expected)
+
+    def test_adding_after_a_lookup_rebuilds_the_ranges(self):
+        matcher = NetworkMatcher(["192.0.2.0/24"])
+        self.assertNotIn("198.51.100.1", matcher)
+        matcher.add("198.51.100.0/24")
+        self.assertIn("198.51.100.1", matcher)
+        self.assertEqual(len(matcher), 2)
+
+
+class BlocklistTests(IPTrackingTestCase):
+    def snapshot(self):
+        snapshot = BlocklistSnapshot()
+        snapshot.refresh(force=True)
+        return snapshot
+
+    def test_snapshot_matches_addresses_and_networks(self):
+        BlockedIP.objects.create(ip_address="192.0.2.7")
+        BlockedNetwork.objects.create(network="10.20.0.0/16")
+        BlockedNetwork.objects.create(network="2001:db8::/32")
+        snapshot = self.snapshot()
+
+        for ip in ("192.0.2.7", "10.20.255.1", "2001:db8::42"):
+            self.assertTrue(snapshot.contains(ip), ip)
+        for ip in ("192.0.2.8", "10.21.0.1", "2001:db9::1", "not-an-ip"):
+            self.assertFalse(snapshot.contains(ip), ip)
+
+    def test_expired_blocks_do_not_apply(self):
+        BlockedIP.objects.create(ip_address="192.0.2.7", expires_at=timezone.now() - timedelta(seconds=1))
+        BlockedNetwork.objects.create(network="10.20.0.0/16", expires_at=timezone.now() - timedelta(seconds=1))
+        snapshot = self.snapshot()
+        self.assertFalse(snapshot.contains("192.0.2.7"))
+        self.assertFalse(snapshot.contains("10.20.0.1"))
+
+    def test_version_is_bumped_only_once_the_block_commits(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                BlockedIP.objects.create(ip_address="192.0.2.7")
+                self.assertIsNone(cache.get(BLOCKLIST_VERSION_KEY))
+        self.assertEqual(len(callbacks), 1)
+        self.assertIsNotNone(cache.get(BLOCKLIST_VERSION_KEY))
+
+    def test_rolled_back_block_does_not_bump_the_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                BlockedIP.objects.create(ip_address="192.0.2.7")
+                raise RuntimeError
+        self.assertIsNone(cache.get(BLOCKLIST_VERSION_KEY))
+
+    def test_batch_publishes_one_version(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            import_blocks([("ip", f"192.0.2.{host}") for host in range(1, 50)], chunk_size=10)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_middleware_refuses_blocked_clients(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BlockedIP.objects.create(ip_address="192.0.2.7")
+        blocklist.refresh(force=True)
+        self.assertEqual(self.client.get("/health/", REMOTE_ADDR="192.0.2.7").status_code, 403)
+        self.assertNotEqual(self.client.get("/health/", REMOTE_ADDR="192.0.2.8").status_code, 403)
+
+
+class RecordingWriter(RequestLogWriter):
+    """Keeps flushed batches in memory instead of writing them."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+        self.flushed = threading.Event()
+
+    def _write(self, batch):
+        self.batches.append(batch)
+        self.written += len(batch)
+        self.flushed.set()
+        return len(batch)
+
+
+class LogWriterTests(IPTrackingTestCase):
+    def writer(self, **kwargs):
+        writer = RecordingWriter(**kwargs)
+        self.addCleanup(writer.stop, 1.0)
+        return writer
+
+    def enqueue(self, writer, count, first=0):
+        for number in range(first, first + count):
+            writer.enqueue(f"10.0.0.{number}", "/", timezone.now(), status_code=200)
+
+    def test_flushes_when_a_batch_is_full(self):
+        writer = self.writer(batch_size=3, flush_interval=60)
+        writer.start()
+        self.enqueue(writer, 3)
+        self.assertTrue(writer.flushed.wait(2))
+        self.assertEqual([len(batch) for batch in writer.batches], [3])
+
+    def test_flushes_a_partial_batch_after_the_interval(self):
+        writer = self.writer(batch_size=100, flush_interval=0.05)
+        writer.start()
+        self.enqueue(writer, 2)
+        self.assertTrue(writer.flushed.wait(2))
+        self.assertEqual([len(batch) for batch in writer.batches], [2])
+
+    def test_drop_oldest_overflow(self):
+        writer = self.writer(max_queue=2, overflow=DROP_OLDEST)
+        self.enqueue(writer, 3)
+        self.assertEqual((writer.dropped, writer.enqueued, writer.queue_depth()), (1, 3, 2))
+        writer.flush()
+        self.assertEqual([record[0] for record in writer.batches[0]], ["10.0.0.1", "10.0.0.2"])
+
+    def test_block_overflow_waits_for_a_flush(self):
+        writer = self.writer(max_queue=1, overflow=BLOCK)
+        self.enqueue(writer, 1)
+        second = threading.Thread(target=self.enqueue, args=(writer, 1, 1))
+        second.start()
+        second.join(0.1)
+        self.assertTrue(second.is_alive())  # waiting for room
+        writer.flush()
+        second.join(2)
+        self.assertFalse(second.is_alive())
+        self.assertEqual((writer.dropped, writer.queue_depth()), (0, 1))
+
+    def test_stop_writes_what_is_queued(self):
+        # No flusher thread: it would write outside the test's transaction.
+        writer = RequestLogWriter(batch_size=2, flush_interval=60)
+        self.enqueue(writer, 5)
+        writer.stop()
+        self.assertEqual((writer.written, writer.queue_depth()), (5, 0))
+        self.assertEqual(RequestLog.objects.count(), 5)
+
+    def test_a_rejected_row_does_not_lose_its_batch(self):
+        writer = RequestLogWriter(batch_size=10)
+        self.enqueue(writer, 2)
+        writer.enqueue("10.0.0.9", "/", timezone.now(), status_code=-1)  # fails the CHECK constraint
+        with self.assertLogs("ip_tracking.logwriter", "ERROR"):
+            self.assertEqual(writer.flush(), 2)
+        self.assertEqual((writer.written, writer.failed), (2, 1))
+        self.assertEqual(RequestLog.objects.count(), 2)
+
+
+class ClientAddressAsyncClient(AsyncClient):
+    """AsyncClient whose requests come from `ip` (ASGI sets REMOTE_ADDR from the scope)."""
+
+    def __init__(self, ip, **defaults):
+        super().__init__(**defaults)
+        self.ip = ip
+
+    def _base_scope(self, **request):
+        return dict(super()._base_scope(**request), client=[self.ip, 50000])
+
+
+@override_settings(IP_TRACKING_REALTIME_DETECTION=False)
+class AsyncMiddlewareTests(IPTrackingTestCase):
+    async def get(self, path, ip="198.51.100.4"):
+        return await ClientAddressAsyncClient(ip).get(path)
+
+    async def test_blocked_client_gets_403(self):
+        await BlockedIP.objects.acreate(ip_address="198.51.100.4")
+        await sync_to_async(blocklist.refresh)(force=True)
+        self.assertEqual((await self.get("/api/")).status_code, 403)
+        self.assertEqual(await RequestLog.objects.acount(), 0)
+
+    async def test_logs_the_request_with_its_status(self):
+        original = IPLoggingMiddleware.aprocess_request
+        with mock.patch.object(IPLoggingMiddleware, "aprocess_request", autospec=True, side_effect=original) as native:
+            response = await self.get("/no-such-page/")
+        native.assert_called_once()
+        log = await RequestLog.objects.aget()
+        self.assertEqual((unpack_ip(log.ip), log.status_code), ("198.51.100.4", response.status_code))
+
+    @override_settings(IP_TRACKING_PATH_RULES=[{"prefix": "/api/", "sample_rate": 0}])
+    async def test_sampled_out_requests_are_not_logged(self):
+        await self.get("/api/")
+        self.assertEqual(await RequestLog.objects.acount(), 0)
+
+    @override_settings(IP_TRACKING_LOG_MODE="buffered")
+    async def test_buffered_mode_enqueues_without_writing(self):
+        writer = RecordingWriter()  # no flusher thread: rows stay queued
+        with mock.patch.object(logwriter, "_writer", writer), mock.patch.object(logwriter, "_writer_pid", os.getpid()):
+            await self.get("/api/")
+        self.assertEqual(writer.queue_depth(), 1)
+        self.assertEqual(writer._queue[0][:2], ("198.51.100.4", "/api/"))
+        self.assertEqual(await RequestLog.objects.acount(), 0)
+
+    @override_settings(IP_TRACKING_ASYNC_MIDDLEWARE=False)
+    async def test_sync_fallback_runs_process_request_in_a_thread(self):
+        native = mock.AsyncMock(side_effect=AssertionError("native async path used"))
+        with mock.patch.object(IPLoggingMiddleware, "aprocess_request", native):
+            await self.get("/api/")
+        native.assert_not_called()
+        self.assertEqual(await RequestLog.objects.acount(), 1)
+
+
+class PathRulesTests(SimpleTestCase):
+    def test_longest_prefix_wins_and_regexes_only_apply_without_one(self):
+        rules = PathRules([
+            {"prefix": "/api/", "sample_rate": 0.5},
+            {"prefix": "/api/v1/export", "sample_rate": 0},
+            {"regex": r"^/api/v1/", "sample_rate": 0.25},
+            {"regex": r"^/docs/", "sample_rate": 0.1},
+            {"regex": r"^/docs/internal/", "sample_rate": 0},
+        ], default_sample_rate=0.75)
+        cases = {
+            "/api/v1/export/": 0,  # longer of two prefixes
+            "/api/v1/users/": 0.5,  # a prefix beats a regex
+            "/api/": 0.5,
+            "/docs/internal/": 0.1,  # first listed regex wins
+            "/ap": 0.75,  # partial prefix: default
+            "/": 0.75,
+        }
+        for path, sample_rate in cases.items():
+            self.assertEqual(rules.match(path).sample_rate, sample_rate, path)
+
+    def test_sample_rate_zero_and_one_never_draw(self):
+        def draw():
+            raise AssertionError("random draw for a fixed rate")
+
+        self.assertFalse(PathRule("/static/", sample_rate=0).should_log(draw))
+        self.assertTrue(PathRule("/login/", sample_rate=1).should_log(draw))
+        self.assertTrue(PathRule("/health/", sample_rate=0.01).should_log(lambda: 0.005))
+        self.assertFalse(PathRule("/health/", sample_rate=0.01).should_log(lambda: 0.01))
+
+    def test_rule_needs_a_prefix_or_regex(self):
+        with self.assertRaises(ImproperlyConfigured):
+            PathRules([{"sample_rate": 0}])
+
+
+@override_settings(IP_TRACKING_REALTIME_DETECTION=False)
+class PathRuleMiddlewareTests(IPTrackingTestCase):
+    @override_settings(IP_TRACKING_PATH_RULES=[{"prefix": "/api/", "geolocate": False}])
+    def test_geolocate_false_logs_without_a_lookup(self):
+        with mock.patch.object(IPLoggingMiddleware, "get_geolocation", side_effect=AssertionError):
+            self.client.get("/api/", REMOTE_ADDR="198.51.100.9")
+        row = RequestLog.objects.get()
+        self.assertEqual((row.location_id, row.geo_pending), (None, False))
+
+    @override_settings(IP_TRACKING_PATH_RULES=[{"prefix": "/api/", "sample_rate": 0}])
+    def test_excluded_paths_are_still_blocked(self):
+        BlockedIP.objects.create(ip_address="198.51.100.9")
+        blocklist.refresh(force=True)
+        self.assertEqual(self.client.get("/api/", REMOTE_ADDR="198.51.100.9").status_code, 403)
+        self.assertFalse(RequestLog.objects.exists())
+
+
+class RateLimitTests(IPTrackingTestCase):
+    def request(self, remote_addr, forwarded_for=None):
+        headers = {"REMOTE_ADDR": remote_addr}
+        if forwarded_for:
+            headers["HTTP_X_FORWARDED_FOR"] = forwarded_for
+        return RequestFactory().get("/", **headers)
+
+    def test_token_bucket_allows_the_limit_then_refills(self):
+        limiter = RateLimiter("3/m", algorithm=TOKEN_BUCKET, store=LocalStore())
+        allowed = [limiter.check_key("a", now=100.0).allowed for _ in range(4)]
+        self.assertEqual(allowed, [True, True, True, False])
+        self.assertAlmostEqual(limiter.check_key("a", now=100.0).retry_after, 20.0, places=3)
+        self.assertTrue(limiter.check_key("a", now=120.0).allowed)
+
+    def test_sliding_log_forgets_hits_past_the_period(self):
+        limiter = RateLimiter("2/10s", algorithm=SLIDING_LOG, store=LocalStore())
+        self.assertTrue(limiter.check_key("a", now=0.0).allowed)
+        self.assertTrue(limiter.check_key("a", now=5.0).allowed)
+        self.assertFalse(limiter.check_key("a", now=9.0).allowed)
+        self.assertTrue(limiter.check_key("a", now=10.5).allowed)
+
+    def test_cache_store_counts_across_limiters(self):
+        first = RateLimiter("2/m", group="shared", store=CacheStore())
+        second = RateLimiter("2/m", group="shared", store=CacheStore())
+        self.assertTrue(first.check_key("a", now=60.0).allowed)
+        self.assertTrue(second.check_key("a", now=60.0).allowed)
+        self.assertFalse(first.check_key("a", now=60.0).allowed)
+
+    def test_local_store_evicts_least_recently_used_keys(self):
+        limiter = RateLimiter("1/m", algorithm=TOKEN_BUCKET, store=LocalStore(max_keys=2))
+        limiter.check_key("offender", now=0.0)
+        limiter.check_key("b", now=0.0)
+        self.assertFalse(limiter.check_key("offender", now=1.0).allowed)  # keeps it recent
+        limiter.check_key("c", now=1.0)  # evicts "b", not "offender"
+        self.assertFalse(limiter.check_key("offender", now=2.0).allowed)
+
+    def test_ip_key_ignores_forwarded_for_from_untrusted_peers(self):
+        self.assertEqual(get_key(self.request("198.51.100.9", "1.2.3.4"), "ip"), "198.51.100.9")
+
+    @override_settings(IP_TRACKING_TRUSTED_PROXIES=["10.0.0.0/8"])
+    def test_ip_key_reads_forwarded_for_behind_trusted_proxies(self):
+        # The client sent "1.2.3.4" itself; the proxies appended what they saw.
+        request = self.request("10.0.0.2", "1.2.3.4, 203.0.113.7, 10.0.0.1")
+        self.assertEqual(get_key(request, "ip"), "203.0.113.7")
+        self.assertEqual(get_key(self.request("198.51.100.9", "1.2.3.4"), "ip"), "198.51.100.9")
+
+
+class RealtimeTests(IPTrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.sketch_file = os.path.join(directory.name, "realtime.sketch")
+
+    def tracker(self, **kwargs):
+        tracker = RateTracker(threshold=5, window=60, width=1024, **kwargs)
+        self.addCleanup(tracker.close)
+        return tracker
+
+    def test_flags_once_when_the_threshold_is_crossed(self):
+        tracker = self.tracker()
+        flagged = [tracker.hit("203.0.113.1", now=100.0) for _ in range(8)]
+        self.assertEqual(flagged, [False] * 5 + [True, False, False])
+
+    def test_findings_are_marked_as_estimates(self):
+        emitter = mock.Mock()
+        tracker = self.tracker(emitter=emitter)
+        for _ in range(6):
+            tracker.hit("203.0.113.1", now=100.0)
+        finding = emitter.emit.call_args.args[0]
+        self.assertEqual((finding.ip_address, finding.rule, finding.hits), ("203.0.113.1", "rate_estimate", 6))
+
+    def test_counts_expire_with_the_window(self):
+        tracker = self.tracker()
+        for _ in range(5):
+            tracker.hit("203.0.113.1", now=100.0)
+        self.assertEqual(tracker.sketch.estimate("203.0.113.1", 100.0), 5)
+        self.assertEqual(tracker.sketch.estimate("203.0.113.1", 170.0), 0)
+
+    def test_workers_sharing_a_sketch_file_count_together(self):
+        workers = [self.tracker(sketch_file=self.sketch_file) for _ in range(3)]
+        flagged = [workers[number % 3].hit("203.0.113.1", now=100.0) for number in range(6)]
+        self.assertEqual(flagged, [False] * 5 + [True])
+
+        separate = [self.tracker() for _ in range(3)]
+        flagged = [separate[number % 3].hit("203.0.113.1", now=100.0) for number in range(6)]
+        self.assertEqual(flagged, [False] * 6)
+
+    def test_sketch_file_of_another_shape_starts_afresh(self):
+        first = self.tracker(sketch_file=self.sketch_file)
+        for _ in range(4):
+            first.hit("203.0.113.1", now=100.0)
+        first.close()
+        wider = RateTracker(threshold=5, window=60, width=2048, sketch_file=self.sketch_file)
+        self.addCleanup(wider.close)
+        self.assertEqual(wider.sketch.estimate("203.0.113.1", 100.0), 0)
+
+
+class InterningTests(IPTrackingTestCase):
+    @override_settings(IP_TRACKING_INTERN_MAX_PATHS=3)
+    def test_paths_past_the_cap_are_logged_as_overflow(self):
+        for number in range(6):
+            self.log("10.0.0.1", f"/probe-{number}")
+
+        self.assertEqual(LogPath.objects.count(), 4)  # three paths and the overflow bucket
+        paths = RequestLog.objects.order_by("id").values_list("path__path", flat=True)
+        self.assertEqual(list(paths), ["/probe-0", "/probe-1", "/probe-2"] + [OVERFLOW_PATH] * 3)
+        self.assertLessEqual(get_path_interner().stats()["size"], 4)
+
+    def test_cache_evicts_least_recently_used(self):
+        interner = Interner(LogPath, ["path"], max_size=2)
+        # Ids are cached once the transaction that may have created them commits.
+        with self.captureOnCommitCallbacks(execute=True):
+            interner.ids(["/a", "/b"])
+        interner.ids(["/a"])  # /b is now the least recently used
+        with self.captureOnCommitCallbacks(execute=True):
+            interner.ids(["/c"])
+        interner.hits = interner.misses = 0
+
+        interner.ids(["/a", "/c"])
+        self.assertEqual((interner.hits, interner.misses), (2, 0))
+        interner.ids(["/b"])
+        self.assertEqual(interner.misses, 1)
+
+
+class RollupTests(IPTrackingTestCase):
+    def test_counts_requests_and_client_errors(self):
+        then = timezone.now() - timedelta(minutes=5)
+        self.log("10.0.0.1", "/api/", timestamp=then, country="Ghana")
+        self.log("10.0.0.1", "/api/", timestamp=then, country="Ghana", status_code=404)
+        self.log("10.0.0.1", "/api/", timestamp=timezone.now())  # not settled yet
+
+        self.assertEqual(rollup_request_logs()["rows"], 2)
+        self.assertEqual(
+            list(MinuteRollup.objects.values_list("ip_address", "path", "country", "requests", "errors")),
+            [("10.0.0.1", "/api/", "Ghana", 2, 1)],
+        )
+        self.assertEqual(rollup_request_logs()["rows"], 0)
+
+    @override_settings(IP_TRACKING_GEO_BACKENDS=[STUB_GEO_BACKEND])
+    def test_enrichment_moves_rolled_up_counts_to_the_country(self):
+        then = timezone.now() - timedelta(minutes=5)
+        self.log("10.0.0.1", "/api/", timestamp=then, geo_pending=True)
+        self.log("10.0.0.1", "/api/", timestamp=then, geo_pending=True, status_code=403)
+        self.log("10.0.0.1", "/api/", timestamp=then, country="Ghana")
+        rollup_request_logs()
+        self.assertEqual(MinuteRollup.objects.get(country="").requests, 2)
+
+        self.log("10.0.0.1", "/api/", timestamp=timezone.now(), geo_pending=True)  # not rolled up yet
+        enrich_request_logs()
+
+        country = StubGeoBackend().lookup("10.0.0.1")["country"]
+        for model in (MinuteRollup, HourRollup):
+            self.assertEqual(
+                sorted(model.objects.values_list("country", "requests", "errors")),
+                sorted([("Ghana", 1, 0), (country, 2, 1)]),
+            )
+        self.assertFalse(RequestLog.objects.filter(geo_pending=True).exists())
+
+
+class RecordFindingsTests(IPTrackingTestCase):
+    def test_upsert_keeps_the_most_hits(self):
+        seen = timezone.now()
+        window = window_start(seen)
+        record_findings([Finding("10.0.0.1", "rate", window, 120, "120 requests in the hour", seen)])
+        later = seen + timedelta(seconds=5)
+        self.assertEqual(record_findings([
+            Finding("10.0.0.1", "rate", window, 101, "101 requests so far", later),  # fewer hits
+            Finding("10.0.0.2", "rate", window, 7, "7 requests", seen),
+            Finding("10.0.0.2", "rate", window, 9, "9 requests", seen),
+        ]), 2)
+
+        rows = {row.ip_address: row for row in SuspiciousIP.objects.all()}
+        self.assertEqual(len(rows), 2)
+        self.assertEqual((rows["10.0.0.1"].hits, rows["10.0.0.1"].reason), (120, "120 requests in the hour"))
+        self.assertEqual((rows["10.0.0.1"].detected_at, rows["10.0.0.1"].last_seen), (seen, later))
+        self.assertEqual(rows["10.0.0.2"].hits, 9)
+
+        record_findings([Finding("10.0.0.1", "rate", window, 150, "150 requests in the hour", later)])
+        self.assertEqual(SuspiciousIP.objects.get(ip_address="10.0.0.1").hits, 150)
+
+
+@override_settings(IP_TRACKING_DETECT_RATE_THRESHOLD=5)
+class DetectionTests(IPTrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        then = timezone.now() - timedelta(minutes=10)
+        for second in range(8):
+            self.log("10.0.0.1", "/api/", timestamp=then + timedelta(seconds=second))
+        self.log("10.0.0.2", "/admin/login/", timestamp=then)
+        for ip in ("10.0.0.3", "10.0.0.4", "2001:db8::1"):
+            self.log(ip, "/", timestamp=then)
+            self.log(ip, "/about/", timestamp=then)
+
+    def findings(self):
+        return set(SuspiciousIP.objects.values_list("ip_address", "rule"))
+
+    def test_every_mode_flags_the_same_ips(self):
+        expected = {("10.0.0.1", "rate"), ("10.0.0.2", "sensitive_path:/admin")}
+        for mode in ("incremental", "full", "pipeline"):  # incremental first: full consumes the new rows
+            with self.subTest(mode=mode):
+                SuspiciousIP.objects.all().delete()
+                result = detect_anomalies(mode)
+                self.assertEqual(result["flagged"], 2)
+                self.assertEqual(self.findings(), expected)
+
+    def test_incremental_mode_skips_ips_without_new_traffic(self):
+        detect_anomalies("incremental")
+        SuspiciousIP.objects.all().delete()
+        self.assertEqual(detect_anomalies("incremental")["flagged"], 0)
+
+    def test_ip_ranges_split_rows_evenly_and_disjointly(self):
+        window = RequestLog.objects.all()
+        ranges = ip_ranges(window, 3)
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual((ranges[0][0], ranges[-1][1]), (None, None))
+        sizes = [window.filter(in_ip_range(lower, upper)).count() for lower, upper in ranges]
+        self.assertEqual(sum(sizes), window.count())
+        self.assertEqual(ip_ranges(window, 50)[-1][1], None)  # never more ranges than IPs
+        self.assertLessEqual(len(ip_ranges(window, 50)), 5)
+
+    def test_partitions_find_what_one_batch_finds(self):
+        now = timezone.now()
+        since = (now - timedelta(hours=1)).isoformat()
+        whole = run_detectors(WindowBatch.from_queryset(RequestLog.objects.all()), now)
+        merged = []
+        for lower, upper in ip_ranges(RequestLog.objects.all(), 3):
+            merged.extend(detect_partition(lower and lower.hex(), upper and upper.hex(), since, now.isoformat()))
+        self.assertEqual(
+            sorted(merged),
+            sorted([finding.ip_address, finding.rule, finding.hits, finding.reason] for finding in whole),
+        )
+
+    @override_settings(IP_TRACKING_DETECTION_PARTITIONS=2, IP_TRACKING_DETECTION_EXECUTOR="process")
+    def test_daemonic_workers_shard_with_celery_instead_of_a_process_pool(self):
+        prefork_child = mock.Mock(daemon=True)
+        with (
+            mock.patch("ip_tracking.detectors.multiprocessing.current_process", return_value=prefork_child),
+            mock.patch("ip_tracking.detectors.ProcessPoolExecutor", side_effect=AssertionError),
+        ):
+            result = detect_anomalies("pipeline")
+            whole = run_partitioned(WindowBatch.from_queryset(RequestLog.objects.all()), timezone.now(), 2)
+        self.assertEqual(result["partitions"], 2)
+        self.assertEqual(self.findings(), {("10.0.0.1", "rate"), ("10.0.0.2", "sensitive_path:/admin")})
+        self.assertEqual({(finding.ip_address, finding.rule) for finding in whole}, self.findings())
+
+
+class FailingBackend(GeoBackend):
+    remote = True
+
+    def lookup(self, ip):
+        raise GeoLookupError("provider down")
+
+
+class SlowFirstBackend(GeoBackend):
+    """Never answers its first lookup (the caller is cancelled instead)."""
+
+    remote = True
+
+    def __init__(self):
+        self.calls = 0
+
+    async def alookup(self, ip):
+        self.calls += 1
+        if self.calls == 1:
+            await asyncio.Event().wait()
+        return {"country": "Ghana", "city": "Accra"}
+
+
+@override_settings(IP_TRACKING_PATH_RULES=[{"prefix": "/api/", "sample_rate": 0}], IP_TRACKING_REALTIME_DETECTION=False)
+class SuspiciousIPsViewTests(IPTrackingTestCase):
+    """Requests to the view itself are not logged, so assertNumQueries counts the listing only."""
+
+    url = "/api/v1/suspicious-ips/"
+
+    def flag(self, ip, minutes_ago=0):
+        seen = timezone.now() - timedelta(minutes=minutes_ago)
+        return SuspiciousIP.objects.create(
+            ip_address=ip, rule="rate", window_start=window_start(seen), reason="test",
+            detected_at=seen, last_seen=seen,
+        )
+
+    def test_blocked_status_comes_from_the_listing_query(self):
+        now = timezone.now()
+        for minutes_ago, ip in enumerate(["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]):
+            self.flag(ip, minutes_ago)
+        BlockedIP.objects.create(ip_address="10.0.0.1")
+        BlockedIP.objects.create(ip_address="10.0.0.2", expires_at=now + timedelta(hours=1))
+        BlockedIP.objects.create(ip_address="10.0.0.3", expires_at=now - timedelta(hours=1))
+        blocklist.refresh(force=True)
+
+        with self.assertNumQueries(1):
+            body = self.client.get(self.url).json()
+        rows = {row["ip_address"]: row for row in body["suspicious_ips"]}
+        self.assertEqual(
+            {ip: row["is_blocked"] for ip, row in rows.items()},
+            {"10.0.0.1": True, "10.0.0.2": True, "10.0.0.3": False, "10.0.0.4": False},
+        )
+        self.assertIsNone(rows["10.0.0.1"]["blocked_until"])
+        self.assertIsNotNone(rows["10.0.0.2"]["blocked_until"])
+
+    def test_listing_is_cached_until_findings_or_blocks_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flag("10.0.0.1")
+        self.assertEqual(self.client.get(self.url).json()["count"], 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json()["count"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.flag("10.0.0.2")
+            self.assertEqual(self.client.get(self.url).json()["count"], 1)  # version bumped on commit only
+        self.assertTrue(callbacks)
+        self.assertEqual(self.client.get(self.url).json()["count"], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BlockedIP.objects.create(ip_address="10.0.0.2")
+        blocklist.refresh(force=True)
+        rows = self.client.get(self.url).json()["suspicious_ips"]
+        self.assertTrue(next(row for row in rows if row["ip_address"] == "10.0.0.2")["is_blocked"])
+
+    def test_if_none_match_gets_304_until_the_listing_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flag("10.0.0.1")
+        response = self.client.get(self.url)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flag("10.0.0.2")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class FixedBackend(GeoBackend):
+    def __init__(self, geo_data):
+        self.geo_data = geo_data
+
+    def lookup(self, ip):
+        return self.geo_data
+
+
+class RangeFileBackendTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "ranges.csv")
+        with open(self.path, "w", newline="", encoding="utf-8") as handle:
+            csv.writer(handle).writerows([
+                ["start", "end", "country", "city"],
+                ["192.0.2.0", "192.0.2.255", "Ghana", "Accra"],
+                [int(ipaddress.ip_address("198.51.100.0")), int(ipaddress.ip_address("198.51.100.127")), "Togo"],
+                ["2001:db8::", "2001:db8::ffff", "Kenya", "Nairobi"],
+                ["203.0.113.0", "2001:db8:1::"],  # too short
+                ["203.0.113.0", "2001:db8:1::", "Mixed", ""],  # start and end of different versions
+            ])
+        self.backend = RangeFileBackend(self.path)
+
+    def test_dotted_quad_integer_and_ipv6_rows(self):
+        cases = {
+            "192.0.2.0": {"country": "Ghana", "city": "Accra"},
+            "192.0.2.255": {"country": "Ghana", "city": "Accra"},
+            "198.51.100.0": {"country": "Togo", "city": None},
+            "198.51.100.127": {"country": "Togo", "city": None},
+            "2001:db8::": {"country": "Kenya", "city": "Nairobi"},
+            "2001:db8::ffff": {"country": "Kenya", "city": "Nairobi"},
+        }
+        for address, geo_data in cases.items():
+            self.assertEqual(self.backend.lookup(address), geo_data, address)
+        self.assertEqual(len(self.backend._tables[4][0]), 2)  # header and bad rows skipped
+        self.assertEqual(len(self.backend._tables[6][0]), 1)
+
+    def test_addresses_just_outside_a_range_are_unknown(self):
+        for address in ("192.0.1.255", "192.0.3.0", "198.51.100.128", "2001:db8::1:0", "203.0.113.1", "not-an-ip"):
+            self.assertIsNone(self.backend.lookup(address), address)
+
+    def test_alookup_loads_the_file(self):
+        self.assertEqual(asyncio.run(self.backend.alookup("192.0.2.7"))["country"], "Ghana")
+
+    def test_unanswered_lookups_fall_through_to_the_next_backend(self):
+        locator = GeoLocator([self.backend, FixedBackend({"country": "Mali", "city": None})])
+        self.assertEqual(locator.lookup("192.0.2.1")["country"], "Ghana")
+        self.assertEqual(locator.lookup("203.0.113.1")["country"], "Mali")
+
+
+class GeoLocatorTests(IPTrackingTestCase):
+    def test_failed_refresh_keeps_the_stale_answer(self):
+        locator = GeoLocator([FailingBackend()], negative_timeout=300)
+        cache.set(locator._cache_key("8.8.8.8"), ("Ghana", "Accra", time.time() - 1))
+
+        self.assertEqual(locator.lookup("8.8.8.8"), {"country": "Ghana", "city": "Accra"})
+        deadline = time.time() + 5
+        while cache.get(locator._cache_key("8.8.8.8"))[2] < time.time() and time.time() < deadline:
+            time.sleep(0.01)
+
+        country, city, fresh_until = cache.get(locator._cache_key("8.8.8.8"))
+        self.assertEqual((country, city), ("Ghana", "Accra"))
+        self.assertGreater(fresh_until, time.time() + 200)
+        self.assertEqual(locator.failures, 1)
+
+    def test_failed_lookup_without_stale_answer_is_negative(self):
+        locator = GeoLocator([FailingBackend()])
+        self.assertEqual(locator.lookup("8.8.8.8"), EMPTY_GEO)
+        self.assertEqual(cache.get(locator._cache_key("8.8.8.8"))[:2], (None, None))
+
+    def test_cancelled_leader_does_not_cancel_coalesced_waiters(self):
+        backend = SlowFirstBackend()
+        locator = GeoLocator([backend])
+
+        async def scenario():
+            leader = asyncio.ensure_future(locator.alookup("8.8.8.8"))
+            while "8.8.8.8" not in locator._ainflight:
+                await asyncio.sleep(0.001)
+            waiter = asyncio.ensure_future(locator.alookup("8.8.8.8"))
+            while not locator.coalesced:
+                await asyncio.sleep(0.001)
+            leader.cancel()
+            return await waiter
+
+        self.assertEqual(asyncio.run(scenario()), {"country": "Ghana", "city": "Accra"})
+        self.assertEqual(backend.calls, 2)
+
+
+class EscalationTests(IPTrackingTestCase):
+    def finding(self, ip, rule, hours_ago=0, hits=10):
+        window = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours_ago)
+        return SuspiciousIP.objects.create(ip_address=ip, rule=rule, window_start=window, hits=hits, reason=rule)
+
+    def test_sensitive_path_findings_alone_never_block(self):
+        for rule in ("sensitive_path:/admin", "sensitive_path:/login", "sensitive_path:/.env"):
+            self.finding("203.0.113.5", rule)
+        self.assertEqual(escalate(), {"blocked": 0, "extended": 0})
+        self.assertFalse(BlockedIP.objects.exists())
+
+    def test_repeated_rate_findings_block_for_an_hour(self):
+        for hours_ago in range(3):
+            self.finding("203.0.113.5", "rate", hours_ago)
+        self.assertEqual(escalate(), {"blocked": 1, "extended": 0})
+        block = BlockedIP.objects.get()
+        self.assertEqual(block.reason, "Escalated by policy repeat-offender")
+        self.assertAlmostEqual((block.expires_at - timezone.now()).total_seconds(), 3600, delta=60)
+        self.assertEqual(escalate(), {"blocked": 0, "extended": 0})
+
+    def test_severe_rate_finding_blocks_for_a_day(self):
+        self.finding("203.0.113.5", "rate", hits=5000)
+        self.assertEqual(escalate(), {"blocked": 1, "extended": 0})
+        self.assertEqual(BlockedIP.objects.get().reason, "Escalated by policy severe-rate")
+
+    def test_manual_block_makes_an_escalated_block_permanent(self):
+        BlockedIP.objects.create(
+            ip_address="203.0.113.5",
+            expires_at=timezone.now() + timedelta(hours=1),
+            reason="Escalated by policy repeat-offender",
+        )
+        out = StringIO()
+        call_command("block_ip", "203.0.113.5", "--reason", "abuse report", stdout=out)
+
+        block = BlockedIP.objects.get()
+        self.assertIsNone(block.expires_at)
+        self.assertEqual(block.reason, "abuse report")
+        self.assertIn("updated the block", out.getvalue())
+
+        out = StringIO()
+        call_command("block_ip", "203.0.113.5", "--reason", "abuse report", stdout=out)
+        self.assertIn("already blocked", out.getvalue())
+
+    def test_forwarded_for_from_a_client_picks_neither_the_logged_nor_the_blocked_ip(self):
+        self.client.get("/api/", REMOTE_ADDR="198.51.100.66", HTTP_X_FORWARDED_FOR="203.0.113.200")
+        self.assertEqual(unpack_ip(RequestLog.objects.get().ip), "198.51.100.66")
+
+        BlockedIP.objects.create(ip_address="198.51.100.66")
+        blocklist.refresh(force=True)
+        response = self.client.get("/api/", REMOTE_ADDR="198.51.100.66", HTTP_X_FORWARDED_FOR="203.0.113.201")
+        self.assertEqual(response.status_code, 403)
+
+    def test_realtime_estimates_never_block(self):
+        self.finding("203.0.113.5", "rate_estimate", hits=5000)
+        for hours_ago in range(3):
+            self.finding("203.0.113.6", "rate_estimate", hours_ago)
+        policies = DEFAULT_POLICIES + [{"name": "any-rule", "min_hits": 1, "ttl": 60}]
+        self.assertEqual(escalate(policies=policies), {"blocked": 0, "extended": 0})
+        self.assertFalse(BlockedIP.objects.exists())
+
+    def test_scheduled_escalation_is_opt_in(self):
+        self.finding("203.0.113.5", "rate", hits=5000)
+        self.assertEqual(escalate_suspicious_ips()["blocked"], 0)
+        self.assertFalse(BlockedIP.objects.exists())
+        with override_settings(IP_TRACKING_ESCALATION_ENABLED=True):
+            self.assertEqual(escalate_suspicious_ips()["blocked"], 1)
+
+
+class PaginationTests(IPTrackingTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now().replace(microsecond=0)
+        # Pairs share a timestamp, so pages have to break ties on id.
+        self.rows = [self.log("10.0.0.1", f"/page/{n}", timestamp=now - timedelta(seconds=n // 2)) for n in range(7)]
+        self.newest_first = [row.id for row in sorted(self.rows, key=lambda row: (row.timestamp, row.id), reverse=True)]
+
+    def walk(self, queryset, limit):
+        ids, cursor, pages = [], None, 0
+        while True:
+            page, next_cursor = log_page(queryset, decode_cursor(cursor) if cursor else None, limit)
+            ids.extend(row["id"] for row in page)
+            pages += 1
+            if next_cursor is None:
+                return ids, pages
+            cursor = next_cursor
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        ids, pages = self.walk(filter_logs(path_prefix="/page/"), limit=3)
+        self.assertEqual(ids, self.newest_first)
+        self.assertEqual(pages, 3)
+
+    def test_rows_logged_meanwhile_do_not_shift_later_pages(self):
+        logs = filter_logs(path_prefix="/page/")
+        first, cursor = log_page(logs, limit=3)
+        self.log("10.0.0.2", "/page/new")
+        second, _ = log_page(logs, decode_cursor(cursor), limit=3)
+        self.assertEqual([row["id"] for row in first + second], self.newest_first[:6])
+
+    def test_view_pages_and_rejects_bad_input(self):
+        url = "/api/v1/request-logs/"
+        body = self.client.get(url, {"path": "/page/", "limit": 4}).json()
+        self.assertEqual(body["count"], 4)
+        rest = self.client.get(url, {"path": "/page/", "limit": 4, "cursor": body["next_cursor"]}).json()
+        self.assertEqual([row["id"] for row in body["request_logs"] + rest["request_logs"]], self.newest_first)
+        self.assertIsNone(rest["next_cursor"])
+
+        self.assertEqual(self.client.get(url, {"cursor": "not-a-cursor"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": 0}).status_code, 400)
+
+    def test_export_streams_every_row_in_batches(self):
+        batches = list(iter_log_batches(filter_logs(path_prefix="/page/"), batch_size=3))
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        batches = list(iter_log_batches(filter_logs(path_prefix="/page/"), batch_size=3, max_rows=4))
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+
+    @override_settings(IP_TRACKING_LOG_EXPORT_TOKEN="secret", IP_TRACKING_LOG_EXPORT_MAX_ROWS=5)
+    def test_export_needs_staff_or_the_token_and_is_capped(self):
+        url = "/api/v1/request-logs/"
+        params = {"path": "/page/", "export": "ndjson"}
+        self.assertEqual(self.client.get(url, params).status_code, 403)
+        self.assertEqual(self.client.get(url, params, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+        response = self.client.get(url, params, HTTP_AUTHORIZATION="Bearer secret")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row["id"] for row in rows], self.newest_first[:5])
+
+        self.client.force_login(get_user_model().objects.create_user("ops", password="pw", is_staff=True))
+        response = self.client.get(url, dict(params, export="csv"))
+        self.assertEqual(len(b"".join(response.streaming_content).decode().splitlines()), 6)  # header + 5
+
+
+class BlockFeedTests(IPTrackingTestCase):
+    def test_feed_reader_normalizes_and_counts_invalid_lines(self):
+        feed = FeedReader(["# header", "10.0.0.1, scanner", "10.1.2.3/16", "2001:db8::1/128", "nonsense", ""])
+        self.assertEqual(
+            list(feed),
+            [("ip", "10.0.0.1"), ("network", "10.1.0.0/16"), ("ip", "2001:db8::1")],
+        )
+        self.assertEqual((feed.invalid_count, feed.invalid), (1, ["nonsense"]))
+
+    def test_import_renews_expiring_and_expired_blocks(self):
+        now = timezone.now()
+        BlockedIP.objects.create(ip_address="10.0.0.1", expires_at=now - timedelta(hours=1), reason="feed")
+        BlockedIP.objects.create(ip_address="10.0.0.2", expires_at=now + timedelta(days=1), reason="feed")
+        BlockedIP.objects.create(ip_address="10.0.0.3", reason="feed")
+        renewed = now + timedelta(days=2)
+
+        result = import_blocks(
+            [("ip", "10.0.0.1"), ("ip", "10.0.0.2"), ("ip", "10.0.0.4"), ("network", "10.9.0.0/16")],
+            expires_at=renewed, reason="feed", chunk_size=2,
+        )
+
+        self.assertEqual(result, {"created": 2, "updated": 2, "existing": 0})
+        self.assertEqual(
+            set(BlockedIP.objects.filter(expires_at=renewed).values_list("ip_address", flat=True)),
+            {"10.0.0.1", "10.0.0.2", "10.0.0.4"},
+        )
+        self.assertIsNone(BlockedIP.objects.get(ip_address="10.0.0.3").expires_at)
+        self.assertTrue(BlockedNetwork.objects.filter(network="10.9.0.0/16").exists())
+        self.assertEqual(
+            import_blocks([("ip", "10.0.0.1")], expires_at=renewed, reason="feed"),
+            {"created": 0, "updated": 0, "existing": 1},
+        )
+
+    def test_dry_run_writes_nothing(self):
+        BlockedIP.objects.create(ip_address="10.0.0.1", reason="old")
+        result = import_blocks([("ip", "10.0.0.1"), ("ip", "10.0.0.2")], reason="feed", dry_run=True)
+        self.assertEqual(result, {"created": 1, "updated": 0, "existing": 1})
+        self.assertEqual(list(BlockedIP.objects.values_list("ip_address", "reason")), [("10.0.0.1", "old")])
+
+    def test_import_never_retags_or_shortens_other_blocks(self):
+        now = timezone.now()
+        BlockedIP.objects.create(ip_address="10.0.0.1", reason="manual: abuse report")
+        BlockedIP.objects.create(ip_address="10.0.0.2", expires_at=now + timedelta(days=7), reason="feed")
+
+        result = import_blocks(
+            [("ip", "10.0.0.1"), ("ip", "10.0.0.2")], expires_at=now + timedelta(hours=1), reason="feed"
+        )
+
+        self.assertEqual(result, {"created": 0, "updated": 0, "existing": 2})
+        manual = BlockedIP.objects.get(ip_address="10.0.0.1")
+        self.assertEqual((manual.expires_at, manual.reason), (None, "manual: abuse report"))
+        self.assertEqual(BlockedIP.objects.get(ip_address="10.0.0.2").expires_at, now + timedelta(days=7))
+
+        sync_blocks([], reason="feed")
+        self.assertEqual(list(BlockedIP.objects.values_list("ip_address", flat=True)), ["10.0.0.1"])
+
+    def test_sync_removes_only_dropped_entries_of_the_feed(self):
+        BlockedIP.objects.create(ip_address="10.0.0.1", reason="feed")
+        BlockedIP.objects.create(ip_address="10.0.0.2", reason="feed")
+        BlockedIP.objects.create(ip_address="10.0.0.3", reason="manual")
+
+        result = sync_blocks([("ip", "10.0.0.1"), ("ip", "10.0.0.4")], reason="feed")
+
+        self.assertEqual(result, {"created": 1, "updated": 0, "existing": 1, "removed": 1})
+        self.assertEqual(
+            sorted(BlockedIP.objects.values_list("ip_address", flat=True)),
+            ["10.0.0.1", "10.0.0.3", "10.0.0.4"],
+        )
+
+
+@override_settings(
+    CACHES=LOCMEM_CACHES,
+    IP_TRACKING_GEO_BACKENDS=[],
+    IP_TRACKING_METRICS_DIR="",
+    IP_TRACKING_LOG_MODE="sync",
+    IP_TRACKING_GEO_MODE="inline",
+    IP_TRACKING_REALTIME_DETECTION=False,
+)
+class PrunedInternedIdTests(TransactionTestCase):
+    """Foreign keys are only checked on commit, so this needs real transactions."""
+
+    def setUp(self):
+        reset_interners()
+
+    def test_insert_rebuilds_rows_whose_cached_path_was_pruned(self):
+        pruned = LogPath.objects.create(path="/gone/").pk
+        get_path_interner()._ids.set("/gone/", pruned)
+        LogPath.objects.filter(pk=pruned).delete()  # by another process
+
+        insert_request_logs([("10.0.0.1", "/gone/", timezone.now(), None, None, False, 200)])
+
+        self.assertEqual(list(RequestLog.objects.values_list("path__path", flat=True)), ["/gone/"])
+        self.assertNotEqual(RequestLog.objects.get().path_id, pruned)
+
+
+class ReplayTests(TransactionTestCase):
+    """Interned ids are only cached on commit, so this needs real transactions."""
+
+    def setUp(self):
+        cache.clear()
+        reset_interners()
+
+    def test_queries_per_request_and_cache_hit_ratios(self):
+        trace = list(synthetic_trace(300, 20, ["/api/", "/no-such-page/"], [3, 1], skew=0))
+        # The test database and cache are already throwaway ones.
+        result = replay(trace, driver="wsgi", warmup=100, isolate=False)
+
+        self.assertEqual(result["requests"], 200)
+        self.assertEqual(RequestLog.objects.count(), 300)
+        # One INSERT per logged request; the blocklist, paths and locations are served from memory.
+        self.assertEqual(result["queries_per_request"], 1.0)
+        self.assertEqual(result["writes_per_request"], 1.0)
+        self.assertEqual(result["caches"]["geo_local"]["hit_ratio"], 1.0)
+        self.assertEqual(result["caches"]["path_intern"]["hit_ratio"], 1.0)
+        self.assertEqual(result["caches"]["location_intern"]["hit_ratio"], 1.0)
+        self.assertEqual(result["geo_provider_calls"], 0)
+
+
+class MetricsTests(IPTrackingTestCase):
+    def registry(self):
+        registry = Registry()
+        requests = registry.counter("requests_total", "Requests.", ("outcome",), [("ok",), ("failed",)])
+        latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        return registry, requests, latency
+
+    def test_render_counters_and_histograms(self):
+        registry, requests, latency = self.registry()
+        requests.child("ok").inc()
+        requests.child("ok").inc(2)
+        latency.child().observe(0.05)
+        latency.child().observe(0.5)
+        latency.child().observe(5)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{outcome="ok"} 3', lines)
+        self.assertIn('requests_total{outcome="failed"} 0', lines)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("latency_seconds_sum 5.55", lines)
+        self.assertIn("latency_seconds_count 3", lines)
+
+    def test_render_sums_every_process_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry, requests, _ = self.registry()
+        with override_settings(IP_TRACKING_METRICS_DIR=directory):
+            requests.child("failed").inc(4)
+            own = os.path.join(directory, f"{os.getpid()}.metrics")
+            shutil.copyfile(own, os.path.join(directory, "1.metrics"))  # another worker's counters
+            self.assertIn('requests_total{outcome="failed"} 8', registry.render().splitlines())
+
+    def test_closed_by_default(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(b"ip_tracking_requests_total", response.content)
+
+    @override_settings(IP_TRACKING_METRICS_TOKEN="secret")
+    def test_bearer_token(self):
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE ip_tracking_requests_total counter", response.content)
+
+    def test_staff_users(self):
+        user = get_user_model().objects.create_user("ops", password="pw")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(IP_TRACKING_METRICS_ALLOWED_IPS=["10.0.0.0/8"])
+    def test_allowed_ips_ignore_forwarded_for(self):
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.1.2.3").status_code, 200)
+        response = self.client.get("/metrics", REMOTE_ADDR="203.0.113.9", HTTP_X_FORWARDED_FOR="10.1.2.3")
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(IP_TRACKING_METRICS_PUBLIC=True)
+    def test_explicitly_public(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
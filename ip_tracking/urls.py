@@ -9,4 +9,5 @@ urlpatterns = [
     path('test-email/', views.test_email_view, name='test-email'),
     path('suspicious-ips/', views.suspicious_ips_view, name='suspicious-ips'),
     path('request-logs/', views.request_logs_view, name='request-logs'),
+    path('traffic-summary/', views.traffic_summary_view, name='traffic-summary'),
 ]
@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate, login
 from django.core.mail import send_mail
 from django.conf import settings
@@ -11,13 +11,28 @@ from rest_framework import status
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from .tasks import detect_anomalies
-from .models import RequestLog, SuspiciousIP
+from .blocklist import BLOCKLIST_VERSION_KEY, blocklist
+from .findings import FINDINGS_VERSION_KEY, list_findings
+from .iputils import get_trusted_client_ip, ip_in_networks
+from .metrics import render as render_metrics
+from .logquery import (
+    MAX_PAGE_SIZE, InvalidQuery, csv_chunks, decode_cursor, encode_cursor, filter_logs, iter_log_batches,
+    log_page, ndjson_chunks, parse_filters,
+)
+from .models import HourRollup, MinuteRollup
+from .ratelimit import ratelimit
+from .rollups import summarize
+import hashlib
+import hmac
 import json
-# from django_ratelimit.decorators import ratelimit
+from datetime import timedelta
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 
 
-# @ratelimit(key="ip", rate="5/m", method="POST", block=True)  # 🚫 Anonymous users
-# @ratelimit(key="user_or_ip", rate="10/m", method="POST", block=True)  # ✅ Authenticated users
+@ratelimit(key="ip", rate="5/m", method="POST", block=True)  # 🚫 Anonymous users
+@ratelimit(key="user_or_ip", rate="10/m", method="POST", block=True)  # ✅ Authenticated users
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @swagger_auto_schema(
@@ -42,7 +57,8 @@ import json
             )
         ),
         400: 'Invalid credentials',
-        405: 'Method not allowed'
+        405: 'Method not allowed',
+        429: 'Rate limit exceeded'
     }
 )
 def login_view(request):
@@ -50,7 +66,6 @@ def login_view(request):
     A sample login view protected by IP-based rate limiting.
     Anonymous: 5 requests/min
     Authenticated: 10 requests/min
-    Note: Rate limiting temporarily disabled for development
     """
     if request.method == "POST":
         data = request.data if hasattr(request, 'data') else request.POST
@@ -159,10 +174,65 @@ def test_email_view(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+SUSPICIOUS_IPS_CACHE_PREFIX = "ip_tracking:suspicious_ips:"
+
+
+def _suspicious_ips_payload(params):
+    """Build one suspicious-ips page; returns (payload, seconds it stays valid)."""
+    filters = parse_filters({key: params.get(key) for key in ('since', 'until')})
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    try:
+        limit = int(params.get('limit', 20))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise InvalidQuery(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    now = timezone.now()
+    rows, next_cursor = list_findings(params.get('rule') or None, cursor=cursor, limit=limit, now=now, **filters)
+    timeout = getattr(settings, 'IP_TRACKING_SUSPICIOUS_IPS_CACHE_SECONDS', 60)
+    data = []
+    for row in rows:
+        if row["blocked_until"] is not None:
+            # A block ending changes is_blocked without any write.
+            timeout = min(timeout, max(1, int((row["blocked_until"] - now).total_seconds()) + 1))
+        data.append({
+            "ip_address": row["ip_address"],
+            "rule": row["rule"],
+            "window_start": row["window_start"].isoformat(),
+            "hits": row["hits"],
+            "reason": row["reason"],
+            "detected_at": row["detected_at"].isoformat(),
+            "last_seen": row["last_seen"].isoformat(),
+            # Exact BlockedIP entries come from the query; CIDR blocks from the snapshot.
+            "is_blocked": row["is_blocked"] or blocklist.is_blocked(row["ip_address"]),
+            "blocked_until": row["blocked_until"].isoformat() if row["blocked_until"] else None,
+        })
+    payload = {
+        "status": "success",
+        "count": len(data),
+        "next_cursor": encode_cursor(*next_cursor) if next_cursor else None,
+        "suspicious_ips": data
+    }
+    return payload, timeout
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @swagger_auto_schema(
-    operation_description="View suspicious IPs detected by the system",
+    operation_description="Suspicious IPs, most recently detected first, paginated by cursor. Responses carry "
+                          "an ETag and are cached until findings or blocks change.",
+    manual_parameters=[
+        openapi.Parameter('rule', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description='Rule name; a trailing * matches a prefix (sensitive_path:*)'),
+        openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                          description='Last seen at or after'),
+        openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME,
+                          description='Last seen before'),
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description='next_cursor of the previous page'),
+        openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, default=20),
+    ],
     responses={
         200: openapi.Response(
             description='Suspicious IPs retrieved successfully',
@@ -171,42 +241,55 @@ def test_email_view(request):
                 properties={
                     'status': openapi.Schema(type=openapi.TYPE_STRING),
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'next_cursor': openapi.Schema(type=openapi.TYPE_STRING),
                     'suspicious_ips': openapi.Schema(
                         type=openapi.TYPE_ARRAY,
                         items=openapi.Schema(
                             type=openapi.TYPE_OBJECT,
                             properties={
                                 'ip_address': openapi.Schema(type=openapi.TYPE_STRING),
+                                'rule': openapi.Schema(type=openapi.TYPE_STRING),
+                                'window_start': openapi.Schema(type=openapi.TYPE_STRING),
+                                'hits': openapi.Schema(type=openapi.TYPE_INTEGER),
                                 'reason': openapi.Schema(type=openapi.TYPE_STRING),
                                 'detected_at': openapi.Schema(type=openapi.TYPE_STRING),
+                                'last_seen': openapi.Schema(type=openapi.TYPE_STRING),
                                 'is_blocked': openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                                'blocked_until': openapi.Schema(type=openapi.TYPE_STRING),
                             }
                         )
                     ),
                 }
             )
         ),
+        304: 'Not modified (If-None-Match matched the current ETag)',
+        400: 'Invalid rule filter, time range, cursor or limit',
         500: 'Failed to fetch suspicious IPs'
     }
 )
 def suspicious_ips_view(request):
     """View suspicious IPs detected by the system"""
     try:
-        suspicious_ips = SuspiciousIP.objects.all().order_by('-detected_at')[:20]
-        data = []
-        for ip in suspicious_ips:
-            data.append({
-                "ip_address": ip.ip_address,
-                "reason": ip.reason,
-                "detected_at": ip.detected_at.isoformat(),
-                "is_blocked": ip.is_blocked
-            })
-        
-        return Response({
-            "status": "success",
-            "count": len(data),
-            "suspicious_ips": data
-        })
+        versions = cache.get_many([FINDINGS_VERSION_KEY, BLOCKLIST_VERSION_KEY])
+        query = sorted(request.query_params.items())
+        cache_key = SUSPICIOUS_IPS_CACHE_PREFIX + hashlib.md5(json.dumps([
+            versions.get(FINDINGS_VERSION_KEY), versions.get(BLOCKLIST_VERSION_KEY), query
+        ]).encode()).hexdigest()
+        cached = cache.get(cache_key)
+        if cached is None:
+            try:
+                payload, timeout = _suspicious_ips_payload(request.query_params)
+            except InvalidQuery as e:
+                return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            etag = quote_etag(hashlib.md5(json.dumps(payload, sort_keys=True).encode()).hexdigest())
+            cached = (etag, payload)
+            cache.set(cache_key, cached, timeout)
+
+        etag, payload = cached
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(payload, headers=headers)
     except Exception as e:
         return Response({
             "status": "error",
@@ -214,10 +297,30 @@ def suspicious_ips_view(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+LOG_EXPORT_FORMATS = {
+    # format -> (content type, chunk generator)
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'csv': ('text/csv', csv_chunks),
+}
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @swagger_auto_schema(
-    operation_description="View recent request logs",
+    operation_description="Request logs, newest first, paginated by cursor; export=ndjson|csv streams the "
+                          "newest IP_TRACKING_LOG_EXPORT_MAX_ROWS matching rows instead (staff users or "
+                          "Authorization: Bearer <IP_TRACKING_LOG_EXPORT_TOKEN> only)",
+    manual_parameters=[
+        openapi.Parameter('ip', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        openapi.Parameter('path', openapi.IN_QUERY, type=openapi.TYPE_STRING, description='Path prefix'),
+        openapi.Parameter('country', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+        openapi.Parameter('since', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+        openapi.Parameter('until', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATETIME),
+        openapi.Parameter('cursor', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description='next_cursor of the previous page'),
+        openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, default=50),
+        openapi.Parameter('export', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(LOG_EXPORT_FORMATS)),
+    ],
     responses={
         200: openapi.Response(
             description='Request logs retrieved successfully',
@@ -226,46 +329,71 @@ def suspicious_ips_view(request):
                 properties={
                     'status': openapi.Schema(type=openapi.TYPE_STRING),
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER),
+                    'next_cursor': openapi.Schema(type=openapi.TYPE_STRING),
                     'request_logs': openapi.Schema(
                         type=openapi.TYPE_ARRAY,
                         items=openapi.Schema(
                             type=openapi.TYPE_OBJECT,
                             properties={
+                                'id': openapi.Schema(type=openapi.TYPE_INTEGER),
                                 'ip_address': openapi.Schema(type=openapi.TYPE_STRING),
-                                'path': openapi.Schema(type=openapi.TYPE_STRING),
-                                'method': openapi.Schema(type=openapi.TYPE_STRING),
-                                'user_agent': openapi.Schema(type=openapi.TYPE_STRING),
                                 'timestamp': openapi.Schema(type=openapi.TYPE_STRING),
-                                'city': openapi.Schema(type=openapi.TYPE_STRING),
+                                'path': openapi.Schema(type=openapi.TYPE_STRING),
                                 'country': openapi.Schema(type=openapi.TYPE_STRING),
+                                'city': openapi.Schema(type=openapi.TYPE_STRING),
+                                'status_code': openapi.Schema(type=openapi.TYPE_INTEGER),
                             }
                         )
                     ),
                 }
             )
         ),
+        400: 'Invalid filter, cursor, limit or export format',
+        403: 'Export requested without a staff user or the export token',
         500: 'Failed to fetch request logs'
     }
 )
 def request_logs_view(request):
-    """View recent request logs"""
+    """Page through (or export) request logs"""
+    params = request.query_params
+    # Not "format": DRF reserves that parameter for renderer selection.
+    export = params.get('export')
     try:
-        logs = RequestLog.objects.all().order_by('-timestamp')[:50]
-        data = []
-        for log in logs:
-            data.append({
-                "ip_address": log.ip_address,
-                "path": log.path,
-                "method": log.method,
-                "user_agent": log.user_agent,
-                "timestamp": log.timestamp.isoformat(),
-                "city": getattr(log, 'city', 'Unknown'),
-                "country": getattr(log, 'country', 'Unknown')
-            })
-        
+        if export is not None and export not in LOG_EXPORT_FORMATS:
+            raise InvalidQuery(f"export must be one of {list(LOG_EXPORT_FORMATS)}")
+        filters = parse_filters(params)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        try:
+            limit = int(params.get('limit', 50))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise InvalidQuery(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    except InvalidQuery as e:
+        return Response({"status": "error", "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    logs = filter_logs(**filters)
+    if export is not None:
+        if not staff_or_token(request, getattr(settings, "IP_TRACKING_LOG_EXPORT_TOKEN", "")):
+            return Response({
+                "status": "error",
+                "message": "Exports require a staff user or the export token"
+            }, status=status.HTTP_403_FORBIDDEN)
+        max_rows = getattr(settings, "IP_TRACKING_LOG_EXPORT_MAX_ROWS", 100000)
+        content_type, chunks = LOG_EXPORT_FORMATS[export]
+        response = StreamingHttpResponse(
+            chunks(iter_log_batches(logs, max_rows=max_rows)), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="request-logs.{export}"'
+        response['X-Export-Max-Rows'] = str(max_rows)
+        return response
+
+    try:
+        data, next_cursor = log_page(logs, cursor, limit)
         return Response({
             "status": "success",
             "count": len(data),
+            "next_cursor": next_cursor,
             "request_logs": data
         })
     except Exception as e:
@@ -274,3 +402,117 @@ def request_logs_view(request):
             "message": f"Failed to fetch request logs: {str(e)}"
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+SUMMARY_PERIODS = {
+    # period -> (rollup table, length)
+    'hour': (MinuteRollup, timedelta(hours=1)),
+    'day': (HourRollup, timedelta(days=1)),
+    'week': (HourRollup, timedelta(days=7)),
+}
+SUMMARY_GROUPS = {'ip': 'ip_address', 'country': 'country', 'path': 'path'}
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@swagger_auto_schema(
+    operation_description="Top IPs, countries or paths by request count, read from the traffic rollups",
+    manual_parameters=[
+        openapi.Parameter('period', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(SUMMARY_PERIODS), default='hour'),
+        openapi.Parameter('by', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          enum=list(SUMMARY_GROUPS), default='ip'),
+        openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, default=50),
+    ],
+    responses={
+        200: openapi.Response(
+            description='Traffic summary retrieved successfully',
+            schema=openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING),
+                    'period': openapi.Schema(type=openapi.TYPE_STRING),
+                    'by': openapi.Schema(type=openapi.TYPE_STRING),
+                    'summary': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        items=openapi.Schema(
+                            type=openapi.TYPE_OBJECT,
+                            properties={
+                                'key': openapi.Schema(type=openapi.TYPE_STRING),
+                                'requests': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                'errors': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            }
+                        )
+                    ),
+                }
+            )
+        ),
+        400: 'Invalid period, by or limit',
+        500: 'Failed to fetch traffic summary'
+    }
+)
+def traffic_summary_view(request):
+    """Top talkers from MinuteRollup (last hour) or HourRollup (last day/week)"""
+    period = request.query_params.get('period', 'hour')
+    by = request.query_params.get('by', 'ip')
+    try:
+        limit = min(int(request.query_params.get('limit', 50)), 500)
+    except ValueError:
+        limit = None
+    if period not in SUMMARY_PERIODS or by not in SUMMARY_GROUPS or not limit or limit < 1:
+        return Response({
+            "status": "error",
+            "message": f"period must be one of {list(SUMMARY_PERIODS)}, by one of {list(SUMMARY_GROUPS)}, "
+                       "limit a positive integer"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        model, length = SUMMARY_PERIODS[period]
+        field = SUMMARY_GROUPS[by]
+        rows = summarize(model, timezone.now() - length, field, limit)
+        return Response({
+            "status": "success",
+            "period": period,
+            "by": by,
+            "summary": [
+                {"key": row[field], "requests": row["requests"], "errors": row["errors"]}
+                for row in rows
+            ]
+        })
+    except Exception as e:
+        return Response({
+            "status": "error",
+            "message": f"Failed to fetch traffic summary: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def staff_or_token(request, token):
+    """Whether `request` comes from a staff user or carries `Authorization: Bearer <token>`."""
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    user = getattr(request, "user", None)
+    return user is not None and user.is_active and user.is_staff
+
+
+def metrics_allowed(request):
+    """
+    Whether `request` may read /metrics: it carries the bearer token, comes
+    from a staff user or from IP_TRACKING_METRICS_ALLOWED_IPS, or the
+    endpoint was opened with IP_TRACKING_METRICS_PUBLIC.
+    """
+    if getattr(settings, "IP_TRACKING_METRICS_PUBLIC", False):
+        return True
+    if staff_or_token(request, getattr(settings, "IP_TRACKING_METRICS_TOKEN", "")):
+        return True
+    allowed = getattr(settings, "IP_TRACKING_METRICS_ALLOWED_IPS", ())
+    return bool(allowed) and ip_in_networks(get_trusted_client_ip(request), allowed)
+
+
+def metrics_view(request):
+    """Prometheus text-format metrics, summed over every worker process"""
+    if not metrics_allowed(request):
+        if getattr(settings, "IP_TRACKING_METRICS_TOKEN", ""):
+            response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+            response["WWW-Authenticate"] = "Bearer"
+            return response
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")